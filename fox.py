@@ -14,9 +14,13 @@ Description: Fox is a companion tool for BloodHound. Its intended purpose is to
 
 from neo4j.v1 import GraphDatabase
 import os
+import sys
+import json
 import click
+import contextlib
 from colors import red, green, yellow
-from lib import users, groups, domains, helpers
+from lib import users, groups, domains, helpers, paths, queries, cache, simulate, profiling, \
+    synthetic, bench, export, plans, progress, report, service, snapshot, vectorized
 
 
 # Setup a class for CLICK
@@ -43,21 +47,80 @@ class AliasedGroup(click.Group):
 
 # That's right, we support -h and --help! Not using -h for an argument like 'host'! ;D
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
-@click.command(context_settings=CONTEXT_SETTINGS)
+# Commands that do not need the Neo4j connection or an offline collection
+STANDALONE_COMMANDS = ("generate", "bench", "plancheck")
+# Commands that can be answered by a running Fox service
+SERVICE_COMMANDS = ("metric",)
+# Commands that print JSON, so everything else they print goes to stderr
+JSON_COMMANDS = ("metric",)
+@click.group(cls=AliasedGroup, context_settings=CONTEXT_SETTINGS, invoke_without_command=True)
 
 # Declare our CLI options
 @click.option('-d', '--domain', help="The Active Directory domain to use for Cypher \
 queries.", required=False)
-@click.option('--pass-age', help="Password age (in months) to look for with PwdLastset. Default \
-to 6 months.", required=False, type=int, default=6)
+@click.option('--pass-age', help="Password age (in months) to look for with PwdLastset. Repeat \
+to report several thresholds at once. Default to 6 months.", required=False, type=int,
+              multiple=True, default=[6])
+@click.option('--age-buckets', help="Comma separated edges (in months) of the password age \
+histogram. Default to 3,6,12.", required=False, default="3,6,12")
+@click.option('--offline', help="Path to a SharpHound ZIP, a directory of its JSON files, a \
+single JSON file, or a Fox snapshot to analyze in-process instead of connecting to Neo4j.",
+              required=False, type=click.Path(exists=True))
+@click.option('--now', help="Measure password ages from this time, in seconds since the \
+epoch, instead of the current time -- for example the --now a synthetic dataset was generated \
+at.", required=False, type=int)
+@click.option('--max-nesting', help="Maximum number of nested group levels to unroll when \
+calculating effective group membership. Default is unlimited.", required=False, type=int)
+@click.option('-w', '--workers', help="Number of queries to run in parallel over the driver's \
+connection pool. Default to 1 (one query at a time).", required=False, type=click.IntRange(1),
+              default=1)
+@click.option('--details', help="Also fetch and print the full lists behind the summary counts, \
+like GPOs, OUs blocking inheritance, computers with unconstrained delegation, and users with \
+old passwords.", is_flag=True)
+@click.option('--export', 'export_path', help="Stream the full results behind the report to this \
+path as they are collected: a directory of CSV files, a .jsonl file, or an .xlsx workbook.",
+              required=False, type=click.Path())
+@click.option('--export-format', help="Format for --export when the path's extension does not \
+say. Default to CSV.", required=False, type=click.Choice(["csv", "jsonl", "xlsx"]))
+@click.option('--no-cache', help="Do not read or store cached results. By default results are \
+cached on disk and reused while the dataset is unchanged.", is_flag=True)
+@click.option('--refresh', help="Recompute every result and replace what is in the cache.",
+              is_flag=True)
+@click.option('--profile', help="Time every query and report its rows, bytes, and (with Neo4j) \
+database hits and operators. Cached results are not profiled.", is_flag=True)
+@click.option('--trace-file', help="Where to write the JSON trace for --profile. Default to \
+fox_profile.json.", required=False, default="fox_profile.json", type=click.Path())
+@click.option('--preflight', help="Check every query's plan and the indexes Fox relies on \
+before running the report. Use the preflight command to create missing indexes.", is_flag=True)
+@click.option('--approximate', help="Estimate the paths to Domain Admin from a sample of users \
+and computers, refining the estimate for up to this many seconds per domain, instead of \
+searching every path.", required=False, type=click.FloatRange(0, min_open=True))
+@click.option('--vectorize', help="Pull users, computers, groups, and group membership in a few \
+bulk queries and compute the domain summaries, average group membership, and password ages \
+with NumPy instead of a query per domain.", is_flag=True)
+@click.option('--service', 'service_url', help="Ask the Fox service running at this URL (like \
+http://127.0.0.1:8421) for the report or metric instead of connecting to the database.",
+              required=False)
+@click.option('--partial-file', help="Where to write the finished results as JSON if the run is \
+interrupted with Ctrl-C. Default to fox_partial.json.", required=False,
+              default="fox_partial.json", type=click.Path())
 
-def fox(domain, pass_age):
+@click.pass_context
+def fox(ctx, domain, pass_age, age_buckets, offline, now, max_nesting, workers, details,
+        export_path, export_format, no_cache, refresh, profile, trace_file, preflight,
+        approximate, vectorize, service_url, partial_file):
     """
     Welcome to Fox! Before using Fox, start your Neo4j project containing your
     BloodHound data. Please review the README for details for the modules and queries.\n
-    Let's crunch some BloodHound data!
+    Let's crunch some BloodHound data! Run Fox without a command for the full report.
     """
-    click.clear()
+    # Keep stdout for the JSON of commands that print it, so it can be piped to a parser
+    stdout = sys.stdout
+    if ctx.invoked_subcommand and \
+            fox.get_command(ctx, ctx.invoked_subcommand).name in JSON_COMMANDS:
+        ctx.with_resource(contextlib.redirect_stdout(sys.stderr))
+    else:
+        click.clear()
     print(green("""
   █████▒▒█████  ▒██   ██▒
 ▓██   ▒▒██▒  ██▒▒▒ █ █ ▒░
@@ -71,196 +134,343 @@ def fox(domain, pass_age):
 \t\t  v.0.2
     """))
 
+    try:
+        age_buckets = [int(months) for months in age_buckets.split(",") if months.strip()]
+    except ValueError:
+        print(red("[X] The --age-buckets option expects numbers separated by commas, like 3,6,12."))
+        exit()
+
+    # A running service already holds the connection and the results, so just ask it
+    if service_url:
+        if ctx.invoked_subcommand is None:
+            print(service.fetch_report(service_url, domain, pass_age, age_buckets, details,
+                                       approximate), end="")
+            return
+        if fox.get_command(ctx, ctx.invoked_subcommand).name not in SERVICE_COMMANDS:
+            print(red("[X] Only the report and the metric command can be sent to the Fox \
+service."))
+            exit()
+        ctx.obj = {"service": service_url, "domain": domain, "pass_age": pass_age,
+                   "age_buckets": age_buckets, "stdout": stdout}
+        return
+
+    # Generating and benchmarking data set up their own graphs, so skip the connection
+    if ctx.invoked_subcommand and \
+            fox.get_command(ctx, ctx.invoked_subcommand).name in STANDALONE_COMMANDS:
+        ctx.obj = {"domain": domain, "workers": workers}
+        return
+
+    if vectorize and vectorized.numpy is None:
+        print(red("[X] The --vectorize option requires NumPy -- install it with pip3 install \
+numpy, or run Fox without it."))
+        exit()
+
     # Setup the DB connection and metrics objects
-    neo4j_driver = helpers.setup_database_conn()
-    domain_metrics = domains.DomainData(neo4j_driver)
-    group_metrics = groups.GroupMetrics(neo4j_driver)
-    users_metrics = users.UserMetrics(neo4j_driver)
+    if offline:
+        neo4j_driver = helpers.setup_offline_graph(offline)
+        source = os.path.abspath(offline)
+    else:
+        neo4j_driver = helpers.setup_database_conn()
+        if workers > neo4j_driver.settings["max_pool_size"]:
+            print(yellow("[!] There are more workers than pooled connections, so some workers \
+will wait for a connection -- raise max_pool_size in database.config."))
+        queries.prewarm(neo4j_driver)
+        source = helpers.config_section_map("Database")["uri"]
+        if preflight and ctx.invoked_subcommand is None:
+            plans.preflight(neo4j_driver)
+    if profile:
+        # Report the profile once the report or command is done, however it finishes
+        profiling.profiler.enable()
+        ctx.call_on_close(lambda: profiling.profiler.write_trace(trace_file, source))
+        ctx.call_on_close(profiling.profiler.print_report)
+    result_cache = None
+    if not no_cache:
+        result_cache = cache.ResultCache(neo4j_driver, source, refresh=refresh,
+                                          max_nesting=max_nesting)
+    domain_metrics = domains.DomainData(neo4j_driver, max_nesting)
+    group_metrics = groups.GroupMetrics(neo4j_driver, max_nesting)
+    users_metrics = users.UserMetrics(neo4j_driver, max_nesting, now)
     all_domains = helpers.prepare_domains_list(domain_metrics, domain)
-    # A few variables we need for tracking some numbers across domains
-    super_total_users = 0
-    super_total_enabled_users = 0
-    super_total_computers = 0
-    
-    for domain in all_domains:
-        # We may get a 'None' domain if the label is missing in BloodHound
+    # Commands get the connection and the domains to work on instead of the full report
+    if ctx.invoked_subcommand:
+        ctx.obj = {"driver": neo4j_driver, "offline": bool(offline), "domain": domain,
+                   "domain_metrics": domain_metrics, "all_domains": all_domains,
+                   "workers": workers, "cache": result_cache, "max_nesting": max_nesting,
+                   "pass_age": pass_age, "age_buckets": age_buckets, "vectorize": vectorize,
+                   "stdout": stdout}
+        return
+    vector_metrics = None
+    if vectorize:
+        vector_metrics = vectorized.VectorMetrics(neo4j_driver, max_nesting, now)
+    # Queue up every independent query for every domain, so they can all be sent at once
+    tasks = report.report_tasks(all_domains, domain_metrics, group_metrics, users_metrics,
+                                pass_age, age_buckets, details, approximate, vector_metrics)
+
+    # Exports stream their rows to disk alongside the rest of the queries
+    exporter = None
+    if export_path:
+        exporter = export.open_exporter(export_path, export_format)
+        for domain in all_domains:
+            if domain:
+                tasks.extend(export.export_tasks(exporter, domain.upper(), domain_metrics,
+                                                 group_metrics, users_metrics, pass_age))
+
+    print(green("[+] Running %s queries with %s worker(s), including paths to Domain Admin -- \
+this can take some time..." % (len(tasks), workers)))
+    # Each domain's section is printed as soon as all of its queries are done
+    report_progress = progress.ReportProgress(all_domains, tasks, workers, source)
+    report_progress.start()
+    try:
+        results = helpers.run_tasks(tasks, workers, result_cache, report_progress)
+    except KeyboardInterrupt:
+        report_progress.interrupt(partial_file)
+        if exporter:
+            exporter.close()
+        ctx.close()
+        sys.stdout.flush()
+        # Queries that are already running cannot be stopped, so leave without waiting for them
+        os._exit(130)
+    report_progress.finish()
+    if exporter:
+        exporter.close()
+        exported = sum(value for (_, name), value in results.items()
+                       if name.startswith("export."))
+        print(green("[+] Exported %s rows to %s." % (exported, export_path)))
+    if not offline:
+        neo4j_driver.print_stats()
+    if result_cache:
+        result_cache.print_stats()
+
+
+@fox.command("simulate", context_settings=CONTEXT_SETTINGS)
+@click.argument('candidates', type=click.File('r'))
+@click.option('--combined', help="Also report every candidate applied together.", is_flag=True)
+@click.pass_obj
+def simulate_fixes(obj, candidates, combined):
+    """
+    Rank candidate fixes by how much they cut the paths to Domain Admin. CANDIDATES is a file
+    with one fix per line, using "remove-edge SOURCE -[RELATIONSHIP]-> TARGET", "remove-member
+    MEMBER -> GROUP", or "disable ACCOUNT". Separate several changes with ; to try them
+    together.
+    """
+    try:
+        candidates = simulate.parse_candidates(candidates)
+    except ValueError as error:
+        print(red("[X] Could not read the candidate fixes."))
+        print(red("L.. Details: {}".format(error)))
+        exit()
+    if combined:
+        candidates.append(("(all of the above)",
+                           [change for _, changes in candidates for change in changes]))
+
+    domain_metrics = obj["domain_metrics"]
+    tasks = []
+    for domain in obj["all_domains"]:
         if domain:
-            # Neo4j will expect domain names to match what it has in the database, so must be all uppercase
             domain = domain.upper()
+            tasks.extend([
+                (domain, "summary", domain_metrics.get_domain_summary, (domain,),
+                 domains.DomainSummary(domain)),
+                (domain, "path_stats", domain_metrics.get_da_path_stats, (domain,),
+                 paths.PathStats(domain, None, {}, [])),
+            ])
+    print(green("[+] Loading the paths to Domain Admin -- this can take some time..."))
+    results = helpers.run_tasks(tasks, obj["workers"], obj["cache"])
+
+    for domain in obj["all_domains"]:
+        if domain:
+            domain = domain.upper()
+            summary = results[(domain, "summary")]
+            simulation = simulate.Simulation(results[(domain, "path_stats")])
             print(green("\n[+] Domain: %s" % domain))
+            print(green("Users with path to a Domain Admin:\t\t%s (%s %%)"
+                         % (simulation.count("User"),
+                            simulation.percentage("User", summary.total_users))))
+            print(green("Average path length:\t\t\t\t%s" % _format_average(simulation.average())))
+            print(green("Machines with path to Domain Admin:\t\t%s" % simulation.count("Computer")))
+            print(green("Candidate fixes, best first (users, average path length, machines):"))
+            for description, users_left, average, computers_left in simulation.rank(candidates):
+                percentage = 0
+                if summary.total_users:
+                    percentage = 100.0 * users_left / summary.total_users
+                print(yellow("\t%s (%.1f %%)\t%s\t%s\t%s"
+                             % (users_left, percentage, _format_average(average),
+                                computers_left, description)))
+
+
+@fox.command("preflight", context_settings=CONTEXT_SETTINGS)
+@click.option('--create-indexes', help="Create the indexes Fox relies on that are missing, after \
+asking for confirmation, and compare the estimated rows before and after.", is_flag=True)
+@click.option('-y', '--yes', help="Do not ask before creating the indexes.", is_flag=True)
+@click.pass_obj
+def preflight_check(obj, create_indexes, yes):
+    """
+    Run every Fox query with EXPLAIN and flag the ones that scan every node, filter a label scan,
+    or build a cartesian product, and list the lookups Fox uses that have no index.
+    """
+    if obj["offline"]:
+        print(yellow("[!] The offline backend has no query plans or indexes to check -- run the \
+preflight against your Neo4j database instead."))
+        return
+    confirm = None if yes else click.confirm
+    plans.preflight(obj["driver"], create_indexes, confirm)
+
+
+@fox.command("serve", context_settings=CONTEXT_SETTINGS)
+@click.option('--host', help="Address to listen on. Default to 127.0.0.1 (this machine only).",
+              default=service.DEFAULT_HOST)
+@click.option('--port', help="Port to listen on. Default to 8421.", type=click.IntRange(1, 65535),
+              default=service.DEFAULT_PORT)
+@click.pass_obj
+def serve(obj, host, port):
+    """
+    Keep the database connection and every computed result in memory and answer report and
+    metric requests over HTTP. Run Fox with --service to ask it for a report.
+    """
+    fox_service = service.FoxService(obj["driver"], obj["max_nesting"], obj["workers"],
+                                     obj["cache"], obj["vectorize"])
+    service.serve(fox_service, host, port)
+
+
+@fox.command("metric", context_settings=CONTEXT_SETTINGS)
+@click.argument('name')
+@click.pass_obj
+def metric(obj, name):
+    """
+    Print a single metric, like da_sessions or path_stats, as JSON for every domain (or the one
+    given with -d). With --service the metric comes from the running Fox service.
+    """
+    if "service" in obj:
+        results = service.fetch_metric(obj["service"], name, obj["domain"], obj["pass_age"],
+                                       obj["age_buckets"])
+    else:
+        fox_service = service.FoxService(obj["driver"], obj["max_nesting"], obj["workers"],
+                                         obj["cache"], obj["vectorize"])
+        try:
+            results = fox_service.metric(name, obj["domain"], obj["pass_age"], obj["age_buckets"])
+        except KeyError as error:
+            print(red("[X] {}".format(str(error).strip("'\""))))
+            exit()
+    print(json.dumps(results, indent=2, default=service.encode), file=obj["stdout"])
+
+
+@fox.command("snapshot", context_settings=CONTEXT_SETTINGS)
+@click.argument('output', type=click.Path())
+@click.pass_obj
+def write_snapshot(obj, output):
+    """
+    Write the whole dataset to OUTPUT as a compact binary snapshot. Pass the snapshot to
+    --offline to run Fox against it without loading anything up front.
+    """
+    graph = obj["driver"]
+    if isinstance(graph, snapshot.SnapshotGraph):
+        print(yellow("[!] {} is already a snapshot.".format(graph.path)))
+        return
+    if not obj["offline"]:
+        print(yellow("[!] Pulling every node and relationship from Neo4j -- this can take some \
+time..."))
+        graph = snapshot.build_graph(helpers.stream_query(graph, "snapshot.nodes"),
+                                     helpers.stream_query(graph, "snapshot.edges"))
+    try:
+        snapshot.write_snapshot(graph, output)
+    except OSError as error:
+        print(red("[X] Could not write the snapshot to {}.".format(output)))
+        print(red("L.. Details: {}".format(error)))
+        exit()
+    print(green("[+] Wrote {} objects to the snapshot at {}.".format(len(graph), output)))
+
+
+@fox.command("generate", context_settings=CONTEXT_SETTINGS)
+@click.argument('output', type=click.Path())
+@click.option('--objects', help="Roughly how many objects to generate. Default to 10000.",
+              type=click.IntRange(1), default=10000)
+@click.option('--domains', 'domain_count', help="Number of domains to spread the objects \
+across. Default to 2.", type=click.IntRange(1), default=2)
+@click.option('--seed', help="Seed for the generator; the same seed always produces the same \
+data. Default to 1.", type=int, default=1)
+@click.option('--now', help="The time, in seconds since the epoch, the data is generated at. \
+Password ages are worked out from it. Default to 1577836800 (2020-01-01).", type=int,
+              default=synthetic.EPOCH)
+def generate(output, objects, domain_count, seed, now):
+    """
+    Write a synthetic SharpHound ZIP to OUTPUT for testing and benchmarking. The ZIP can be
+    analyzed with --offline or imported into BloodHound.
+    """
+    print(yellow("[!] Generating {} objects across {} domain(s) with seed {}."
+                 .format(objects, domain_count, seed)))
+    synthetic.SyntheticDataset(objects, domain_count, seed, now).write(output)
+    print(green("[+] Wrote the synthetic collection to {}.".format(output)))
+
+
+@fox.command("bench", context_settings=CONTEXT_SETTINGS)
+@click.option('--sizes', help="Comma separated dataset sizes (in objects) to benchmark. \
+Default to 1000,10000,100000,1000000.", default="1000,10000,100000,1000000")
+@click.option('--domains', 'domain_count', help="Number of domains in each synthetic dataset. \
+Default to 2.", type=click.IntRange(1), default=2)
+@click.option('--seed', help="Seed for the synthetic datasets. Default to 1.", type=int,
+              default=1)
+@click.option('--repeat', help="Run each method this many times and keep the best. Default \
+to 1.", type=click.IntRange(1), default=1)
+@click.option('--neo4j', 'use_neo4j', help="Benchmark the database in database.config instead \
+of synthetic data.", is_flag=True)
+@click.option('-o', '--output', help="Where to write the JSON results. Default to \
+fox_bench.json.", type=click.Path(), default="fox_bench.json")
+@click.option('--now', help="The time, in seconds since the epoch, the synthetic datasets are \
+generated at. Default to 1577836800 (2020-01-01).", type=int, default=synthetic.EPOCH)
+@click.pass_obj
+def benchmark(obj, sizes, domain_count, seed, repeat, use_neo4j, output, now):
+    """
+    Time every DomainData, GroupMetrics, and UserMetrics method against synthetic datasets of
+    increasing size, or against your Neo4j database, and write the results as JSON.
+    """
+    try:
+        sizes = [int(size) for size in sizes.split(",") if size.strip()]
+    except ValueError:
+        print(red("[X] The --sizes option expects numbers separated by commas, like 1000,10000."))
+        exit()
+    driver = None
+    if use_neo4j:
+        driver = helpers.setup_database_conn()
+    report = bench.run(sizes, seed, domain_count, repeat, driver, obj["domain"], now)
+    bench.print_report(report)
+    bench.write_report(report, output)
+
+
+@fox.command("plancheck", context_settings=CONTEXT_SETTINGS)
+@click.option('--baseline', help="The JSON file with the estimated rows from an earlier \
+check. Default to plan_baseline.json.", type=click.Path(), default=plans.BASELINE_FILE)
+@click.option('--update-baseline', help="Record the current estimates as the new baseline \
+instead of comparing against it.", is_flag=True)
+@click.option('--tolerance', help="How far, as a fraction, a query's estimated rows may grow \
+past the baseline. Default to 0.2.", type=click.FloatRange(0), default=plans.ROW_TOLERANCE)
+@click.option('--load-fixture', help="Load a small synthetic graph into the database in \
+database.config first. The database must be empty.", is_flag=True)
+@click.option('--objects', help="Roughly how many objects the fixture has. Default to 2000.",
+              type=click.IntRange(1), default=plans.FIXTURE_OBJECTS)
+@click.option('--seed', help="Seed for the fixture. Default to 1.", type=int, default=1)
+def plan_check(baseline, update_baseline, tolerance, load_fixture, objects, seed):
+    """
+    Run every Fox query with EXPLAIN against a Neo4j database holding the plan fixture, and
+    exit with an error if a plan scans every node, filters a label scan, or builds a cartesian
+    product, or if its estimated rows grew past the baseline.
+    """
+    driver = helpers.setup_database_conn()
+    passed = True
+    if load_fixture:
+        graph = synthetic.SyntheticDataset(objects, plans.FIXTURE_DOMAINS, seed).graph()
+        passed = plans.load_fixture(driver, graph)
+    if passed:
+        passed = plans.check_regressions(driver, baseline, update_baseline, tolerance)
+    driver.close()
+    if not passed:
+        exit(1)
+
 
-            # Collect session info
-            print(green("[+] Collecting session data..."))
-            da_sessions = domain_metrics.get_systems_with_da(domain)
-            
-            # Calculations for group membership
-            print(green("[+] Collecting group membership information..."))
-            avg_membership_nonrecur = group_metrics.get_avg_group_membership(domain)
-            avg_membership_recur = group_metrics.get_avg_group_membership(domain, True)
-            dadmins, eadmins, admins = group_metrics.get_admin_groups(domain)
-            admin_groups = group_metrics.find_admin_groups(domain)
-            local_admin = group_metrics.find_local_admin_groups(domain)
-            rdp_users = group_metrics.find_remote_desktop_users(domain)
-            foreign_groups = group_metrics.find_foreign_group_membership(domain)
-            
-            # Collect user object info
-            print(green("[+] Collecting user and computer object information..."))
-            total_users = users_metrics.get_total_users(domain)
-            total_enabled_users = users_metrics.get_total_users(domain, True)
-            total_computers = users_metrics.get_total_computers(domain)
-            unc_deleg_computers = users_metrics.find_unconstrained_delegation(domain)
-            
-            # Calculations for user objects
-            super_total_users += total_users
-            super_total_enabled_users += total_enabled_users
-            super_total_computers = super_total_computers + total_computers
-            
-            # Path to DA calculations
-            print(green("[+] Calculating paths to Domain Admin and averages -- this can take \
-some time..."))
-            total_paths = domain_metrics.get_all_da_paths(domain)
-            avg_path = domain_metrics.avg_path_length(domain)
-            try:
-                percentage_users_path_to_da = 100.0 * (total_paths/total_users)
-            except:
-                percentage_users_path_to_da = 0
-            try:
-                percentage_comps_path_to_da = 100.0 * (total_paths/total_computers)
-            except:
-                percentage_comps_path_to_da = 0
-
-            # Other statistics and data
-            print(green("[+] Querying some additional interesting data... nearly done..."))
-            gpo_list = domain_metrics.get_all_gpos(domain)
-            operating_systems = domain_metrics.get_operating_systems(domain)
-            old_passwords = users_metrics.find_old_pwdlastset(domain, pass_age)
-            special_users = users_metrics.find_special_users(domain)
-            da_spn = users_metrics.find_da_spn(domain)
-            foreign_groups = users_metrics.find_foreign_group_membership(domain)
-            blocker_ous = domain_metrics.find_blocked_inheritance(domain)
-
-            # Review the data to see if we can detect any missing labels/data and try to name
-            # CollectionMethod types that are missing from the database
-            warning_count = 0
-            print(yellow("\n[!] WARNINGS for %s:" % domain))
-            if len(gpo_list) == 0:
-                warning_count += 1
-                print(yellow("[*] There are zero GPOs for this domain!"))
-                print(yellow("L.. Missing CollectionMethod: GPO"))
-            if total_enabled_users == 0:
-                warning_count += 1
-                print(yellow("[*] There are no user objects with the Enabled attribute!"))
-                print(yellow("L.. Missing CollectionMethod: ObjectProps"))
-            if not operating_systems:
-                warning_count += 1
-                print(yellow("[*] There are no computer objects with the operating system attribute!"))
-                print(yellow("L.. Missing CollectionMethod: ObjectProps"))
-            if not avg_membership_nonrecur:
-                warning_count += 1
-                print(red("[X] Cannot pull group membership data!"))
-                print(red("L.. Data for this domain is too incomplete and will be skipped."))
-                continue
-            if warning_count == 0:
-                print(green("\tNone! BloodHound data looks good!\n"))
-
-            # Report domain-related data
-            if len(gpo_list) > 0:
-                print(green("Number of GPOs:\t%s" % len(gpo_list)))
-            if blocker_ous:
-                print(green("OUs blockiung inheritance:"))
-                for ou in blocker_ous:
-                    print(yellow("\t%s" % ou))
-            if operating_systems:
-                print(green("Operating Systems seen in domain:"))
-                for key, value in operating_systems.items():
-                    print(yellow("\t%s\t%s" % (value, key)))
-            print(green("Domain Admins tied to SPNs:"))
-            if len(da_spn):
-                for account in da_spn:
-                    print(yellow("\t%s" % account))
-            else:
-                print(green("\tNone! :D"))
-
-            # Report session data
-            print(green("Systems that are not Domain Controllers with Domain Admin sessions:"))
-            if da_sessions:
-                for session in da_sessions:
-                    print(yellow("\t%s" % session))
-            else:
-                print(green("\tNone! :D"))
-
-            # Report group-related data
-            print(green("Average group membership:\t\t\t%s" % avg_membership_nonrecur))
-            print(green("Average recursive group membership:\t\t%s" % avg_membership_recur))
-            print(green("Nested groups increased membership by:\t\t%s"
-                         % float(avg_membership_recur-avg_membership_nonrecur)))
-            print(green("Domain Admins:"))
-            for user in dadmins:
-                print(yellow("\t%s" % user))
-            print(green("Enterprise Admins:"))
-            for user in eadmins:
-                print(yellow("\t%s" % user))
-            print(green("Administrators:"))
-            for user in admins:
-                print(yellow("\t%s" % user))
-            print(green("Other ADMIN groups:"))
-            for group in admin_groups:
-                print(yellow("\t%s" % group))
-            print(green("Non-Admin groups with Local Admin:"))
-            if local_admin:
-                for group in local_admin:
-                    print(yellow("\t%s" % group))
-            else:
-                print(green("\tNone! :D"))
-            print(green("REMOTE DESKTOP USERS members:"))
-            for member in rdp_users:
-                if "DOMAIN USERS" in member:
-                    print(red("\t--> %s" % member))
-                else:
-                    print(yellow("\t%s" % member))
-            if foreign_groups:
-                print(green("Groups with foregin group membership:"))
-                for group,foreign_group in foreign_groups.items():
-                    print(yellow("\t%s -> %s" % (group, foreign_group)))
-
-            # Report user statistics
-            print(green("Total users:\t\t\t\t\t%s" % total_users))
-            print(green("Total enabled users:\t\t\t\t%s (%s disabled)"
-                         % (total_enabled_users, total_users-total_enabled_users)))
-            print(green("Users with passwords older than %s months:\t%s"
-                         % (pass_age, len(old_passwords))))
-            print(green("Total computers:\t\t\t\t%s" % total_computers))
-            print(green("Potentially privileged accounts:"))
-            for account in special_users:
-                print(yellow("\t%s" % account))
-            print(green("Users with foregin group membership:"))
-            if foreign_groups:
-                for account,group in foreign_groups.items():
-                    print(yellow("\t%s -> %s" % (account, group)))
-            else:
-                print(green("\tNone!"))
-
-            # Report on computer objects
-            print(green("Computers with Unconstrained Delegation:"))
-            if unc_deleg_computers:
-                for computer in unc_deleg_computers:
-                    print(yellow("\t%s" % computer))
-            else:
-                print(green("\tNone! :D"))
-
-            # Report on paths
-            print(green("Total paths:\t\t\t\t\t%s" % total_paths))
-            print(green("Average path length:\t\t\t\t%s" % avg_path))
-            print(green("Users with path to a Domain Admin:\t\t%s %%"
-                         % percentage_users_path_to_da))
-            print(green("Machines with path to Domain Admin:\t\t%s %%"
-                         % percentage_comps_path_to_da))
-
-    # Report totals across domains
-    print(green("\n[+] Totals for all domains in dataset:"))
-    print(green("Total users across domains:\t\t\t%s" % super_total_users))
-    print(green("Total enabled users across domains:\t\t%s" % super_total_enabled_users))
-    print(green("Total computers across domains:\t\t\t%s" % super_total_computers))
+def _format_average(average):
+    """Format an average path length for the simulation output."""
+    if average is None:
+        return None
+    return "%.2f" % average
 
 
 if __name__ == "__main__":
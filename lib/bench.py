@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the benchmark harness. It times every DomainData, GroupMetrics,
+UserMetrics, and VectorMetrics method against synthetic datasets of increasing size (or against
+the configured Neo4j database) and returns the timings in a form that can be written out as JSON
+and compared across versions of Fox.
+"""
+
+import json
+import time
+import platform
+from colors import red, green, yellow
+from lib import classify, domains, groups, membership, offline, rights, sessions, synthetic, \
+    users, vectorized
+
+# Every metric method as (class, method, extra arguments after the domain). Methods that do not
+# take a domain have None for their arguments.
+BENCHMARKS = (
+    ("DomainData", "get_all_domains", None),
+    ("DomainData", "get_domain_summary", ()),
+    ("DomainData", "get_da_path_stats", ()),
+    ("DomainData", "get_all_da_paths", ()),
+    ("DomainData", "avg_path_length", ()),
+    ("DomainData", "get_systems_with_da", ()),
+    ("DomainData", "get_privileged_sessions", ()),
+    ("DomainData", "count_local_admins", ()),
+    ("DomainData", "get_most_exposed_computers", ()),
+    ("DomainData", "get_operating_systems", ()),
+    ("DomainData", "get_all_gpos", ()),
+    ("DomainData", "find_blocked_inheritance", ()),
+    ("GroupMetrics", "get_avg_group_membership", ()),
+    ("GroupMetrics", "get_avg_group_membership", (True,)),
+    ("GroupMetrics", "get_admin_groups", ()),
+    ("GroupMetrics", "find_admin_groups", ()),
+    ("GroupMetrics", "find_local_admin_groups", ()),
+    ("GroupMetrics", "get_group_reach", ()),
+    ("GroupMetrics", "find_foreign_group_membership", ()),
+    ("GroupMetrics", "get_foreign_domains", ()),
+    ("GroupMetrics", "find_remote_desktop_users", ()),
+    ("UserMetrics", "get_total_users", ()),
+    ("UserMetrics", "get_total_computers", ()),
+    ("UserMetrics", "find_da_spn", ()),
+    ("UserMetrics", "find_unconstrained_delegation", ()),
+    ("UserMetrics", "find_old_pwdlastset", ()),
+    ("UserMetrics", "get_password_ages", ()),
+    ("UserMetrics", "find_special_users", ()),
+    ("UserMetrics", "find_special_computers", ()),
+    ("UserMetrics", "find_foreign_group_membership", ()),
+    ("VectorMetrics", "get_domain_summary", ()),
+    ("VectorMetrics", "get_avg_group_membership", ()),
+    ("VectorMetrics", "get_avg_group_membership", (True,)),
+    ("VectorMetrics", "get_password_ages", ()),
+)
+
+# The dataset sizes benchmarked by default, in objects
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+
+
+def _metrics(driver, max_depth=None, now=None):
+    """Return fresh metrics objects, so no method benefits from another one's cached work."""
+    return {
+        "DomainData": domains.DomainData(driver, max_depth),
+        "GroupMetrics": groups.GroupMetrics(driver, max_depth),
+        "UserMetrics": users.UserMetrics(driver, max_depth, now),
+        "VectorMetrics": vectorized.VectorMetrics(driver, max_depth, now),
+    }
+
+
+def _size(result):
+    """Return the number of items in a result, or None for single values."""
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+def time_methods(driver, domain, repeat=1, max_depth=None, now=None):
+    """Time every benchmarked method against the domain. Each run starts from empty caches,
+    including an offline graph's adjacency, and the best of the repeats is kept. Password ages
+    are measured from now, if it is given. Returns a list of result dictionaries.
+    """
+    results = []
+    for class_name, method_name, arguments in BENCHMARKS:
+        timings = []
+        size = None
+        error = None
+        for _ in range(repeat):
+            membership.clear_cache()
+            classify.clear_cache()
+            rights.clear_cache()
+            sessions.clear_cache()
+            vectorized.clear_cache()
+            if isinstance(driver, offline.OfflineGraph):
+                driver.clear_cache()
+            method = getattr(_metrics(driver, max_depth, now)[class_name], method_name)
+            start = time.perf_counter()
+            try:
+                if arguments is None:
+                    result = method()
+                else:
+                    result = method(domain, *arguments)
+            except Exception as failure:
+                error = str(failure)
+                break
+            timings.append(time.perf_counter() - start)
+            size = _size(result)
+        results.append({
+            "method": "%s.%s" % (class_name, method_name),
+            "arguments": list(arguments or ()),
+            "seconds": round(min(timings), 6) if timings else None,
+            "items": size,
+            "error": error,
+        })
+    return results
+
+
+def run(sizes=DEFAULT_SIZES, seed=1, domain_count=2, repeat=1, driver=None, domain=None,
+        now=synthetic.EPOCH):
+    """Run the benchmarks and return the report as a dictionary. Without a driver a synthetic
+    dataset, generated at the given time, is loaded into the offline backend for every size.
+    With a Neo4j driver the configured database is benchmarked as it is.
+    """
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "seed": seed,
+        "now": now,
+        "domains": domain_count,
+        "repeat": repeat,
+        "runs": [],
+    }
+    if driver is not None:
+        domain = domain or domains.DomainData(driver).get_all_domains()[0]
+        print(yellow("[!] Benchmarking the Neo4j database with the {} domain.".format(domain)))
+        report["runs"].append({"backend": "neo4j", "objects": None, "domain": domain,
+                               "load_seconds": None,
+                               "results": time_methods(driver, domain, repeat)})
+        return report
+
+    for objects in sizes:
+        print(yellow("[!] Generating and loading {} synthetic objects...".format(objects)))
+        dataset = synthetic.SyntheticDataset(objects, domain_count, seed, now)
+        start = time.perf_counter()
+        graph = dataset.graph()
+        load_seconds = time.perf_counter() - start
+        target = dataset.domains[0].name
+        report["runs"].append({"backend": "offline", "objects": len(graph), "domain": target,
+                               "load_seconds": round(load_seconds, 6),
+                               "results": time_methods(graph, target, repeat,
+                                                        now=dataset.now)})
+    return report
+
+
+def print_report(report):
+    """Print the benchmark timings with one column per run."""
+    runs = report["runs"]
+    print(green("\n[+] Benchmark results (seconds):"))
+    print(green("%-52s" % "Method" + "".join("%12s" % (run["objects"] or run["backend"])
+                                             for run in runs)))
+    print(yellow("%-52s" % "(load)" + "".join("%12s" % _seconds(run["load_seconds"])
+                                              for run in runs)))
+    for index, (class_name, method_name, arguments) in enumerate(BENCHMARKS):
+        label = "%s.%s%s" % (class_name, method_name,
+                             "(%s)" % ", ".join(map(str, arguments)) if arguments else "")
+        print(yellow("%-52s" % label + "".join("%12s" % _seconds(run["results"][index]["seconds"])
+                                               for run in runs)))
+    for run in runs:
+        for result in run["results"]:
+            if result["error"]:
+                print(red("[X] {} failed on {} objects.".format(result["method"],
+                                                                 run["objects"])))
+                print(red("L.. Details: {}".format(result["error"])))
+
+
+def _seconds(seconds):
+    """Format a timing for the table."""
+    if seconds is None:
+        return "-"
+    return "%.4f" % seconds
+
+
+def write_report(report, path):
+    """Write the benchmark report as JSON."""
+    with open(path, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(green("[+] Wrote the benchmark results to {}.".format(path)))
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the on-disk cache of metric results. Each result is stored with a
+fingerprint of the parts of the dataset the metric reads (node and relationship counts plus a
+small sample of their contents), so re-running Fox against an unchanged dataset reuses the
+stored results and only the metrics whose inputs changed are recomputed.
+"""
+
+import os
+import pickle
+import hashlib
+import threading
+from colors import red, green, yellow
+from lib import classify, helpers, queries, sessions
+
+# Bump this whenever the shape of a cached result changes
+CACHE_VERSION = 5
+
+# Number of nodes or relationships of each kind hashed into the fingerprint
+SAMPLE_SIZE = 100
+
+# The labels and relationship types each metric reads. Metrics that are not listed, like the
+# paths to Domain Admin, can follow any relationship and depend on the whole fingerprint.
+NAMES = ("User", "Group", "Computer")
+METRIC_INPUTS = {
+    "da_sessions": NAMES + ("MemberOf", "HasSession"),
+    "privileged_sessions": NAMES + ("MemberOf", "HasSession"),
+    "avg_membership_nonrecur": NAMES + ("MemberOf",),
+    "avg_membership_recur": NAMES + ("MemberOf",),
+    "admin_groups": NAMES + ("MemberOf",),
+    "other_admin_groups": NAMES,
+    "local_admin": NAMES + ("MemberOf", "AdminTo", "CanRDP", "ExecuteDCOM"),
+    "local_admin_reach": NAMES + ("MemberOf", "AdminTo", "CanRDP", "ExecuteDCOM"),
+    "exposed_hosts": NAMES + ("MemberOf", "AdminTo", "CanRDP", "ExecuteDCOM"),
+    "rdp_users": NAMES + ("MemberOf",),
+    "foreign_groups": NAMES + ("MemberOf",),
+    "foreign_domains": NAMES + ("MemberOf",),
+    "summary": ("User", "Computer", "GPO", "OU"),
+    "password_ages": ("User",),
+    "old_passwords": ("User",),
+    "special_users": NAMES,
+    "special_computers": NAMES,
+    "da_spn": NAMES + ("MemberOf",),
+    "foreign_users": NAMES + ("MemberOf",),
+    "gpo_list": ("GPO",),
+    "blocker_ous": ("OU",),
+    "unc_deleg_computers": ("Computer",),
+}
+
+# Metrics worked out against the current time, so their results go stale even when the dataset
+# does not change
+TIME_BASED_METRICS = ("password_ages", "old_passwords")
+
+
+def default_directory():
+    """Return the directory results are cached in, following XDG_CACHE_HOME if it is set."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "fox")
+
+
+def _digest(*values):
+    """Return a SHA-1 hex digest of the repr of the given values."""
+    return hashlib.sha1(repr(values).encode("utf-8")).hexdigest()
+
+
+def _normalize(value):
+    """Turn dictionaries into sorted item lists so equal samples always hash the same way."""
+    if isinstance(value, dict):
+        return sorted((str(key), _normalize(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+class ResultCache(object):
+    """Stores and fetches metric results on disk for one dataset. The source (the Neo4j URI or
+    the offline collection's path), the nesting depth cap, and a digest of the query registry,
+    the naming rules, and the tier-0 groups are part of every key, so results from another
+    database, another depth, an older version of a query, or other rules in database.config are
+    never reused.
+    """
+
+    def __init__(self, driver, source, directory=None, refresh=False, max_nesting=None):
+        """Everything that should be initiated with a new object goes here."""
+        self.neo4j_driver = driver
+        self.source = source
+        self.max_nesting = max_nesting
+        self.directory = directory or default_directory()
+        # With refresh set nothing is read from the cache, but new results are still stored
+        self.refresh = refresh
+        self.query_version = _digest(CACHE_VERSION, sorted(queries.QUERIES.items()),
+                                     classify.get_classifier().rules,
+                                     sorted(sessions.get_tier0_groups().items()))
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def load_fingerprint(self):
+        """Collect the counts and content samples for every label and relationship type."""
+        fingerprint = {}
+        for key, total in helpers.stream_query(self.neo4j_driver, "fingerprint.counts"):
+            fingerprint[key] = [total, None]
+        for key, sample in helpers.stream_query(self.neo4j_driver, "fingerprint.sample",
+                                                sample=SAMPLE_SIZE):
+            fingerprint.setdefault(key, [0, None])[1] = _digest(_normalize(sample))
+        self.fingerprint = fingerprint
+        return fingerprint
+
+    def cacheable(self, name):
+        """Return True if the named task's result can be cached. Exports write files as they
+        run, and the time-based metrics change from day to day, so they always have to run.
+        """
+        return not name.startswith("export.") and name not in TIME_BASED_METRICS
+
+    def _metric_fingerprint(self, name):
+        """Return the digest of the parts of the fingerprint the named metric reads."""
+        if self.fingerprint is None:
+            self.load_fingerprint()
+        inputs = METRIC_INPUTS.get(name)
+        if inputs is None:
+            inputs = self.fingerprint.keys()
+        return _digest(sorted((str(key), self.fingerprint.get(key)) for key in inputs))
+
+    def _path(self, domain, name, arguments):
+        """Return the file a metric's result is stored in."""
+        key = _digest(self.source, self.query_version, self.max_nesting, domain, name, arguments)
+        return os.path.join(self.directory, "%s.pickle" % key)
+
+    def get(self, domain, name, arguments):
+        """Return (True, result) if a result for the metric was stored for the current dataset,
+        or (False, None).
+        """
+        found, result = False, None
+        if not self.refresh:
+            try:
+                with open(self._path(domain, name, arguments), "rb") as cache_file:
+                    fingerprint, result = pickle.load(cache_file)
+                found = fingerprint == self._metric_fingerprint(name)
+            except (OSError, EOFError, pickle.PickleError, AttributeError, ImportError):
+                pass
+        with self.lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not found:
+            return False, None
+        return True, result
+
+    def put(self, domain, name, arguments, result):
+        """Store a metric's result along with the fingerprint of its inputs."""
+        path = self._path(domain, name, arguments)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temporary file first so a parallel or interrupted run never leaves a
+            # half-written result behind
+            temporary = "%s.%s.tmp" % (path, os.getpid())
+            with open(temporary, "wb") as cache_file:
+                pickle.dump((self._metric_fingerprint(name), result), cache_file,
+                            pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, path)
+        except (OSError, pickle.PickleError) as error:
+            print(yellow("[!] Could not cache the {} result for {}.".format(name, domain)))
+            print(yellow("L.. Details: {}".format(error)))
+
+    def print_stats(self):
+        """Print the cache hits and misses for this run."""
+        print(green("Result cache:\t\t\t\t\t%s hits, %s misses" % (self.hits, self.misses)))
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the naming rules used to spot potentially privileged users, groups,
+and computers. Every rule for an object type is compiled into a single pattern, and the names
+for a domain are streamed once and classified in one pass no matter how many rules there are.
+"""
+
+import re
+import threading
+from collections import defaultdict
+from colors import red, green, yellow
+from lib import helpers
+
+# The default naming rules as (rule name, object types, pattern). Patterns are matched without
+# regard to case against the account part of the name (before the @ or the first dot).
+DEFAULT_RULES = [
+    ("leading-symbol", ("User",), r"^[_$]"),
+    ("admin-affix", ("User",), r"ADMIN[_-]|[_-]ADMIN"),
+    ("adm-affix", ("User",), r"ADM[_-]|[_-]ADM"),
+    ("a-affix", ("User",), r"[_-]A|A[_-]"),
+    ("admin-name", ("Group",), r"ADMIN"),
+    ("admin-host", ("Computer",), r"ADMIN|^PAW|JUMP"),
+]
+
+# Object types that are classified
+LABELS = ("User", "Group", "Computer")
+
+_classifier = None
+_classifications = {}
+_classifications_lock = threading.Lock()
+
+
+def load_rules():
+    """Return the default rules updated with any rules from the [Classification] section of
+    database.config. Each option is a rule name with a value of "Label[,Label]: pattern". A rule
+    with the same name as a default replaces it.
+    """
+    rules = list(DEFAULT_RULES)
+    section = helpers.config_section_map("Classification", required=False, raw=True)
+    for name, value in section.items():
+        labels, _, pattern = value.partition(":")
+        labels = tuple(label.strip() for label in labels.split(",") if label.strip())
+        if not pattern.strip() or not labels:
+            print(yellow("[!] Skipping the {} classification rule -- use Label: pattern"
+                         .format(name)))
+            continue
+        try:
+            re.compile(pattern.strip())
+        except re.error as error:
+            print(red("[X] Skipping the {} classification rule -- its pattern is not a valid \
+regular expression.".format(name)))
+            print(red("L.. Details: {}".format(error)))
+            continue
+        rules = [rule for rule in rules if rule[0] != name]
+        rules.append((name, labels, pattern.strip()))
+
+    return rules
+
+
+class NameClassifier(object):
+    """Classifies names against the naming rules. The rules for each object type are compiled
+    into one alternation with a named group per rule, so a name is scanned once and the group
+    that matched says which rule fired.
+    """
+
+    def __init__(self, rules):
+        """Everything that should be initiated with a new object goes here."""
+        self.rules = rules
+        self.patterns = {}
+        self.group_names = {}
+        for label in LABELS:
+            alternatives = []
+            for number, (name, labels, pattern) in enumerate(rules):
+                if label in labels:
+                    group = "rule%s" % number
+                    self.group_names[group] = name
+                    alternatives.append("(?P<%s>%s)" % (group, pattern))
+            if alternatives:
+                self.patterns[label] = re.compile("|".join(alternatives), re.IGNORECASE)
+
+    def classify(self, label, name):
+        """Return the name of the rule the name matches, or None."""
+        pattern = self.patterns.get(label)
+        if not pattern or not name:
+            return None
+        match = pattern.search(_account_name(label, name))
+        if match:
+            return self.group_names[match.lastgroup]
+        return None
+
+
+class Classification(object):
+    """The names matched for one domain, keyed by object type."""
+
+    def __init__(self, domain):
+        """Everything that should be initiated with a new object goes here."""
+        self.domain = domain
+        self.matches = defaultdict(list)
+
+    def add(self, label, name, rule):
+        """Record a name that matched a rule."""
+        self.matches[label].append((name, rule))
+
+    def get(self, label):
+        """Return the (name, rule) pairs for the object type, sorted by name."""
+        return sorted(self.matches.get(label, []))
+
+
+def _account_name(label, name):
+    """Strip the domain from a BloodHound name before it is matched."""
+    if "@" in name:
+        return name.split("@", 1)[0]
+    if label == "Computer":
+        return name.split(".", 1)[0]
+    return name
+
+
+def get_classifier():
+    """Return the shared NameClassifier, compiling the rules the first time."""
+    global _classifier
+    if _classifier is None:
+        _classifier = NameClassifier(load_rules())
+    return _classifier
+
+
+def get_classification(driver, domain):
+    """Return the Classification for the domain. The user, group, and computer names are
+    streamed from one query and classified as they arrive, and the result is kept for the
+    rest of the run.
+    """
+    key = (id(driver), domain.upper())
+    with _classifications_lock:
+        if key not in _classifications:
+            classifier = get_classifier()
+            classification = Classification(domain.upper())
+            for label, name in helpers.stream_query(driver, "classify.names",
+                                                    domain=domain.upper()):
+                rule = classifier.classify(label, name)
+                if rule:
+                    classification.add(label, name, rule)
+            _classifications[key] = classification
+
+        return _classifications[key]
+
+
+def clear_cache():
+    """Forget every classification made so far, so the next request streams the names again."""
+    with _classifications_lock:
+        _classifications.clear()
@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains Fox's connection layer for Neo4j. The driver is built with the pool
+settings from database.config, optionally routed across a cluster, and wrapped so that every
+connection taken from the pool is timed and read queries that hit a transient error are retried
+with exponential backoff instead of failing the metric.
+"""
+
+import time
+import random
+import threading
+from neo4j import is_retriable_transient_error
+from neo4j.v1 import GraphDatabase, READ_ACCESS, ConnectionExpired, ServiceUnavailable, \
+    SessionExpired, TransientError
+from colors import green, yellow
+
+# Errors that are worth retrying: the server or cluster member went away, a pooled connection
+# went stale, or the query hit a lock, a leader switch, or another condition that clears up on
+# its own. These are the errors the driver's own retry loop handles.
+TRANSIENT_ERRORS = (ServiceUnavailable, SessionExpired, ConnectionExpired, TransientError)
+
+# Settings read from the [Database] section of database.config, with their defaults
+POOL_DEFAULTS = {
+    "max_pool_size": 100,
+    "acquisition_timeout": 60.0,
+    "connection_timeout": 30.0,
+    "max_retries": 3,
+    "retry_delay": 0.5,
+    "routing": False,
+}
+
+
+def pool_settings(database):
+    """Return the pool settings from a [Database] config section, falling back to the
+    defaults for the ones that are not set.
+    """
+    settings = dict(POOL_DEFAULTS)
+    for option, default in POOL_DEFAULTS.items():
+        value = database.get(option)
+        if value is None or value == "":
+            continue
+        if isinstance(default, bool):
+            settings[option] = value.strip().lower() in ("1", "yes", "true", "on")
+        else:
+            settings[option] = type(default)(value)
+    return settings
+
+
+def is_retriable(error):
+    """Return True if a query that failed with the error should be retried. Like the driver,
+    transient errors for a terminated transaction or a stopped lock client are not retried.
+    """
+    if isinstance(error, TransientError):
+        return is_retriable_transient_error(error)
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+def routing_uri(uri):
+    """Return the URI that makes the driver route queries across a causal cluster."""
+    scheme, separator, rest = uri.partition("://")
+    if separator and scheme == "bolt":
+        return "bolt+routing://" + rest
+    return uri
+
+
+class PoolStats(object):
+    """Counts how long queries waited for a connection from the pool and how many of them were
+    retried.
+    """
+
+    def __init__(self):
+        """Everything that should be initiated with a new object goes here."""
+        self.acquisitions = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.retries = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def record_wait(self, seconds):
+        """Count one connection taken from the pool after waiting the given time."""
+        with self.lock:
+            self.acquisitions += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def record_retry(self):
+        """Count one retried query."""
+        with self.lock:
+            self.retries += 1
+
+    def record_failure(self):
+        """Count one query that failed after every retry."""
+        with self.lock:
+            self.failures += 1
+
+
+class ManagedDriver(object):
+    """Wraps a Neo4j driver to time connection acquisition and retry read queries. Everything
+    else, like opening sessions, is passed through to the driver, so it can be used wherever a
+    driver is expected.
+    """
+
+    def __init__(self, driver, settings):
+        """Everything that should be initiated with a new object goes here."""
+        self.driver = driver
+        self.settings = settings
+        self.max_retries = settings["max_retries"]
+        self.retry_delay = settings["retry_delay"]
+        self.stats = PoolStats()
+        self._time_acquisitions()
+
+    def _time_acquisitions(self):
+        """Time every connection the driver takes from its pool."""
+        pool = getattr(self.driver, "_pool", None)
+        if pool is None or not hasattr(pool, "acquire"):
+            return
+        acquire = pool.acquire
+
+        def timed_acquire(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return acquire(*args, **kwargs)
+            finally:
+                self.stats.record_wait(time.perf_counter() - start)
+
+        pool.acquire = timed_acquire
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+    def session(self, *args, **kwargs):
+        """Open a session on the wrapped driver."""
+        return self.driver.session(*args, **kwargs)
+
+    def close(self):
+        """Close the driver and every pooled connection."""
+        self.driver.close()
+
+    def backoff(self, attempt, error):
+        """Wait before the next attempt at a query that failed with a transient error. The delay
+        doubles with every attempt and is jittered so parallel workers do not retry in step.
+        Returns False if the error is not worth retrying or the query has used up its retries.
+        """
+        if attempt >= self.max_retries or not is_retriable(error):
+            self.stats.record_failure()
+            return False
+        self.stats.record_retry()
+        delay = self.retry_delay * 2 ** attempt * random.uniform(0.8, 1.2)
+        print(yellow("[!] A query hit a transient error and will be retried in %.1fs." % delay))
+        print(yellow("L.. Details: {}".format(error)))
+        time.sleep(delay)
+        return True
+
+    def read_transaction(self, work, *args, **kwargs):
+        """Run a unit of work in a read transaction and return its result, retrying it from the
+        start after a transient error.
+        """
+        attempt = 0
+        while True:
+            try:
+                with self.driver.session(access_mode=READ_ACCESS) as session:
+                    return session.read_transaction(work, *args, **kwargs)
+            except TRANSIENT_ERRORS as error:
+                if not self.backoff(attempt, error):
+                    raise
+                attempt += 1
+
+    def pool_counts(self):
+        """Return the number of pooled connections that are in use and idle."""
+        in_use = idle = 0
+        pool = getattr(self.driver, "_pool", None)
+        for connections in list(getattr(pool, "connections", {}).values()):
+            for pooled in list(connections):
+                if pooled.in_use:
+                    in_use += 1
+                else:
+                    idle += 1
+        return in_use, idle
+
+    def print_stats(self):
+        """Print the pool's connections, the time spent waiting for them, and the retries."""
+        in_use, idle = self.pool_counts()
+        stats = self.stats
+        average = stats.wait_total / stats.acquisitions if stats.acquisitions else 0.0
+        print(green("Connection pool:\t\t\t\t%s in use, %s idle (max %s)"
+                    % (in_use, idle, self.settings["max_pool_size"])))
+        print(green("Connection wait:\t\t\t\t%.1f ms average, %.1f ms max over %s acquisitions"
+                    % (average * 1000, stats.wait_max * 1000, stats.acquisitions)))
+        print(green("Query retries:\t\t\t\t\t%s retried, %s failed"
+                    % (stats.retries, stats.failures)))
+
+
+def connect(uri, user, password, settings):
+    """Build the driver with the pool settings and wrap it in a ManagedDriver. The driver's own
+    retry loop is switched off, so every retry goes through ManagedDriver.backoff.
+    """
+    if settings["routing"]:
+        uri = routing_uri(uri)
+    driver = GraphDatabase.driver(uri, auth=(user, password),
+                                  max_connection_pool_size=settings["max_pool_size"],
+                                  connection_acquisition_timeout=settings["acquisition_timeout"],
+                                  connection_timeout=settings["connection_timeout"],
+                                  max_retry_time=0)
+    return ManagedDriver(driver, settings)
@@ -3,17 +3,43 @@
 
 """This module contains all of tools and functions used for collecting domain data."""
 
+import threading
 from neo4j.v1 import GraphDatabase
 from colors import red, green, yellow
-from lib import helpers
+from lib import helpers, membership, paths, rights, sessions
+
+class DomainSummary(object):
+    """The per-domain counters and small aggregates collected by the fused summary query."""
+
+    def __init__(self, domain, record=None):
+        """Everything that should be initiated with a new object goes here."""
+        self.domain = domain
+        if record is None:
+            record = (0, 0, 0, 0, [], 0, 0)
+        self.total_users = record[0] or 0
+        self.total_enabled_users = record[1] or 0
+        self.total_computers = record[2] or 0
+        self.unconstrained_delegation = record[3] or 0
+        self.operating_systems = dict(sorted((tuple(pair) for pair in record[4] or []),
+                                             key=lambda pair: pair[1], reverse=True))
+        self.total_gpos = record[5] or 0
+        self.blocked_inheritance_ous = record[6] or 0
+
 
 class DomainData(object):
     """A class containing functions for getting domain statistics."""
 
-    def __init__(self, driver):
+    def __init__(self, driver, max_depth=None):
         """Everything that should be initiated with a new object goes here."""
         # Collect the database info from the config file
         self.neo4j_driver = driver
+        # Optional cap on how many levels of group nesting are unrolled
+        self.max_depth = max_depth
+        # Paths to Domain Admin are expensive, so keep them for each domain
+        self.path_stats = {}
+        self.path_stats_lock = threading.Lock()
+        self.summaries = {}
+        self.summaries_lock = threading.Lock()
 
     def get_all_domains(self, inclusive=False):
         """Fetch and return distinct domains from the BloodHound data set for which there is data.
@@ -28,18 +54,12 @@ class DomainData(object):
 
         # Include ALL domains regardless of info available -- useful for comparisons
         if inclusive:
-            query = """
-            MATCH (d:Domain)
-            RETURN DISTINCT d.name
-            """
+            name = "domains.all_domains"
         # Get only domains for which we have data
         else:
-            query = """
-            MATCH (g:Group)
-            RETURN DISTINCT g.domain
-            """
+            name = "domains.domains_with_data"
 
-        results = helpers.execute_query(self.neo4j_driver, query)
+        results = helpers.execute_query(self.neo4j_driver, name)
 
         domains = []
         for record in results:
@@ -47,78 +67,90 @@ class DomainData(object):
 
         return domains
 
-    def get_all_da_paths(self, domain):
-        """Returns the number of paths to a Domain Admin that exist for the given domain."""
-        query = """
-        MATCH p = shortestPath((pathToDAUsers:User {domain:UPPER('%s')})-[r*1..]-> 
-        (g:Group {name:UPPER('DOMAIN ADMINS@%s')}))
-        RETURN COUNT(DISTINCT(pathToDAUsers))
-        """ % (domain, domain)
+    def get_domain_summary(self, domain):
+        """Returns the DomainSummary for the given domain. All of the per-domain counters (users,
+        enabled users, computers, GPOs, OUs blocking inheritance, unconstrained delegation, and
+        operating systems) come back from one query and are kept for the rest of the run.
+        """
+        domain = domain.upper()
+        with self.summaries_lock:
+            if domain not in self.summaries:
+                record = helpers.query_record(self.neo4j_driver, "domains.summary",
+                                              domain=domain)
+                self.summaries[domain] = DomainSummary(domain, record)
+
+            return self.summaries[domain]
+
+    def get_da_path_stats(self, domain):
+        """Returns the PathStats for the given domain's paths to Domain Admin. A single reverse
+        breadth-first search from the Domain Admins group produces the hop distance for every
+        principal, and the result is reused by all of the path metrics.
+        """
+        domain = domain.upper()
+        with self.path_stats_lock:
+            if domain not in self.path_stats:
+                self.path_stats[domain] = paths.reverse_bfs(self.neo4j_driver, domain,
+                                                            "DOMAIN ADMINS@%s" % domain)
 
-        results = helpers.execute_query(self.neo4j_driver, query)
+            return self.path_stats[domain]
 
-        for record in results:
-            return record[0]
+    def get_all_da_paths(self, domain):
+        """Returns the number of users with a path to a Domain Admin for the given domain."""
+        return self.get_da_path_stats(domain).count("User")
 
     def avg_path_length(self, domain):
         """Returns the average number of hops in a path to a Domain Admin in the given domain."""
-        query = """
-        MATCH p = shortestPath((n {domain:UPPER('%s')})-[r*1..]->(g:Group {name:'DOMAIN ADMINS@%s'}))
-        RETURN toInt(AVG(LENGTH(p))) as avgPathLength
-        """ % (domain, domain)
+        average = self.get_da_path_stats(domain).average()
+        if average is None:
+            return None
 
-        results = helpers.execute_query(self.neo4j_driver, query)
+        return int(average)
 
-        for record in results:
-            return record[0]
+    def estimate_da_paths(self, domain, budget, seed=1):
+        """Returns a PathEstimate of the paths to Domain Admin for the given domain, sampling
+        users and computers until the time budget (in seconds) runs out. Used instead of the
+        exact path metrics when the full search would take too long.
+        """
+        domain = domain.upper()
+        return paths.estimate_paths(self.neo4j_driver, domain, "DOMAIN ADMINS@%s" % domain,
+                                    budget, seed)
 
     def get_systems_with_da(self, domain):
         """Returns a list of computers that are not Domain Controllers and have at least one active
         session for a Domain Admin user.
         """
-        query = """
-        MATCH (c2:Computer)-[r3:MemberOf*1..]->(g2:Group {name:UPPER('DOMAIN CONTROLLERS@%s')})
-        WITH COLLECT(c2.name) as domainControllers
-        MATCH (c1:Computer)-[r1:HasSession]->(u1:User)-[r2:MemberOf*1..]->(g1:Group {name:UPPER('DOMAIN ADMINS@%s')})
-        WHERE NOT (c1.name IN domainControllers)
-        RETURN DISTINCT(c1.name)
-        ORDER BY c1.name ASC
-        """ % (domain, domain)
-
-        results = helpers.execute_query(self.neo4j_driver, query)
-
-        computers = []
-        for record in results:
-            computers.append(record[0])
-        
-        return computers
-
-    def count_local_admins(self, domain):
-        """Discover the number of local admins for each computer in the domain."""
-        query = """
-        MATCH p = (u1:User)-[r:MemberOf|AdminTo*1..]->(c:Computer)
-        RETURN c.name as computerName,COUNT(DISTINCT(u1)) AS adminCount
-        ORDER BY adminCount DESC
-        """
+        analyzer = sessions.get_analyzer(self.neo4j_driver, self.max_depth)
+        return analyzer.computers_with("DOMAIN ADMINS@%s" % domain)
 
-        results = helpers.execute_query(self.neo4j_driver, query)
+    def get_privileged_sessions(self, domain, count=10):
+        """Returns the (computer, [(tier-0 user, group), ...], most privileged group) for the
+        domain's computers that are not Domain Controllers but have sessions for tier-0 users,
+        ranked by the privilege level and number of those users, most exposed first.
+        """
+        analyzer = sessions.get_analyzer(self.neo4j_driver, self.max_depth)
+        return [(exposure.computer,
+                 sorted((user, group) for user, (_, group) in exposure.users.items()),
+                 exposure.group())
+                for exposure in analyzer.ranked(domain)[:count]]
+
+    def count_local_admins(self, domain, right="AdminTo"):
+        """Discover the number of users with local admin (or another right) on each computer in
+        the domain, counting users that hold it through nested groups. Returns a dictionary of
+        computer -> users, most exposed first.
+        """
+        return rights.get_rights(self.neo4j_driver, self.max_depth).counts(right, domain)
 
-        admin_count = {}
-        for record in results:
-            admin_count[record[0]] = record[1]
-        
-        return admin_count
+    def get_most_exposed_computers(self, domain, count=10, right="AdminTo"):
+        """Returns the (computer, users) pairs for the computers in the domain where the most
+        users hold local admin (or another right), most exposed first.
+        """
+        matrix = rights.get_rights(self.neo4j_driver, self.max_depth)
+        return matrix.most_exposed(right, count, domain)
 
     def get_operating_systems(self, domain):
         """Get a list of the opreating systems reported for the given domain's computers."""
-        query = """
-        MATCH (c:Computer {domain:'%s'})
-        WHERE NOT (c.OperatingSystem = "" or c.OperatingSystem is Null)
-        RETURN DISTINCT(c.OperatingSystem) as OperartingSystems,COUNT(c.OperatingSystem) as Total
-        ORDER BY Total DESC
-        """ % domain
-
-        results = helpers.execute_query(self.neo4j_driver, query)
+        results = helpers.execute_query(self.neo4j_driver, "domains.operating_systems",
+                                        domain=domain)
 
         operating_systems = {}
         for record in results:
@@ -128,13 +160,7 @@ class DomainData(object):
 
     def get_all_gpos(self, domain):
         """Get the names of all GPOs for the given domain."""
-        query = """
-        MATCH (g:GPO {domain:'%s'})
-        WHERE NOT (g.name is Null or g.name = "")
-        RETURN g.name
-        """ % domain
-
-        results = helpers.execute_query(self.neo4j_driver, query)
+        results = helpers.execute_query(self.neo4j_driver, "domains.gpos", domain=domain)
 
         gpos = []
         for record in results:
@@ -144,13 +170,8 @@ class DomainData(object):
 
     def find_blocked_inheritance(self, domain):
         """Finds Active Directory OUs that block inheritance of group policies."""
-        query = """
-        MATCH (o:OU {domain:'%s'})
-        WHERE o.blocksInheritance = True
-        RETURN o.name
-        """ % domain
-
-        results = helpers.execute_query(self.neo4j_driver, query)
+        results = helpers.execute_query(self.neo4j_driver, "domains.blocked_inheritance_ous",
+                                        domain=domain)
 
         blocker_ous = []
         for record in results:
@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the exporters for the detailed results behind Fox's summary counts.
+Rows are written one at a time as each query streams them in, to CSV files, a JSON Lines file,
+or a write-only XLSX workbook with one sheet per metric, so memory use stays flat no matter how
+many rows a metric has.
+"""
+
+import os
+import csv
+import json
+import threading
+from colors import red, green, yellow
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Export formats by file extension
+FORMATS = {
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".xlsx": "xlsx",
+}
+
+
+class Exporter(object):
+    """Base class for the exporters. Every metric gets its own table with a domain column in
+    front of the metric's columns. Writes are serialized, so several workers can export at once.
+    """
+
+    def __init__(self, path):
+        """Everything that should be initiated with a new object goes here."""
+        self.path = path
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def export(self, metric, domain, columns, rows):
+        """Write every row of a metric for the domain and return the number of rows written."""
+        count = 0
+        for row in rows:
+            with self.lock:
+                if metric not in self.tables:
+                    self.tables[metric] = self.open_table(metric, ("domain",) + tuple(columns))
+                self.write_row(self.tables[metric], metric, ("domain",) + tuple(columns),
+                               (domain,) + tuple(row))
+            count += 1
+        return count
+
+    def open_table(self, metric, columns):
+        """Create the table for a metric and write its header."""
+        raise NotImplementedError
+
+    def write_row(self, table, metric, columns, row):
+        """Write one row to a metric's table."""
+        raise NotImplementedError
+
+    def close(self):
+        """Finish writing the export."""
+        raise NotImplementedError
+
+
+class CsvExporter(Exporter):
+    """Writes one CSV file per metric into a directory."""
+
+    def open_table(self, metric, columns):
+        os.makedirs(self.path, exist_ok=True)
+        handle = open(os.path.join(self.path, "%s.csv" % metric), "w", newline="",
+                      encoding="utf-8")
+        writer = csv.writer(handle)
+        writer.writerow(columns)
+        return handle, writer
+
+    def write_row(self, table, metric, columns, row):
+        table[1].writerow(row)
+
+    def close(self):
+        for handle, _ in self.tables.values():
+            handle.close()
+
+
+class JsonlExporter(Exporter):
+    """Writes every metric's rows to one JSON Lines file, tagged with the metric's name."""
+
+    def __init__(self, path):
+        """Everything that should be initiated with a new object goes here."""
+        Exporter.__init__(self, path)
+        self.handle = open(path, "w", encoding="utf-8")
+
+    def open_table(self, metric, columns):
+        return columns
+
+    def write_row(self, table, metric, columns, row):
+        record = {"metric": metric}
+        record.update(zip(columns, row))
+        self.handle.write(json.dumps(record, default=str) + "\n")
+
+    def close(self):
+        self.handle.close()
+
+
+class XlsxExporter(Exporter):
+    """Writes one sheet per metric to a write-only workbook. openpyxl streams the rows of each
+    sheet to disk as they are appended, so the workbook is never held in memory.
+    """
+
+    def __init__(self, path):
+        """Everything that should be initiated with a new object goes here."""
+        Exporter.__init__(self, path)
+        self.workbook = openpyxl.Workbook(write_only=True)
+
+    def open_table(self, metric, columns):
+        # Excel limits sheet names to 31 characters
+        sheet = self.workbook.create_sheet(title=metric[:31])
+        sheet.append(list(columns))
+        return sheet
+
+    def write_row(self, table, metric, columns, row):
+        table.append(list(row))
+
+    def close(self):
+        if not self.tables:
+            # A workbook needs at least one sheet to be saved
+            self.workbook.create_sheet(title="empty")
+        self.workbook.save(self.path)
+
+
+def open_exporter(path, export_format=None):
+    """Return the exporter for the path, working out the format from its extension unless one
+    is given. A path without a known extension is treated as a directory for CSV files.
+    """
+    if not export_format:
+        export_format = FORMATS.get(os.path.splitext(path)[1].lower(), "csv")
+    if export_format == "xlsx" and openpyxl is None:
+        print(red("[X] Exporting to XLSX requires openpyxl -- install it with pip3 install \
+openpyxl, or export to CSV or JSONL instead."))
+        exit()
+    exporters = {"csv": CsvExporter, "jsonl": JsonlExporter, "xlsx": XlsxExporter}
+    try:
+        return exporters[export_format](path)
+    except OSError as error:
+        print(red("[X] Could not open {} for the export.".format(path)))
+        print(red("L.. Details: {}".format(error)))
+        exit()
+
+
+def _members(lists):
+    """Yield (group, member) rows for the Domain Admins, Enterprise Admins, and Administrators."""
+    for group, members in zip(("DOMAIN ADMINS", "ENTERPRISE ADMINS", "ADMINISTRATORS"), lists):
+        for member in members:
+            yield group, member
+
+
+def _sessions(exposures):
+    """Yield (computer, user, group) rows for the ranked tier-0 sessions, with the user's most
+    privileged tier-0 group.
+    """
+    for computer, session_users, _ in exposures:
+        for user, group in session_users:
+            yield computer, user, group
+
+
+def _memberships(memberships):
+    """Yield (principal, foreign group, direct) rows for a dictionary of foreign memberships."""
+    for principal, groups in sorted(memberships.items()):
+        for group, direct in groups:
+            yield principal, group, direct
+
+
+def export_tasks(exporter, domain, domain_metrics, group_metrics, users_metrics, pass_age):
+    """Return a task for every detailed result set of the domain, for helpers.run_tasks. Each
+    task streams its metric's rows into the exporter and returns the number of rows written.
+    """
+    metrics = (
+        ("old_passwords", ("name", "pwdlastset"),
+         lambda: users_metrics.iter_old_pwdlastset(domain, min(pass_age))),
+        ("special_users", ("name", "rule"), lambda: users_metrics.find_special_users(domain)),
+        ("special_computers", ("name", "rule"),
+         lambda: users_metrics.find_special_computers(domain)),
+        ("admin_group_members", ("group", "member"),
+         lambda: _members(group_metrics.get_admin_groups(domain))),
+        ("admin_named_groups", ("group", "rule"),
+         lambda: group_metrics.find_admin_groups(domain)),
+        ("remote_desktop_users", ("member",),
+         lambda: ((member,) for member in group_metrics.find_remote_desktop_users(domain))),
+        ("local_admin_counts", ("computer", "admins"),
+         lambda: domain_metrics.count_local_admins(domain).items()),
+        ("privileged_sessions", ("computer", "user", "group"),
+         lambda: _sessions(domain_metrics.get_privileged_sessions(domain, None))),
+        ("da_sessions", ("computer",),
+         lambda: ((computer,) for computer in domain_metrics.get_systems_with_da(domain))),
+        ("foreign_user_membership", ("user", "group", "direct"),
+         lambda: _memberships(users_metrics.find_foreign_group_membership(domain))),
+        ("foreign_group_membership", ("group", "foreign_group", "direct"),
+         lambda: _memberships(group_metrics.find_foreign_group_membership(domain))),
+        ("gpos", ("name",),
+         lambda: ((gpo,) for gpo in domain_metrics.get_all_gpos(domain))),
+        ("blocked_inheritance_ous", ("name",),
+         lambda: ((ou,) for ou in domain_metrics.find_blocked_inheritance(domain))),
+        ("unconstrained_delegation", ("computer",),
+         lambda: ((computer,) for computer in
+                  users_metrics.find_unconstrained_delegation(domain))),
+        ("da_paths", ("name", "type", "hops"),
+         lambda: domain_metrics.get_da_path_stats(domain).rows()),
+    )
+
+    tasks = []
+    for metric, columns, rows in metrics:
+        tasks.append((domain, "export.%s" % metric, _export, (exporter, metric, domain, columns,
+                                                              rows), 0))
+    return tasks
+
+
+def _export(exporter, metric, domain, columns, rows):
+    """Pull the rows for a metric and stream them into the exporter."""
+    return exporter.export(metric, domain, columns, rows())
@@ -7,151 +7,103 @@ statistics.
 
 from neo4j.v1 import GraphDatabase
 from colors import red, green, yellow
-from lib import helpers
+from lib import helpers, classify, membership, rights
 
 class GroupMetrics(object):
     """A class containing functions for checking group membership data."""
 
-    def __init__(self, driver):
+    def __init__(self, driver, max_depth=None):
         """Everything that should be initiated with a new object goes here."""
         # Collect the database info from the config file
         self.neo4j_driver = driver
+        # Optional cap on how many levels of group nesting are unrolled
+        self.max_depth = max_depth
+
+    def get_membership(self):
+        """Returns the shared group membership closure for the dataset."""
+        return membership.get_closure(self.neo4j_driver, self.max_depth)
 
     def get_avg_group_membership(self, domain, recursive=False):
         """Calculate the average number of groups memberships for each user. If the recursive
         flag is set, this function will unroll group memberships to get the total number
         of groups.
         """
-        if recursive:
-            query = """
-            MATCH (u:User {domain: UPPER('%s')})-[r:MemberOf*1..]->(g:Group)
-            WITH u.name as userName,COUNT(r) as relCount
-            RETURN AVG(relCount)
-            """ % domain
-        else:
-            query = """
-            MATCH (u:User {domain: UPPER('%s')})-[r:MemberOf*1]->(g:Group)
-            WITH u.name as userName,COUNT(r) as relCount
-            RETURN AVG(relCount)
-            """ % domain
-
-        results = helpers.execute_query(self.neo4j_driver, query)
-
-        for record in results:
-            return record[0]
+        closure = self.get_membership()
+        counts = []
+        for user in closure.principals("User", domain):
+            if recursive:
+                counts.append(len(closure.groups_of(user)))
+            else:
+                counts.append(len(closure.direct_groups[user]))
+
+        if counts:
+            return sum(counts) / len(counts)
 
     def get_admin_groups(self, domain):
         """Get the Domain Admins, Enterprise Admins, and Administrator group members for the
         given domain.
         """
-        da_query = """
-        MATCH (n:Group) WHERE n.name =~ 'DOMAIN ADMINS@%s'
-        WITH n MATCH (n)<-[r:MemberOf*1..]-(m)
-        RETURN m.name,r
-        """ % domain
-
-        ea_query = """
-        MATCH (n:Group) WHERE n.name =~ 'ENTERPRISE ADMINS@%s'
-        WITH n MATCH (n)<-[r:MemberOf*1..]-(m)
-        RETURN m.name,r
-        """ % domain
-
-        admin_query = """
-        MATCH (n:Group) WHERE n.name =~ 'ADMINISTRATORS@%s'
-        WITH n MATCH (n)<-[r:MemberOf*1..]-(m)
-        RETURN m.name,r
-        """ % domain
-
-        da_results = helpers.execute_query(self.neo4j_driver, da_query)
-        ea_results = helpers.execute_query(self.neo4j_driver, ea_query)
-        admin_results = helpers.execute_query(self.neo4j_driver, admin_query)
-
-        domain_admins = []
-        for record in da_results:
-            domain_admins.append(record[0])
-        
-        enterprise_admins = []
-        for record in ea_results:
-            enterprise_admins.append(record[0])
-
-        admins = []
-        for record in admin_results:
-            admins.append(record[0])
+        closure = self.get_membership()
+        domain_admins = sorted(closure.members_of("DOMAIN ADMINS@%s" % domain))
+        enterprise_admins = sorted(closure.members_of("ENTERPRISE ADMINS@%s" % domain))
+        admins = sorted(closure.members_of("ADMINISTRATORS@%s" % domain))
 
         return domain_admins, enterprise_admins, admins
 
     def find_admin_groups(self, domain):
         """Attempt to find interesting groups with ADMIN in their names. The built-in Domain
-        Admins, Enterprise Admins, and Administrator accounts are ignored.
+        Admins, Enterprise Admins, and Administrator accounts are ignored. Returns a list of
+        (group, rule) pairs naming the classification rule each group matched.
         """
-        query = """
-        MATCH (g:Group {domain:'%s'})
-        WHERE g.name =~ '(?i).*ADMIN.*'
-        AND NOT ('DOMAIN ADMINS@%s' in g.name)
-        AND NOT ('ENTERPRISE ADMINS@%s' in g.name)
-        AND NOT ('ADMINISTRATORS@%s' in g.name)
-        RETURN g.name
-        """ % (domain, domain, domain, domain)
-
-        results = helpers.execute_query(self.neo4j_driver, query)
+        builtins = ["%s@%s" % (group, domain.upper())
+                    for group in ("DOMAIN ADMINS", "ENTERPRISE ADMINS", "ADMINISTRATORS")]
+        classification = classify.get_classification(self.neo4j_driver, domain)
 
         groups = []
-        for record in results:
-            groups.append(record[0])
+        for group, rule in classification.get("Group"):
+            if group.upper() not in builtins:
+                groups.append((group, rule))
 
         return groups
 
     def find_local_admin_groups(self, domain):
         """Identify groups that are not built-in Admin groups and have Local Administrator
-        privileges.
+        privileges assigned to them on at least one computer.
         """
-        query = """
-        MATCH (g:Group {domain:'%s'})-[:AdminTo*1..]->(c:Computer)
-        WHERE NOT ('DOMAIN ADMINS@%s' in g.name)
-        AND NOT ('ENTERPRISE ADMINS@%s' in g.name)
-        AND NOT ('ADMINISTRATORS@%s' in g.name)
-        RETURN DISTINCT(g.name)
-        """ % (domain, domain, domain, domain)
-
-        results = helpers.execute_query(self.neo4j_driver, query)
+        builtins = ["%s@%s" % (group, domain.upper())
+                    for group in ("DOMAIN ADMINS", "ENTERPRISE ADMINS", "ADMINISTRATORS")]
+        matrix = rights.get_rights(self.neo4j_driver, self.max_depth)
 
         groups = []
-        for record in results:
-            groups.append(record[0])
+        for group in sorted(matrix.direct_holders("AdminTo", "Group", domain)):
+            if group not in builtins:
+                groups.append(group)
 
         return groups
 
+    def get_group_reach(self, domain, right="AdminTo"):
+        """Returns a dictionary of group -> number of the domain's computers its members hold
+        local admin (or another right) on, directly or through nested groups, largest first.
+        """
+        matrix = rights.get_rights(self.neo4j_driver, self.max_depth)
+        return matrix.reach(right, domain, "Group")
+
     def find_foreign_group_membership(self, domain):
-        """Identify groups with foregin group memberships."""
-        query = """
-        MATCH (n:Group) 
-        WHERE n.name ENDS WITH ('@' + '%s') 
-        WITH n 
-        MATCH (n)-[r:MemberOf*1..]->(m:Group) 
-        WHERE NOT m.name ENDS WITH ('@' + '%s') 
-        RETURN n.name,m.name
-        """ % (domain, domain)
-
-        results = helpers.execute_query(self.neo4j_driver, query)
-
-        groups = {}
-        for record in results:
-            groups[record[0]] = record[1]
+        """Identify groups with foreign group memberships, direct or nested. Returns a
+        dictionary of group -> list of (foreign group, direct) pairs.
+        """
+        foreign = membership.get_foreign_membership(self.neo4j_driver, self.max_depth)
+        return foreign.memberships(domain, "Group")
+
+    def get_foreign_domains(self, domain):
+        """Returns a list of (foreign domain, users, groups, computers) counts of the domain's
+        principals that are members of groups in each foreign domain.
+        """
+        foreign = membership.get_foreign_membership(self.neo4j_driver, self.max_depth)
+        return foreign.by_domain(domain)
 
-        return groups
-    
     def find_remote_desktop_users(self, domain):
         """Identify members of the Remote Desktop Users."""
-        query = """
-        MATCH (n:Group) WHERE n.name = 'REMOTE DESKTOP USERS@%s'
-        WITH n MATCH (n)<-[r:MemberOf*1..]-(m)
-        RETURN m.name
-        """ % domain
-
-        results = helpers.execute_query(self.neo4j_driver, query)
-
-        members = []
-        for member in results:
-            members.append(member[0])
+        closure = self.get_membership()
 
-        return members
\ No newline at end of file
+        return sorted(closure.members_of("REMOTE DESKTOP USERS@%s" % domain))
\ No newline at end of file
@@ -6,22 +6,35 @@ Helper functions that are shared across different custom libraries.
 """
 
 import sys
+import time
 import configparser
-from neo4j.v1 import GraphDatabase
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from neo4j.v1 import READ_ACCESS
 from colors import red, yellow, green
+from lib import connection, offline, queries, profiling, snapshot
 
+# The parsed database.config, read the first time a section is requested
+_config_parser = None
 
-def config_section_map(section):
+def config_section_map(section, required=True, raw=False):
     """Function to read a config file section and return a dictionary object that can be
-    referenced for configuration settings.
+    referenced for configuration settings. The file is only read and parsed once. A section
+    that is not required returns an empty dictionary if it is missing, and a raw section is read
+    without % interpolation, for values like regular expressions.
     """
-    try:
-        config_parser = configparser.ConfigParser()
-        config_parser.read("database.config")
-    except configparser.Error as error:
-        print(red("[X] Could not open the database.config file -- make sure it exists and is readable."))
-        print(red("L.. Details: {}".format(error)))
-        exit()
+    global _config_parser
+    if _config_parser is None:
+        try:
+            config_parser = configparser.ConfigParser()
+            config_parser.read("database.config")
+        except configparser.Error as error:
+            print(red("[X] Could not open the database.config file -- make sure it exists and is readable."))
+            print(red("L.. Details: {}".format(error)))
+            exit()
+        _config_parser = config_parser
+    config_parser = _config_parser
+    if not required and not config_parser.has_section(section):
+        return {}
 
     try:
         section_dict = {}
@@ -30,7 +43,7 @@ def config_section_map(section):
         # Loop through each option
         for option in options:
             # Get the section and option and add it to the dictionary
-            section_dict[option] = config_parser.get(section, option)
+            section_dict[option] = config_parser.get(section, option, raw=raw)
             if section_dict[option] == -1:
                 print("[X] Skipping: {}".format(option))
 
@@ -43,15 +56,24 @@ def config_section_map(section):
 
 def setup_database_conn():
     """Function to setup the database connection to the Neo4j project containing the BloodHound
-    data.
+    data. The connection pool, its timeouts, the retries, and routing for clustered Neo4j are
+    configured by the optional max_pool_size, acquisition_timeout, connection_timeout,
+    max_retries, retry_delay, and routing options in the same section as the credentials.
     """
+    database = config_section_map("Database") or {}
     try:
-        database_uri = config_section_map("Database")["uri"]
-        database_user = config_section_map("Database")["username"]
-        database_pass = config_section_map("Database")["password"]
+        settings = connection.pool_settings(database)
+    except ValueError as error:
+        print(red("[X] The connection pool settings in your database.config are not valid."))
+        print(red("L.. Details: {}".format(error)))
+        exit()
+    try:
+        database_uri = database["uri"]
+        database_user = database["username"]
+        database_pass = database["password"]
         print(yellow("[!] Attempting to connect to your Neo4j project using {}:{} @ {}."
                 .format(database_user, database_pass, database_uri)))
-        neo4j_driver = GraphDatabase.driver(database_uri, auth=(database_user, database_pass))
+        neo4j_driver = connection.connect(database_uri, database_user, database_pass, settings)
         print(green("[+] Success!"))
         return neo4j_driver
     except Exception:
@@ -62,6 +84,31 @@ project is running. Note that the bolt port can change sometimes."))
         exit()
 
 
+def setup_offline_graph(path):
+    """Function to build the in-process graph from a SharpHound collection, or to open a snapshot
+    written by the snapshot command, for running Fox without a Neo4j database.
+    """
+    if snapshot.is_snapshot(path):
+        try:
+            graph = snapshot.open_snapshot(path)
+            print(green("[+] Opened the snapshot at {} with {} objects.".format(path, len(graph))))
+            return graph
+        except (OSError, ValueError) as error:
+            print(red("[X] Could not open the snapshot at {}!".format(path)))
+            print(red("L.. Details: {}".format(error)))
+            exit()
+    try:
+        print(yellow("[!] Loading the SharpHound collection from {}.".format(path)))
+        graph = offline.load_collection(path)
+        print(green("[+] Success! Loaded {} objects.".format(len(graph))))
+        return graph
+    except (OSError, ValueError) as error:
+        print(red("[X] Could not load the SharpHound collection at {}! Provide a SharpHound ZIP, \
+a directory of its JSON files, or a single JSON file.".format(path)))
+        print(red("L.. Details: {}".format(error)))
+        exit()
+
+
 def prepare_domains_list(domain_metrics_obj, domain=None):
     """Function to prepare the list of domains to be enumerated. If a domain is provided, it will
     check if BloodHound has data for that domain. If no domain is provided, it will create a list
@@ -93,9 +140,164 @@ def prepare_domains_list(domain_metrics_obj, domain=None):
     return all_domains
 
 
-def execute_query(driver, query):
-    """Execute the provided query using the current Neo4j database connection."""
-    with driver.session() as session:
-        results = session.run(query)
+def _run_task(task, cache=None):
+    """Run a single (domain, name, function, arguments, default) task. A failing task reports
+    the error and falls back to its default so the rest of the report can still be produced.
+    Results are fetched from and stored in the cache, if one is provided, but a default from a
+    failed task is never stored. Returns the result and the seconds it took to compute, or None
+    for the seconds if it came from the cache or failed.
+    """
+    domain, name, function, arguments, default = task
+    if cache and not cache.cacheable(name):
+        cache = None
+    if cache:
+        found, result = cache.get(domain, name, arguments)
+        if found:
+            return result, None
+    start = time.perf_counter()
+    try:
+        result = function(*arguments)
+    except Exception as error:
+        print(red("[X] The {} query failed for {} and will be reported as empty."
+                  .format(name, domain)))
+        print(red("L.. Details: {}".format(error)))
+        return default, None
+    seconds = time.perf_counter() - start
+    if cache:
+        cache.put(domain, name, arguments, result)
+    return result, seconds
+
+
+def run_tasks(tasks, workers=1, cache=None, progress=None):
+    """Function to run the queued metric tasks and return a dictionary of their results keyed by
+    (domain, name). With more than one worker the tasks are sent in parallel over the driver's
+    connection pool, so a slow query only ties up its own worker. If a progress object is given,
+    its finished() method is called from this thread with each task, its result, and the
+    seconds it took, as soon as the task is done. Interrupting the run with Ctrl-C cancels the
+    tasks that have not started yet and raises KeyboardInterrupt.
+    """
+    results = {}
+    if cache:
+        # Fingerprint the dataset once up front instead of in every worker
+        cache.load_fingerprint()
+    if workers > 1:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {executor.submit(_run_task, task, cache): task for task in tasks}
+        try:
+            for future in as_completed(futures):
+                task = futures[future]
+                result, seconds = future.result()
+                results[task[:2]] = result
+                if progress:
+                    progress.finished(task, result, seconds)
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            executor.shutdown(wait=False)
+    else:
+        for task in tasks:
+            result, seconds = _run_task(task, cache)
+            results[task[:2]] = result
+            if progress:
+                progress.finished(task, result, seconds)
 
     return results
+
+
+def _backoff(driver, attempt, error):
+    """Wait before retrying a query after a transient error, if the driver retries queries.
+    Returns False if the query should not be retried.
+    """
+    if isinstance(driver, connection.ManagedDriver):
+        return driver.backoff(attempt, error)
+    return False
+
+
+def _stream_records(driver, name, query, parameters):
+    """Generator that runs the query once in a read session and yields its records."""
+    profiler = profiling.profiler
+    with driver.session(access_mode=READ_ACCESS) as session:
+        if profiler.enabled:
+            result = session.run("PROFILE " + query, parameters)
+            records = profiler.watch(name, parameters, result, result)
+        else:
+            records = session.run(query, parameters)
+        for record in records:
+            yield record
+
+
+def stream_query(driver, name, **parameters):
+    """Generator that runs the named query from the registry and yields its records one at a
+    time while the session stays open, so a large result is read as it is used. Stopping early
+    does not stop the server: closing the generator closes the session, which still reads and
+    buffers every remaining record, so queries that only need a few rows should LIMIT them. A
+    transient error before the first record is retried, but once records have been handed out
+    the error is raised, since they cannot be taken back.
+    """
+    profiler = profiling.profiler
+    if isinstance(driver, offline.OfflineGraph):
+        records = driver.stream(name, parameters)
+        if profiler.enabled:
+            records = profiler.watch(name, parameters, records)
+        for record in records:
+            yield record
+        return
+
+    query = queries.get_query(name)
+    attempt = 0
+    while True:
+        streamed = False
+        try:
+            for record in _stream_records(driver, name, query, parameters):
+                streamed = True
+                yield record
+            return
+        except connection.TRANSIENT_ERRORS as error:
+            if streamed or not _backoff(driver, attempt, error):
+                raise
+            attempt += 1
+
+
+def execute_query(driver, name, **parameters):
+    """Execute the named query from the registry with the provided parameters using the current
+    Neo4j database connection and return all of its records. The query runs as a read
+    transaction, and the whole transaction is retried after a transient error. An offline graph
+    answers the query by its name instead.
+    """
+    if not isinstance(driver, connection.ManagedDriver):
+        return list(stream_query(driver, name, **parameters))
+
+    profiler = profiling.profiler
+    query = queries.get_query(name)
+
+    def read(transaction):
+        if profiler.enabled:
+            result = transaction.run("PROFILE " + query, parameters)
+            return list(profiler.watch(name, parameters, result, result))
+        return list(transaction.run(query, parameters))
+
+    return driver.read_transaction(read)
+
+
+def query_record(driver, name, **parameters):
+    """Execute the named query and return its first record, or None. The session is closed
+    before returning, so it is meant for queries that return a single row.
+    """
+    results = stream_query(driver, name, **parameters)
+    try:
+        for record in results:
+            return record
+    finally:
+        results.close()
+
+
+def query_value(driver, name, **parameters):
+    """Execute the named query and return the first value of its first record, or None. Like
+    query_record, it is meant for queries that return a single row.
+    """
+    record = query_record(driver, name, **parameters)
+    if record is None:
+        return None
+    return record[0]
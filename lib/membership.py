@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the transitive group membership closure shared by every metric that
+needs to unroll nested groups. The MemberOf relationships are pulled once and each group's
+effective membership is computed a single time, no matter how many metrics ask for it.
+"""
+
+import threading
+from collections import defaultdict, deque
+from lib import helpers
+
+# Labels that matter for membership, in order of preference
+PRINCIPAL_LABELS = ("User", "Computer", "Group")
+
+# Closures are kept for each database connection and nesting depth cap
+_closures = {}
+_closures_lock = threading.Lock()
+
+# Cross-domain memberships, kept alongside the closures they are built from
+_foreign = {}
+
+
+class MembershipClosure(object):
+    """The effective (nested) group memberships for every principal in the dataset. Cycles in
+    group nesting are handled and an optional depth cap limits how far nesting is followed.
+    """
+
+    def __init__(self, max_depth=None):
+        """Everything that should be initiated with a new object goes here."""
+        self.max_depth = max_depth
+        self.direct_groups = defaultdict(set)
+        self.direct_members = defaultdict(set)
+        self.labels = {}
+        self.domains = {}
+        self._groups = {}
+        self._members = {}
+        self._lock = threading.Lock()
+
+    def add(self, member, labels, member_domain, group, group_domain):
+        """Record a single MemberOf relationship."""
+        member = member.upper()
+        group = group.upper()
+        self.direct_groups[member].add(group)
+        self.direct_members[group].add(member)
+        self.labels.setdefault(member, next((l for l in PRINCIPAL_LABELS if l in labels), None))
+        self.labels[group] = "Group"
+        if member_domain:
+            self.domains[member] = member_domain.upper()
+        if group_domain:
+            self.domains[group] = group_domain.upper()
+
+    def principals(self, label=None, domain=None):
+        """Yield the names of principals with at least one group membership."""
+        for member in self.direct_groups:
+            if label and self.labels.get(member) != label:
+                continue
+            if domain and self.domains.get(member) != domain.upper():
+                continue
+            yield member
+
+    def groups_of(self, principal):
+        """Return the set of groups the principal is a direct or nested member of."""
+        return self._closure(principal.upper(), self.direct_groups, self._groups)
+
+    def members_of(self, group, label=None):
+        """Return the set of principals with a direct or nested membership of the group."""
+        members = self._closure(group.upper(), self.direct_members, self._members)
+        if label:
+            return set(member for member in members if self.labels.get(member) == label)
+        return members
+
+    def _closure(self, start, adjacency, memo):
+        """Return the closure of the start node over the adjacency, computing it if needed."""
+        with self._lock:
+            if start not in memo:
+                if self.max_depth is None:
+                    self._closure_components(start, adjacency, memo)
+                else:
+                    memo[start] = self._closure_bounded(start, adjacency)
+            return memo[start]
+
+    def _closure_bounded(self, start, adjacency):
+        """Breadth-first expansion that stops after max_depth levels of nesting."""
+        depths = {start: 0}
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            if depths[current] >= self.max_depth:
+                continue
+            for other in adjacency.get(current, ()):
+                if other not in depths:
+                    depths[other] = depths[current] + 1
+                    queue.append(other)
+        del depths[start]
+        return frozenset(depths)
+
+    def _closure_components(self, start, adjacency, memo):
+        """Compute closures for every node reachable from start with an iterative Tarjan pass.
+        Nodes in the same strongly connected component (a nesting cycle) share one closure,
+        and each component's closure is built from those already computed below it.
+        """
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        work = [(start, iter(adjacency.get(start, ())))]
+        index[start] = lowlink[start] = 0
+        stack.append(start)
+        on_stack.add(start)
+        counter = 1
+        while work:
+            node, children = work[-1]
+            advanced = False
+            for child in children:
+                if child in memo:
+                    continue
+                if child not in index:
+                    index[child] = lowlink[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(adjacency.get(child, ()))))
+                    advanced = True
+                    break
+                if child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                closure = set()
+                for member in component:
+                    for other in adjacency.get(member, ()):
+                        closure.add(other)
+                        if other in memo:
+                            closure.update(memo[other])
+                # Members of a nesting cycle share a closure, but never include themselves
+                for member in component:
+                    memo[member] = frozenset(closure - {member})
+
+
+class ForeignMembership(object):
+    """Every membership that crosses a domain boundary in the dataset, including the ones
+    reached through nested groups, built in one pass over the membership closure. Entries are
+    grouped by the principal's domain and the foreign group's domain, so each domain's report
+    reads its share without another query. A principal's domain comes from its domain property,
+    or from the part of its name after the @ if the property was not collected.
+    """
+
+    def __init__(self, closure):
+        """Everything that should be initiated with a new object goes here."""
+        # source domain -> target domain -> principal -> [(foreign group, direct), ...]
+        self.domains = defaultdict(lambda: defaultdict(dict))
+        for principal in closure.direct_groups:
+            source = self._domain(closure, principal)
+            if not source:
+                continue
+            direct = closure.direct_groups[principal]
+            for group in sorted(closure.groups_of(principal)):
+                target = self._domain(closure, group)
+                if target and target != source:
+                    self.domains[source][target].setdefault(principal, []).append(
+                        (group, group in direct))
+        self.labels = closure.labels
+
+    @staticmethod
+    def _domain(closure, name):
+        domain = closure.domains.get(name)
+        if not domain and "@" in name:
+            domain = name.rpartition("@")[2]
+        return domain
+
+    def memberships(self, domain, label=None):
+        """Return a dictionary of each of the domain's principals (optionally only those with
+        the label) -> the sorted list of (foreign group, direct) pairs it is a member of.
+        """
+        principals = {}
+        for members in self.domains.get(domain.upper(), {}).values():
+            for principal, groups in members.items():
+                if label and self.labels.get(principal) != label:
+                    continue
+                principals.setdefault(principal, []).extend(groups)
+        return dict((principal, sorted(groups)) for principal, groups in principals.items())
+
+    def by_domain(self, domain):
+        """Return a list of (foreign domain, users, groups, computers) counts of the domain's
+        principals with a membership in each foreign domain, sorted by foreign domain.
+        """
+        counts = []
+        for target, members in sorted(self.domains.get(domain.upper(), {}).items()):
+            labels = [self.labels.get(principal) for principal in members]
+            counts.append((target, labels.count("User"), labels.count("Group"),
+                           labels.count("Computer")))
+        return counts
+
+
+def get_closure(driver, max_depth=None):
+    """Return the shared MembershipClosure for the given database connection, pulling the
+    MemberOf relationships the first time it is requested.
+    """
+    key = (id(driver), max_depth)
+    with _closures_lock:
+        if key not in _closures:
+            closure = MembershipClosure(max_depth)
+            results = helpers.stream_query(driver, "membership.edges")
+            for member, labels, member_domain, group, group_domain in results:
+                if member and group:
+                    closure.add(member, labels, member_domain, group, group_domain)
+            _closures[key] = closure
+
+        return _closures[key]
+
+
+def get_foreign_membership(driver, max_depth=None):
+    """Return the shared ForeignMembership for the given database connection, building it from
+    the membership closure the first time it is requested.
+    """
+    key = (id(driver), max_depth)
+    closure = get_closure(driver, max_depth)
+    with _closures_lock:
+        if key not in _foreign:
+            _foreign[key] = ForeignMembership(closure)
+
+        return _foreign[key]
+
+
+def clear_cache():
+    """Forget every closure built so far, so the next request pulls the memberships again."""
+    with _closures_lock:
+        _closures.clear()
+        _foreign.clear()
@@ -0,0 +1,652 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the offline backend that lets Fox run its metrics against SharpHound
+collections without a Neo4j database. The SharpHound JSON files (or the ZIP) are streamed one
+object at a time into a compact in-process graph that answers Fox's queries by name.
+"""
+
+import io
+import os
+import json
+import bisect
+import zipfile
+from array import array
+from collections import deque
+
+
+# SharpHound file types and the labels BloodHound gives their objects
+COLLECTION_LABELS = {
+    "users": "User",
+    "groups": "Group",
+    "computers": "Computer",
+    "domains": "Domain",
+    "gpos": "GPO",
+    "ous": "OU",
+}
+
+# Object types used in SharpHound references (MemberType, PrincipalType, etc.)
+TYPE_LABELS = {
+    "user": "User",
+    "group": "Group",
+    "computer": "Computer",
+    "domain": "Domain",
+    "gpo": "GPO",
+    "ou": "OU",
+}
+
+# Only the properties Fox uses are kept in memory to keep large collections manageable
+KEPT_PROPERTIES = (
+    "domain",
+    "enabled",
+    "pwdlastset",
+    "hasspn",
+    "unconstraineddelegation",
+    "operatingsystem",
+    "blocksinheritance",
+)
+
+# Computer attributes that become rights edges from the listed principals to the computer
+COMPUTER_RIGHTS = (
+    ("LocalAdmins", "AdminTo"),
+    ("RemoteDesktopUsers", "CanRDP"),
+    ("DcomUsers", "ExecuteDCOM"),
+    ("PSRemoteUsers", "CanPSRemote"),
+)
+
+# Keys SharpHound versions use for the referenced object and its type
+REFERENCE_KEYS = ("MemberName", "MemberId", "ObjectIdentifier", "PrincipalName", "PrincipalSID",
+                  "Name")
+REFERENCE_TYPE_KEYS = ("MemberType", "ObjectType", "PrincipalType", "Type")
+
+CHUNK_SIZE = 65536
+
+
+class _JsonStream(object):
+    """A minimal incremental reader for the SharpHound JSON layout. The top-level object is
+    walked key by key and the elements of any array are decoded one at a time, so only a
+    single object has to be held in memory regardless of the file's size.
+    """
+
+    def __init__(self, handle, chunk_size=CHUNK_SIZE):
+        """Everything that should be initiated with a new object goes here."""
+        self.handle = handle
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def _fill(self):
+        """Read the next chunk from the file, dropping what has already been consumed."""
+        chunk = self.handle.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def _peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position].isspace():
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON data")
+
+    def _expect(self, character):
+        """Consume the expected character or fail on malformed input."""
+        if self._peek() != character:
+            raise ValueError("Expected '%s' at offset %s" % (character, self.position))
+        self.position += 1
+
+    def _decode(self):
+        """Decode the next complete JSON value, reading more data until it is available."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # A value that runs to the end of the buffer may be a truncated number
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            if not self._fill():
+                continue
+
+    def items(self):
+        """Yield (key, value) pairs for the top-level object. Arrays are flattened so that one
+        pair is produced for each of their elements.
+        """
+        self._expect("{")
+        while True:
+            character = self._peek()
+            if character == "}":
+                return
+            if character == ",":
+                self.position += 1
+                continue
+            key = self._decode()
+            self._expect(":")
+            if self._peek() == "[":
+                self.position += 1
+                while True:
+                    character = self._peek()
+                    if character == "]":
+                        self.position += 1
+                        break
+                    if character == ",":
+                        self.position += 1
+                        continue
+                    yield key, self._decode()
+            else:
+                yield key, self._decode()
+
+
+def _reference(value):
+    """Return the (key, label) for a SharpHound reference, which may be a bare name or SID
+    or a dictionary describing the referenced object.
+    """
+    if isinstance(value, dict):
+        key = next((value[k] for k in REFERENCE_KEYS if value.get(k)), None)
+        kind = next((value[k] for k in REFERENCE_TYPE_KEYS if value.get(k)), None)
+        label = TYPE_LABELS.get(str(kind).lower()) if kind else None
+        return key, label
+    return value, None
+
+
+def _results(value):
+    """Newer SharpHound versions wrap collected lists in a {"Results": [...]} object."""
+    if isinstance(value, dict):
+        return value.get("Results") or []
+    return value or []
+
+
+class OfflineGraph(object):
+    """An in-process BloodHound graph built from SharpHound collection files. Nodes are
+    interned into dense integers and relationships are kept in flat arrays per type, with
+    adjacency built lazily the first time a relationship type is traversed.
+    """
+
+    def __init__(self):
+        """Everything that should be initiated with a new object goes here."""
+        self.names = []
+        self.labels = []
+        self.properties = []
+        self.index = {}
+        self.edges = {}
+        self._adjacency = {}
+        self.handlers = {
+            "domains.domains_with_data": self._domains_with_data,
+            "domains.all_domains": self._all_domains,
+            "domains.operating_systems": self._operating_systems,
+            "domains.gpos": self._gpos,
+            "domains.blocked_inheritance_ous": self._blocked_inheritance_ous,
+            "domains.summary": self._summary,
+            "users.total_users": self._total_users,
+            "users.total_enabled_users": self._total_enabled_users,
+            "users.total_computers": self._total_computers,
+            "users.unconstrained_delegation": self._unconstrained_delegation,
+            "users.old_pwdlastset": self._old_pwdlastset,
+            "users.pwdlastset_ages": self._pwdlastset_ages,
+            "users.spn_users": self._spn_users,
+            "classify.names": self._names,
+            "paths.start_node": self._start_node,
+            "paths.inbound": self._inbound,
+            "paths.outbound": self._outbound,
+            "paths.principals": self._principals,
+            "membership.edges": self._membership_edges,
+            "rights.edges": self._rights_edges,
+            "sessions.edges": self._sessions_edges,
+            "bulk.users": self._bulk_users,
+            "bulk.computers": self._bulk_computers,
+            "bulk.groups": self._bulk_groups,
+            "bulk.containers": self._bulk_containers,
+            "bulk.memberships": self._bulk_memberships,
+            "snapshot.nodes": self._snapshot_nodes,
+            "snapshot.edges": self._snapshot_edges,
+            "fingerprint.counts": self._fingerprint_counts,
+            "fingerprint.sample": self._fingerprint_sample,
+        }
+
+    # Graph construction
+
+    def node(self, key, label=None, name=None):
+        """Return the integer ID for the given object key, creating a placeholder node the
+        first time an object is referenced.
+        """
+        key = str(key).upper()
+        node_id = self.index.get(key)
+        if node_id is None:
+            node_id = len(self.names)
+            self.index[key] = node_id
+            self.names.append(name.upper() if name else key)
+            self.labels.append(label)
+            self.properties.append({})
+        elif label and not self.labels[node_id]:
+            self.labels[node_id] = label
+        return node_id
+
+    def add_edge(self, source, rel_type, target):
+        """Record a relationship between two interned nodes."""
+        if rel_type not in self.edges:
+            self.edges[rel_type] = (array("l"), array("l"))
+        sources, targets = self.edges[rel_type]
+        sources.append(source)
+        targets.append(target)
+        self._adjacency = {}
+
+    def add_object(self, kind, entry):
+        """Add one SharpHound object and its relationships to the graph."""
+        label = COLLECTION_LABELS[kind]
+        properties = entry.get("Properties") or {}
+        name = properties.get("name") or entry.get("Name")
+        key = entry.get("ObjectIdentifier") or entry.get("Name") or entry.get("Guid")
+        if not key:
+            return
+        node_id = self.node(key, label, name)
+        self.names[node_id] = (name or str(key)).upper()
+        self.labels[node_id] = label
+        # Objects can be referenced by name or by GUID depending on the SharpHound version
+        for alias in (name, entry.get("Guid")):
+            if alias:
+                self.index.setdefault(str(alias).upper(), node_id)
+
+        kept = {}
+        for prop, value in properties.items():
+            prop = prop.lower()
+            if prop in KEPT_PROPERTIES and value is not None:
+                kept[prop] = value
+        domain = kept.get("domain") or self._derive_domain(label, self.names[node_id])
+        kept["domain"] = str(domain).upper()
+        self.properties[node_id] = kept
+
+        primary_group = entry.get("PrimaryGroup") or entry.get("PrimaryGroupSid") or \
+            entry.get("PrimaryGroupSID")
+        if primary_group:
+            self.add_edge(node_id, "MemberOf", self.node(primary_group, "Group"))
+        for member in _results(entry.get("Members")):
+            member_key, member_label = _reference(member)
+            if member_key:
+                self.add_edge(self.node(member_key, member_label), "MemberOf", node_id)
+        for attribute, rel_type in COMPUTER_RIGHTS:
+            for principal in _results(entry.get(attribute)):
+                principal_key, principal_label = _reference(principal)
+                if principal_key:
+                    self.add_edge(self.node(principal_key, principal_label), rel_type, node_id)
+        for attribute in ("Sessions", "PrivilegedSessions", "RegistrySessions"):
+            for session in _results(entry.get(attribute)):
+                user = session.get("UserSID") or session.get("UserId") or session.get("UserName")
+                if user:
+                    self.add_edge(node_id, "HasSession", self.node(user, "User"))
+        for target in _results(entry.get("AllowedToDelegate")):
+            target_key, _ = _reference(target)
+            if target_key:
+                self.add_edge(node_id, "AllowedToDelegate", self.node(target_key, "Computer"))
+        for ace in entry.get("Aces") or []:
+            principal_key, principal_label = _reference(ace)
+            if principal_key and ace.get("RightName"):
+                self.add_edge(self.node(principal_key, principal_label), ace["RightName"], node_id)
+        for link in entry.get("Links") or []:
+            gpo_key, _ = _reference(link)
+            if gpo_key:
+                self.add_edge(self.node(gpo_key, "GPO"), "GpLink", node_id)
+        for attribute, child_label in (("ChildOus", "OU"), ("Users", "User"),
+                                       ("Computers", "Computer"), ("ChildObjects", None)):
+            for child in entry.get(attribute) or []:
+                child_key, reference_label = _reference(child)
+                if child_key:
+                    self.add_edge(node_id, "Contains",
+                                  self.node(child_key, reference_label or child_label))
+
+    def add_session(self, entry):
+        """Add an entry from the separate sessions file older SharpHound versions produce."""
+        user = entry.get("UserName")
+        computer = entry.get("ComputerName")
+        if user and computer:
+            self.add_edge(self.node(computer, "Computer"), "HasSession", self.node(user, "User"))
+
+    @staticmethod
+    def _derive_domain(label, name):
+        """Work out an object's domain from its name when the property was not collected."""
+        if "@" in name:
+            return name.split("@", 1)[1]
+        if label == "Computer" and "." in name:
+            return name.split(".", 1)[1]
+        if label == "Domain":
+            return name
+        return ""
+
+    # Graph access
+
+    def __len__(self):
+        return len(self.names)
+
+    def domain(self, node_id):
+        """Return the domain property for a node, if the node was collected."""
+        return self.properties[node_id].get("domain")
+
+    def prop(self, node_id, key, default=None):
+        """Return one of the kept properties for a node."""
+        return self.properties[node_id].get(key, default)
+
+    def lookup(self, name):
+        """Return the node ID for the given name or object identifier, or None."""
+        return self.index.get(str(name).upper())
+
+    def nodes(self, label=None, domain=None):
+        """Yield the IDs of the nodes matching the given label and domain."""
+        for node_id in range(len(self.names)):
+            if label and self.labels[node_id] != label:
+                continue
+            if domain and self.domain(node_id) != domain.upper():
+                continue
+            yield node_id
+
+    def clear_cache(self):
+        """Forget the adjacency built so far, so the next traversal builds it again."""
+        self._adjacency = {}
+
+    def rel_types(self):
+        """Return the relationship types present in the graph."""
+        return list(self.edges)
+
+    def _csr(self, rel_type, reverse=False):
+        """Build (or fetch) the compressed adjacency arrays for one relationship type."""
+        key = (rel_type, reverse)
+        adjacency = self._adjacency.get(key)
+        if adjacency is None:
+            sources, targets = self.edges.get(rel_type, (array("l"), array("l")))
+            if reverse:
+                sources, targets = targets, sources
+            count = len(self.names)
+            indptr = array("l", [0]) * (count + 1)
+            for source in sources:
+                indptr[source + 1] += 1
+            for node_id in range(count):
+                indptr[node_id + 1] += indptr[node_id]
+            indices = array("l", [0]) * len(sources)
+            fill = array("l", indptr[:-1])
+            for source, target in zip(sources, targets):
+                indices[fill[source]] = target
+                fill[source] += 1
+            adjacency = (indptr, indices)
+            self._adjacency[key] = adjacency
+        return adjacency
+
+    def neighbours(self, node_id, rel_types=None, reverse=False):
+        """Yield (rel_type, node_id) pairs for the relationships leaving the node, or entering
+        it if reverse is set.
+        """
+        for rel_type in rel_types or self.rel_types():
+            indptr, indices = self._csr(rel_type, reverse)
+            for position in range(indptr[node_id], indptr[node_id + 1]):
+                yield rel_type, indices[position]
+
+    def reachable(self, start, rel_types=None, reverse=False):
+        """Breadth-first search from the start node. Returns a dictionary of each reachable
+        node and its distance in hops, excluding the start node itself.
+        """
+        distances = {start: 0}
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            for _, other in self.neighbours(current, rel_types, reverse):
+                if other not in distances:
+                    distances[other] = distances[current] + 1
+                    queue.append(other)
+        del distances[start]
+        return distances
+
+    def stream(self, name, parameters=None):
+        """Answer the named query with an iterator over its records."""
+        try:
+            handler = self.handlers[name]
+        except KeyError:
+            raise KeyError("The offline backend does not support the query: %s" % name)
+        return iter(handler(**(parameters or {})))
+
+    def run(self, name, parameters=None):
+        """Answer the named query with a list of records, just like a Neo4j result."""
+        return list(self.stream(name, parameters))
+
+    def _domains_with_data(self):
+        domains = []
+        for node_id in self.nodes("Group"):
+            domain = self.domain(node_id)
+            if domain and domain not in domains:
+                domains.append(domain)
+        return [(domain,) for domain in domains]
+
+    def _all_domains(self):
+        return [(self.names[node_id],) for node_id in self.nodes("Domain")]
+
+    def _operating_systems(self, domain):
+        totals = {}
+        for computer in self.nodes("Computer", domain):
+            operating_system = self.prop(computer, "operatingsystem")
+            if operating_system:
+                totals[operating_system] = totals.get(operating_system, 0) + 1
+        return sorted(totals.items(), key=lambda record: record[1], reverse=True)
+
+    def _summary(self, domain):
+        users = enabled_users = 0
+        for user in self.nodes("User", domain):
+            users += 1
+            if self.prop(user, "enabled") is True:
+                enabled_users += 1
+        computers = unconstrained = 0
+        systems = {}
+        for computer in self.nodes("Computer", domain):
+            computers += 1
+            if self.prop(computer, "unconstraineddelegation") is True:
+                unconstrained += 1
+            operating_system = self.prop(computer, "operatingsystem")
+            if operating_system:
+                systems[operating_system] = systems.get(operating_system, 0) + 1
+        gpos = sum(1 for gpo in self.nodes("GPO", domain) if self.names[gpo])
+        blocked_ous = sum(1 for ou in self.nodes("OU", domain)
+                          if self.prop(ou, "blocksinheritance") is True)
+        return [(users, enabled_users, computers, unconstrained,
+                 [[name, total] for name, total in systems.items()], gpos, blocked_ous)]
+
+    def _gpos(self, domain):
+        return [(self.names[gpo],) for gpo in self.nodes("GPO", domain) if self.names[gpo]]
+
+    def _blocked_inheritance_ous(self, domain):
+        return [(self.names[ou],) for ou in self.nodes("OU", domain)
+                if self.prop(ou, "blocksinheritance") is True]
+
+    def _total_users(self, domain):
+        return [(sum(1 for _ in self.nodes("User", domain)),)]
+
+    def _total_enabled_users(self, domain):
+        return [(sum(1 for user in self.nodes("User", domain)
+                     if self.prop(user, "enabled") is True),)]
+
+    def _total_computers(self, domain):
+        return [(sum(1 for _ in self.nodes("Computer", domain)),)]
+
+    def _unconstrained_delegation(self, domain):
+        return [(self.names[computer],) for computer in self.nodes("Computer", domain)
+                if self.prop(computer, "unconstraineddelegation") is True]
+
+    def _old_pwdlastset(self, domain, cutoff):
+        for user in self.nodes("User", domain):
+            timestamp = self.prop(user, "pwdlastset")
+            if timestamp and timestamp < cutoff:
+                yield self.names[user], timestamp
+
+    def _pwdlastset_ages(self, domain, now, edges, cutoffs):
+        # Both lists are sorted once so each user is placed with a bisect instead of a scan
+        edges = sorted(edges)
+        cutoffs = sorted(cutoffs)
+        totals = {}
+        for user in self.nodes("User", domain):
+            timestamp = self.prop(user, "pwdlastset")
+            if not timestamp:
+                continue
+            key = (self.prop(user, "enabled") is True,
+                   bisect.bisect_right(edges, now - timestamp),
+                   len(cutoffs) - bisect.bisect_right(cutoffs, timestamp))
+            totals[key] = totals.get(key, 0) + 1
+        return [key + (total,) for key, total in totals.items()]
+
+    def _names(self, domain):
+        for label in ("User", "Group", "Computer"):
+            for node_id in self.nodes(label, domain):
+                yield label, self.names[node_id]
+
+    def _start_node(self, group_name):
+        group = self.lookup(group_name)
+        if group is None or self.labels[group] != "Group":
+            return []
+        return [(group,)]
+
+    def _inbound(self, ids):
+        for target in ids:
+            for rel_type, source in self.neighbours(target, reverse=True):
+                yield (source, rel_type, target, [self.labels[source]], self.domain(source),
+                       self.names[source])
+
+    def _outbound(self, ids):
+        for source in ids:
+            for rel_type, target in self.neighbours(source):
+                yield source, rel_type, target
+
+    def _principals(self, domain):
+        for label in ("User", "Computer"):
+            for node_id in self.nodes(label, domain):
+                yield node_id, label
+
+    def _membership_edges(self):
+        sources, targets = self.edges.get("MemberOf", ((), ()))
+        for member, group in zip(sources, targets):
+            yield (self.names[member], [self.labels[member]], self.domain(member),
+                   self.names[group], self.domain(group))
+
+    def _bulk_users(self):
+        for user in self.nodes("User"):
+            yield (user, self.domain(user), self.prop(user, "enabled"),
+                   self.prop(user, "pwdlastset"))
+
+    def _bulk_computers(self):
+        for computer in self.nodes("Computer"):
+            yield (computer, self.domain(computer), self.prop(computer, "operatingsystem"),
+                   self.prop(computer, "unconstraineddelegation"))
+
+    def _bulk_groups(self):
+        for group in self.nodes("Group"):
+            yield group, self.domain(group)
+
+    def _bulk_containers(self):
+        for gpo in self.nodes("GPO"):
+            yield gpo, "GPO", self.domain(gpo), bool(self.names[gpo])
+        for ou in self.nodes("OU"):
+            yield ou, "OU", self.domain(ou), self.prop(ou, "blocksinheritance") is True
+
+    def _bulk_memberships(self):
+        sources, targets = self.edges.get("MemberOf", ((), ()))
+        return zip(sources, targets)
+
+    def _snapshot_nodes(self):
+        for node_id in range(len(self)):
+            label = self.labels[node_id]
+            yield node_id, [label] if label else [], self.names[node_id], self.properties[node_id]
+
+    def _snapshot_edges(self):
+        for rel_type, (sources, targets) in self.edges.items():
+            for source, target in zip(sources, targets):
+                yield source, rel_type, target
+
+    def _rights_edges(self):
+        for rel_type in ("AdminTo", "CanRDP", "ExecuteDCOM"):
+            sources, targets = self.edges.get(rel_type, ((), ()))
+            for principal, computer in zip(sources, targets):
+                if self.labels[computer] == "Computer":
+                    yield (self.names[principal], [self.labels[principal]],
+                           self.domain(principal), rel_type, self.names[computer],
+                           self.domain(computer))
+
+    def _spn_users(self, domain):
+        return [(self.names[user],) for user in self.nodes("User", domain)
+                if self.prop(user, "hasspn") is True]
+
+    def _sessions_edges(self):
+        sources, targets = self.edges.get("HasSession", ((), ()))
+        for computer, user in zip(sources, targets):
+            if self.labels[computer] == "Computer" and self.labels[user] == "User":
+                yield self.names[computer], self.domain(computer), self.names[user]
+
+    def _fingerprint_counts(self):
+        totals = {}
+        for label in self.labels:
+            totals[label] = totals.get(label, 0) + 1
+        for rel_type, (sources, _) in self.edges.items():
+            totals[rel_type] = len(sources)
+        return sorted(totals.items(), key=lambda record: str(record[0]))
+
+    def _fingerprint_sample(self, sample):
+        samples = {}
+        for node_id, label in enumerate(self.labels):
+            nodes = samples.setdefault(label, [])
+            if len(nodes) < sample:
+                nodes.append([self.names[node_id], sorted(self.properties[node_id].items())])
+        for rel_type, (sources, targets) in self.edges.items():
+            samples[rel_type] = [[self.names[source], self.names[target]]
+                                 for source, target in zip(sources[:sample], targets[:sample])]
+        return sorted(samples.items(), key=lambda record: str(record[0]))
+
+
+def _collection_kind(key, filename):
+    """Work out what a streamed array holds from its key or, for newer SharpHound versions
+    that use a generic "data" key, from the file's name.
+    """
+    key = key.lower()
+    if key in COLLECTION_LABELS or key == "sessions":
+        return key
+    filename = os.path.basename(filename).lower()
+    for kind in list(COLLECTION_LABELS) + ["sessions"]:
+        if kind in filename:
+            return kind
+    return None
+
+
+def load_file(graph, handle, filename):
+    """Stream a single SharpHound JSON file into the graph."""
+    for key, entry in _JsonStream(handle).items():
+        if key == "meta" or not isinstance(entry, dict):
+            continue
+        kind = _collection_kind(key, filename)
+        if kind == "sessions":
+            graph.add_session(entry)
+        elif kind:
+            graph.add_object(kind, entry)
+
+
+def load_collection(path):
+    """Build an OfflineGraph from a SharpHound ZIP, a directory of JSON files, or a single
+    JSON file.
+    """
+    graph = OfflineGraph()
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if member.lower().endswith(".json"):
+                    with archive.open(member) as raw:
+                        load_file(graph, io.TextIOWrapper(raw, encoding="utf-8-sig"), member)
+    else:
+        if os.path.isdir(path):
+            files = [os.path.join(path, filename) for filename in sorted(os.listdir(path))
+                     if filename.lower().endswith(".json")]
+        else:
+            files = [path]
+        for filename in files:
+            with open(filename, encoding="utf-8-sig") as handle:
+                load_file(graph, handle, filename)
+    return graph
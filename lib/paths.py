@@ -0,0 +1,296 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the reverse breadth-first search used for the paths to Domain Admin
+metrics. Instead of asking for a shortest path from every principal, the search walks inbound
+relationships out from the target group once and records every principal's hop distance.
+"""
+
+import math
+import time
+import random
+from collections import Counter
+from lib import helpers
+
+# Labels that matter for the per-type path statistics, in order of preference
+PRINCIPAL_LABELS = ("User", "Computer", "Group", "Domain", "GPO", "OU")
+
+# Frontier IDs are sent to Neo4j in batches to keep each query's parameters reasonable
+BATCH_SIZE = 10000
+
+# Number of sampled principals searched together in each round of an estimate
+SAMPLE_BATCH = 100
+
+# z value for the 95% confidence intervals of the estimates
+Z_95 = 1.96
+
+
+def _principal_label(labels):
+    """Pick the BloodHound object type out of a node's labels."""
+    for label in PRINCIPAL_LABELS:
+        if label in labels:
+            return label
+    return None
+
+
+class PathStats(object):
+    """Hop distances to a target group for every principal that can reach it, along with the
+    statistics Fox reports for the principals in one domain.
+    """
+
+    def __init__(self, domain, target, distances, edges, names=None):
+        """Everything that should be initiated with a new object goes here."""
+        self.domain = domain.upper()
+        self.target = target
+        # Node ID -> (hops, label, domain)
+        self.distances = distances
+        # (source, rel_type, target) for every relationship the search walked
+        self.edges = edges
+        # Node ID -> name, for the target and every node with a path to it
+        self.names = names or {}
+
+    def _lengths(self, label=None):
+        """Yield the path lengths for the domain's principals, optionally for one label."""
+        for hops, node_label, node_domain in self.distances.values():
+            if node_domain != self.domain:
+                continue
+            if label and node_label != label:
+                continue
+            yield hops
+
+    def rows(self):
+        """Yield (name, label, hops) for the domain's principals with a path, nearest first."""
+        for node, (hops, label, node_domain) in sorted(self.distances.items(),
+                                                       key=lambda item: item[1][0]):
+            if node_domain == self.domain:
+                yield self.names.get(node), label, hops
+
+    def count(self, label=None):
+        """Return the number of principals with a path to the target."""
+        return sum(1 for _ in self._lengths(label))
+
+    def average(self, label=None):
+        """Return the average path length, or None if nothing has a path."""
+        lengths = list(self._lengths(label))
+        if not lengths:
+            return None
+        return sum(lengths) / len(lengths)
+
+    def histogram(self, label=None):
+        """Return a dictionary of path length -> number of principals, sorted by length."""
+        counts = Counter(self._lengths(label))
+        return dict(sorted(counts.items()))
+
+    def percentage(self, label, total):
+        """Return the percentage of the given total with a path to the target."""
+        if not total:
+            return 0
+        return 100.0 * self.count(label) / total
+
+
+def reverse_bfs(driver, domain, group_name):
+    """Walk inbound relationships out from the named group and return a PathStats object with
+    the hop distance of every principal that has a path to it.
+    """
+    distances = {}
+    edges = []
+    names = {}
+    start = helpers.query_value(driver, "paths.start_node", group_name=group_name)
+
+    if start is not None:
+        names[start] = group_name
+        visited = {start}
+        frontier = [start]
+        hops = 0
+        while frontier:
+            hops += 1
+            next_frontier = []
+            for offset in range(0, len(frontier), BATCH_SIZE):
+                batch = frontier[offset:offset + BATCH_SIZE]
+                results = helpers.stream_query(driver, "paths.inbound", ids=batch)
+                for source, rel_type, target, labels, node_domain, name in results:
+                    edges.append((source, rel_type, target))
+                    if source in visited:
+                        continue
+                    visited.add(source)
+                    names[source] = name
+                    distances[source] = (hops, _principal_label(labels),
+                                         (node_domain or "").upper())
+                    next_frontier.append(source)
+            frontier = next_frontier
+
+    return PathStats(domain, start, distances, edges, names)
+
+
+def _wilson(successes, trials, population):
+    """Return (proportion, low, high) for the Wilson score interval, narrowed by the finite
+    population correction so the interval closes once the whole population has been sampled.
+    """
+    proportion = successes / trials
+    correction = 0.0
+    if population > 1:
+        correction = math.sqrt(max(0.0, (population - trials) / (population - 1)))
+    scale = 1 + Z_95 ** 2 / trials
+    centre = (proportion + Z_95 ** 2 / (2 * trials)) / scale
+    half = Z_95 * math.sqrt(proportion * (1 - proportion) / trials +
+                            Z_95 ** 2 / (4 * trials ** 2)) / scale
+    centre = proportion + (centre - proportion) * correction
+    half *= correction
+    return proportion, max(0.0, centre - half), min(1.0, centre + half)
+
+
+class PathEstimate(object):
+    """Path statistics for a domain estimated from a stratified sample of its users and
+    computers. Every estimate is returned as (value, low, high), where low and high bound the
+    95% confidence interval.
+    """
+
+    def __init__(self, domain, totals=None):
+        """Everything that should be initiated with a new object goes here."""
+        self.domain = domain.upper()
+        # Label -> number of principals in the domain, searched, and with a path
+        self.totals = totals or {}
+        self.sampled = dict((label, 0) for label in self.totals)
+        self.reached = dict((label, 0) for label in self.totals)
+        # Label -> hop counts of the searched principals with a path
+        self.hops = dict((label, []) for label in self.totals)
+        self.seconds = 0.0
+
+    def add(self, label, hops):
+        """Record one searched principal and its path length, or None if it has no path."""
+        self.sampled[label] += 1
+        if hops is not None:
+            self.reached[label] += 1
+            self.hops[label].append(hops)
+
+    def complete(self):
+        """Return True if every principal was searched, making the estimates exact."""
+        return all(self.sampled[label] == total for label, total in self.totals.items())
+
+    def proportion(self, label):
+        """Return the estimated share of the label's principals with a path, or None."""
+        if not self.sampled.get(label):
+            return None
+        return _wilson(self.reached[label], self.sampled[label], self.totals[label])
+
+    def percentage(self, label):
+        """Return the estimated percentage of the label's principals with a path, or None."""
+        proportion = self.proportion(label)
+        if proportion is None:
+            return None
+        return tuple(100.0 * value for value in proportion)
+
+    def count(self, label):
+        """Return the estimated number of the label's principals with a path, or None."""
+        proportion = self.proportion(label)
+        if proportion is None:
+            return None
+        return tuple(int(round(value * self.totals[label])) for value in proportion)
+
+    def average(self):
+        """Return the estimated average path length of the users and computers with a path,
+        or None. Each searched principal stands in for total / sampled principals of its type.
+        """
+        weighted = []
+        for label, hops in self.hops.items():
+            weight = self.totals[label] / self.sampled[label] if self.sampled[label] else 0
+            weighted.extend((weight, length) for length in hops)
+        total_weight = sum(weight for weight, _ in weighted)
+        if not total_weight:
+            return None
+        mean = sum(weight * length for weight, length in weighted) / total_weight
+        if self.complete():
+            return mean, mean, mean
+        variance = sum((weight * (length - mean)) ** 2
+                       for weight, length in weighted) / total_weight ** 2
+        half = Z_95 * math.sqrt(variance)
+        return mean, max(0.0, mean - half), mean + half
+
+
+def _forward_search(driver, sources, target, deadline):
+    """Search outbound relationships from every source at once, one hop at a time, and return
+    a dictionary of source -> hops to the target, or None if it has no path. Sources that are
+    still being searched when the deadline passes are left out.
+    """
+    hops = {}
+    visited = dict((source, {source}) for source in sources)
+    frontiers = dict((source, [source]) for source in sources)
+    depth = 0
+    while frontiers and time.perf_counter() < deadline:
+        depth += 1
+        nodes = sorted(set(node for frontier in frontiers.values() for node in frontier))
+        neighbours = {}
+        for offset in range(0, len(nodes), BATCH_SIZE):
+            results = helpers.stream_query(driver, "paths.outbound",
+                                           ids=nodes[offset:offset + BATCH_SIZE])
+            for source, _, target_node in results:
+                neighbours.setdefault(source, []).append(target_node)
+        next_frontiers = {}
+        for source, frontier in frontiers.items():
+            seen = visited[source]
+            next_frontier = []
+            found = False
+            for node in frontier:
+                for neighbour in neighbours.get(node, ()):
+                    if neighbour == target:
+                        found = True
+                        break
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        next_frontier.append(neighbour)
+                if found:
+                    break
+            if found:
+                hops[source] = depth
+                del visited[source]
+            elif next_frontier:
+                next_frontiers[source] = next_frontier
+            else:
+                hops[source] = None
+                del visited[source]
+        frontiers = next_frontiers
+    return hops
+
+
+def estimate_paths(driver, domain, group_name, budget, seed=1, batch=SAMPLE_BATCH):
+    """Estimate the path statistics to the named group by searching forward from randomly
+    sampled users and computers until the time budget (in seconds) runs out. Every round takes
+    the same share of each type, so both are sampled in proportion to their numbers, and the
+    rounds start small and double up to batch sources so even a short budget gets an estimate.
+    Returns a PathEstimate, which is exact if every principal could be searched in time.
+    """
+    started = time.perf_counter()
+    deadline = started + budget
+    principals = {}
+    for node, label in helpers.stream_query(driver, "paths.principals", domain=domain):
+        principals.setdefault(label, []).append(node)
+    estimate = PathEstimate(domain, dict((label, len(nodes))
+                                         for label, nodes in principals.items()))
+    rng = random.Random(seed)
+    for nodes in principals.values():
+        nodes.sort()
+        rng.shuffle(nodes)
+
+    target = helpers.query_value(driver, "paths.start_node", group_name=group_name)
+    total = sum(estimate.totals.values())
+    size = max(1, batch // 16)
+    while not estimate.complete() and time.perf_counter() < deadline:
+        sources = []
+        for label, nodes in principals.items():
+            share = max(1, int(math.ceil(size * len(nodes) / total)))
+            taken = estimate.sampled[label]
+            sources.extend((node, label) for node in nodes[taken:taken + share])
+        if target is None:
+            hops = dict((node, None) for node, _ in sources)
+        else:
+            hops = _forward_search(driver, [node for node, _ in sources], target, deadline)
+        if len(hops) < len(sources):
+            # The deadline passed part way through the round, so its sources are dropped
+            # rather than keeping only the ones that finished first
+            break
+        for node, label in sources:
+            estimate.add(label, hops[node])
+        size = min(batch, size * 2)
+
+    estimate.seconds = time.perf_counter() - started
+    return estimate
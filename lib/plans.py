@@ -0,0 +1,354 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the preflight check for Fox's queries. Every registry query is run with
+EXPLAIN and its plan is checked for operators that get slow on large datasets: scans of every
+node, label scans that are filtered on a property, and cartesian products. The indexes Fox's
+lookups depend on are compared with the ones in the database and, with the user's consent, the
+missing ones are created and the estimates compared before and after.
+
+The same plans are used to catch regressions before a release: every query is planned against a
+database loaded with a small synthetic fixture, and the run fails if a plan gains one of the
+flagged operators or its estimated rows grow past a stored baseline.
+"""
+
+import re
+import json
+from colors import red, green, yellow
+from lib import queries
+
+# Operators that are always worth flagging
+FLAGGED_OPERATORS = ("AllNodesScan", "CartesianProduct")
+
+# Label scans are flagged when a filter sits right on top of them, since an index could answer
+# the property lookup instead
+LABEL_SCAN = "NodeByLabelScan"
+
+# The (label, property) lookups Fox's queries filter on
+INDEXES = (
+    ("User", "domain"),
+    ("User", "name"),
+    ("Computer", "domain"),
+    ("Computer", "name"),
+    ("Group", "domain"),
+    ("Group", "name"),
+    ("GPO", "domain"),
+    ("OU", "domain"),
+)
+
+# Queries that read the whole graph on purpose, and the flagged operators they are allowed
+EXPECTED_SCANS = {
+    "snapshot.nodes": ("AllNodesScan",),
+    "snapshot.edges": ("AllNodesScan",),
+    "fingerprint.sample": ("AllNodesScan",),
+}
+
+# Where the estimated rows of every query are kept between checks
+BASELINE_FILE = "plan_baseline.json"
+BASELINE_VERSION = 1
+
+# How far, as a fraction, a query's estimated rows may grow past its baseline
+ROW_TOLERANCE = 0.2
+
+# The synthetic fixture the baseline is recorded against
+FIXTURE_OBJECTS = 2000
+FIXTURE_DOMAINS = 2
+
+# Nodes or relationships created per query when loading the fixture
+FIXTURE_BATCH = 1000
+
+# The offline graph keeps its properties in lower case, so they are written back with the
+# names Fox's queries filter on
+FIXTURE_PROPERTIES = {
+    "domain": "domain",
+    "enabled": "Enabled",
+    "pwdlastset": "PwdLastSet",
+    "hasspn": "HasSPN",
+    "unconstraineddelegation": "UnconstrainedDelegation",
+    "operatingsystem": "OperatingSystem",
+    "blocksinheritance": "blocksInheritance",
+}
+
+
+class PlanReport(object):
+    """The operators and estimates from one query's EXPLAIN plan."""
+
+    def __init__(self, name, plan=None, error=None):
+        """Everything that should be initiated with a new object goes here."""
+        self.name = name
+        self.error = error
+        self.operators = []
+        self.flagged = []
+        self.estimated_rows = 0
+        if plan is not None:
+            self._walk(plan, None)
+
+    def _walk(self, plan, parent):
+        """Collect the operators, flagged operators, and estimated rows of a plan tree."""
+        operator = _operator(plan)
+        self.operators.append(operator)
+        arguments = getattr(plan, "arguments", None) or {}
+        self.estimated_rows += int(arguments.get("EstimatedRows", 0) or 0)
+        if operator in FLAGGED_OPERATORS:
+            self.flagged.append(operator)
+        elif operator == LABEL_SCAN and parent and parent.startswith("Filter"):
+            self.flagged.append("%s + Filter" % operator)
+        for child in getattr(plan, "children", None) or []:
+            self._walk(child, operator)
+
+
+def _operator(plan):
+    """Return a plan operator's name without the @neo4j suffix newer versions add."""
+    return (getattr(plan, "operator_type", None) or "?").split("@")[0]
+
+
+def explain(driver, name):
+    """Return the PlanReport for the named registry query."""
+    try:
+        with driver.session() as session:
+            result = session.run("EXPLAIN " + queries.get_query(name),
+                                 queries.PREWARM_PARAMETERS)
+            return PlanReport(name, result.summary().plan)
+    except Exception as error:
+        return PlanReport(name, error=str(error))
+
+
+def explain_all(driver):
+    """Return a PlanReport for every registry query, keyed by name."""
+    return dict((name, explain(driver, name)) for name in sorted(queries.QUERIES))
+
+
+def existing_indexes(driver):
+    """Return the set of (label, property) pairs with an index or uniqueness constraint.
+    Different Neo4j versions describe their indexes differently, so the description is parsed
+    when the label and properties are not given as columns.
+    """
+    indexes = set()
+    with driver.session() as session:
+        for record in session.run("CALL db.indexes()"):
+            values = dict(record.items())
+            labels = values.get("tokenNames") or values.get("labelsOrTypes") or \
+                [values.get("label")]
+            properties = values.get("properties") or []
+            if not labels[0] and values.get("description"):
+                match = re.search(r":(\w+)\((\w+)\)", values["description"])
+                if match:
+                    labels, properties = [match.group(1)], [match.group(2)]
+            for label in labels:
+                if label and len(properties) == 1:
+                    indexes.add((label, properties[0]))
+    return indexes
+
+
+def missing_indexes(driver):
+    """Return the (label, property) lookups Fox uses that have no index."""
+    existing = existing_indexes(driver)
+    return [index for index in INDEXES if index not in existing]
+
+
+def create_indexes(driver, indexes):
+    """Create the given (label, property) indexes and wait for them to come online."""
+    with driver.session() as session:
+        for label, prop in indexes:
+            print(yellow("[!] Creating an index on :%s(%s)..." % (label, prop)))
+            session.run("CREATE INDEX ON :%s(%s)" % (label, prop)).consume()
+        session.run("CALL db.awaitIndexes()").consume()
+
+
+def print_reports(reports, before=None):
+    """Print the flagged queries and their estimated rows, and the change from the earlier
+    reports if they are given.
+    """
+    flagged = [report for report in reports.values() if report.flagged or report.error]
+    if not flagged:
+        print(green("[+] None of the %s queries scan every node, filter label scans, or build \
+cartesian products." % len(reports)))
+    for report in flagged:
+        if report.error:
+            print(red("[X] Could not EXPLAIN the %s query." % report.name))
+            print(red("L.. Details: %s" % report.error))
+            continue
+        print(yellow("[!] %s: %s" % (report.name, ", ".join(sorted(set(report.flagged))))))
+    if before:
+        print(green("Estimated rows before and after:"))
+        for name in sorted(reports):
+            if name in before and before[name].estimated_rows != reports[name].estimated_rows:
+                print(yellow("\t%s\t%s -> %s" % (name, before[name].estimated_rows,
+                                                 reports[name].estimated_rows)))
+
+
+def preflight(driver, create=False, confirm=None):
+    """Check every query's plan and the indexes behind Fox's lookups. If create is set, the
+    missing indexes are created (after confirm() agrees, if it is given) and the plans are
+    checked again. Returns the final PlanReports.
+    """
+    print(green("[+] Checking the plans for %s queries..." % len(queries.QUERIES)))
+    reports = explain_all(driver)
+    print_reports(reports)
+
+    try:
+        missing = missing_indexes(driver)
+    except Exception as error:
+        print(red("[X] Could not list the database's indexes."))
+        print(red("L.. Details: {}".format(error)))
+        return reports
+    if not missing:
+        print(green("[+] Every lookup Fox uses is indexed."))
+        return reports
+    print(yellow("[!] These lookups have no index:"))
+    for label, prop in missing:
+        print(yellow("\t:%s(%s)" % (label, prop)))
+    if not create:
+        print(yellow("L.. Run the preflight command with --create-indexes to create them."))
+        return reports
+    if confirm and not confirm("Create %s indexes in the database?" % len(missing)):
+        return reports
+
+    create_indexes(driver, missing)
+    print(green("[+] Created %s indexes. Checking the plans again..." % len(missing)))
+    after = explain_all(driver)
+    print_reports(after, reports)
+    return after
+
+
+def _batches(items, size):
+    """Yield consecutive slices of a list with at most size items each."""
+    for offset in range(0, len(items), size):
+        yield items[offset:offset + size]
+
+
+def load_fixture(driver, graph, batch_size=FIXTURE_BATCH):
+    """Load an OfflineGraph, like a synthetic dataset, into an empty database and create the
+    indexes Fox relies on, so plans can be compared from one run to the next. Returns False
+    without changing anything if the database already holds data.
+    """
+    with driver.session() as session:
+        if session.run("MATCH (n) RETURN count(n)").single()[0]:
+            print(red("[X] The database already holds data -- load the plan fixture into an \
+empty database instead."))
+            return False
+
+        print(yellow("[!] Loading a fixture graph of %s nodes..." % len(graph)))
+        by_label = {}
+        for node_id in range(len(graph)):
+            by_label.setdefault(graph.labels[node_id], []).append(node_id)
+        database_ids = [None] * len(graph)
+        for label in sorted(by_label, key=lambda label: label or ""):
+            create = "UNWIND $rows AS row CREATE (n%s) SET n = row RETURN id(n)" \
+                % (":" + label if label else "")
+            for batch in _batches(by_label[label], batch_size):
+                rows = []
+                for node_id in batch:
+                    properties = dict((FIXTURE_PROPERTIES.get(key, key), value)
+                                      for key, value in graph.properties[node_id].items())
+                    properties["name"] = graph.names[node_id]
+                    rows.append(properties)
+                for node_id, record in zip(batch, session.run(create, rows=rows)):
+                    database_ids[node_id] = record[0]
+
+        relationships = 0
+        for rel_type in sorted(graph.rel_types()):
+            indptr, indices = graph._csr(rel_type)
+            edges = [[database_ids[source], database_ids[indices[position]]]
+                     for source in range(len(graph))
+                     for position in range(indptr[source], indptr[source + 1])]
+            create = "UNWIND $edges AS edge MATCH (a) WHERE id(a) = edge[0] MATCH (b) \
+WHERE id(b) = edge[1] CREATE (a)-[:%s]->(b)" % rel_type
+            for batch in _batches(edges, batch_size):
+                session.run(create, edges=batch).consume()
+            relationships += len(edges)
+    print(green("[+] Loaded %s nodes and %s relationships." % (len(graph), relationships)))
+
+    missing = missing_indexes(driver)
+    if missing:
+        create_indexes(driver, missing)
+    return True
+
+
+def read_baseline(path=BASELINE_FILE):
+    """Return the baseline from a previous check, keyed by query name, or None if there is no
+    usable baseline at the path.
+    """
+    try:
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)
+    except OSError:
+        print(red("[X] There is no plan baseline at {} -- record one with --update-baseline."
+                  .format(path)))
+        return None
+    except ValueError as error:
+        print(red("[X] The plan baseline at {} could not be read.".format(path)))
+        print(red("L.. Details: {}".format(error)))
+        return None
+    if baseline.get("version") != BASELINE_VERSION:
+        print(red("[X] The plan baseline at {} was written by another version of Fox -- record \
+a new one with --update-baseline.".format(path)))
+        return None
+    return baseline["queries"]
+
+
+def write_baseline(reports, path=BASELINE_FILE):
+    """Write the estimated rows and operators of every query that could be planned."""
+    baseline = {"version": BASELINE_VERSION, "queries": {}}
+    for name, report in sorted(reports.items()):
+        if report.error:
+            continue
+        baseline["queries"][name] = {"estimated_rows": report.estimated_rows,
+                                     "operators": sorted(set(report.operators))}
+    with open(path, "w") as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+
+
+def find_regressions(reports, baseline=None, tolerance=ROW_TOLERANCE):
+    """Return (name, problem) pairs for the queries that could not be planned, whose plans have
+    a flagged operator they are not expected to have, or, if a baseline is given, whose
+    estimated rows grew past it by more than the tolerance.
+    """
+    problems = []
+    for name in sorted(reports):
+        report = reports[name]
+        if report.error:
+            problems.append((name, "could not be planned: %s" % report.error))
+            continue
+        unexpected = sorted(set(report.flagged) - set(EXPECTED_SCANS.get(name, ())))
+        if unexpected:
+            problems.append((name, "plan contains %s" % ", ".join(unexpected)))
+        if baseline is None:
+            continue
+        expected = baseline.get(name)
+        if expected is None:
+            problems.append((name, "has no baseline -- record one with --update-baseline"))
+            continue
+        if report.estimated_rows > expected["estimated_rows"] * (1 + tolerance):
+            problem = "estimates %s rows, up from %s" % (report.estimated_rows,
+                                                         expected["estimated_rows"])
+            added = sorted(set(report.operators) - set(expected.get("operators", [])))
+            if added:
+                problem += " (new operators: %s)" % ", ".join(added)
+            problems.append((name, problem))
+    return problems
+
+
+def check_regressions(driver, path=BASELINE_FILE, update=False, tolerance=ROW_TOLERANCE):
+    """Plan every query and compare the plans with the baseline, or record a new baseline if
+    update is set. Returns True if no plan regressed.
+    """
+    print(green("[+] Checking the plans for %s queries..." % len(queries.QUERIES)))
+    reports = explain_all(driver)
+    baseline = None
+    if not update:
+        baseline = read_baseline(path)
+        if baseline is None:
+            return False
+    problems = find_regressions(reports, baseline, tolerance)
+    for name, problem in problems:
+        print(red("[X] %s %s" % (name, problem)))
+    if update:
+        write_baseline(reports, path)
+        print(green("[+] Wrote the plan baseline to {}.".format(path)))
+    if problems:
+        print(red("[X] %s of %s query plans regressed."
+                  % (len(set(name for name, _ in problems)), len(reports))))
+        return False
+    print(green("[+] None of the %s query plans regressed." % len(reports)))
+    return True
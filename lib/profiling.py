@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the per-query profiler behind the --profile option. Every registry
+query that goes through the helpers is timed and its rows and bytes are counted. Against Neo4j
+the queries are sent with PROFILE, so the database hits and operators of each plan are kept as
+well. The results are printed as a table sorted by time and written to a JSON trace file.
+"""
+
+import json
+import time
+import threading
+from datetime import datetime
+from colors import red, green, yellow
+
+
+def _record_size(record):
+    """Estimate the bytes received for a record from the size of its values as text."""
+    return sum(len(str(value).encode("utf-8")) for value in record)
+
+
+def _parameters(parameters):
+    """Summarize query parameters for the trace, replacing long lists with their length."""
+    summary = {}
+    for key, value in parameters.items():
+        if isinstance(value, (list, tuple, set)):
+            summary[key] = "%s items" % len(value)
+        else:
+            summary[key] = value
+    return summary
+
+
+def _plan_details(plan):
+    """Return the total database hits and the operators, in order, of a profiled plan."""
+    db_hits = 0
+    operators = []
+    pending = [plan]
+    while pending:
+        current = pending.pop(0)
+        db_hits += getattr(current, "db_hits", 0) or 0
+        operators.append(getattr(current, "operator_type", "?"))
+        pending.extend(getattr(current, "children", None) or [])
+    return db_hits, operators
+
+
+class Profiler(object):
+    """Collects a trace entry for every profiled query execution."""
+
+    def __init__(self):
+        """Everything that should be initiated with a new object goes here."""
+        self.enabled = False
+        self.started = time.time()
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def enable(self):
+        """Start recording query executions."""
+        self.enabled = True
+        self.started = time.time()
+        self.calls = []
+
+    def watch(self, name, parameters, records, result=None):
+        """Generator that passes the records through while timing how long each one takes to
+        arrive. Time spent by the caller between records is not counted. When a Neo4j result is
+        read to the end its profiled plan is added to the entry.
+        """
+        entry = {
+            "name": name,
+            "parameters": _parameters(parameters),
+            "offset": round(time.time() - self.started, 6),
+            "seconds": 0.0,
+            "rows": 0,
+            "bytes": 0,
+            "db_hits": None,
+            "operators": [],
+            "complete": False,
+        }
+        iterator = iter(records)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    record = next(iterator)
+                except StopIteration:
+                    entry["seconds"] += time.perf_counter() - start
+                    entry["complete"] = True
+                    break
+                entry["seconds"] += time.perf_counter() - start
+                entry["rows"] += 1
+                entry["bytes"] += _record_size(record)
+                yield record
+            if result is not None:
+                plan = getattr(result.summary(), "profile", None)
+                if plan is not None:
+                    entry["db_hits"], entry["operators"] = _plan_details(plan)
+        finally:
+            entry["seconds"] = round(entry["seconds"], 6)
+            with self.lock:
+                self.calls.append(entry)
+
+    def summary(self):
+        """Return the per-query totals as a list of dictionaries, slowest first."""
+        totals = {}
+        for call in self.calls:
+            total = totals.setdefault(call["name"], {"name": call["name"], "calls": 0,
+                                                     "seconds": 0.0, "rows": 0, "bytes": 0,
+                                                     "db_hits": None})
+            total["calls"] += 1
+            total["seconds"] += call["seconds"]
+            total["rows"] += call["rows"]
+            total["bytes"] += call["bytes"]
+            if call["db_hits"] is not None:
+                total["db_hits"] = (total["db_hits"] or 0) + call["db_hits"]
+        return sorted(totals.values(), key=lambda total: total["seconds"], reverse=True)
+
+    def print_report(self):
+        """Print the per-query totals as a table, slowest first."""
+        print(green("\n[+] Query profile (slowest first):"))
+        print(green("%-40s %6s %10s %10s %12s %12s"
+                    % ("Query", "Calls", "Seconds", "Rows", "Bytes", "DB hits")))
+        for total in self.summary():
+            db_hits = total["db_hits"] if total["db_hits"] is not None else "-"
+            print(yellow("%-40s %6s %10.3f %10s %12s %12s"
+                         % (total["name"], total["calls"], total["seconds"], total["rows"],
+                            total["bytes"], db_hits)))
+
+    def write_trace(self, path, source=None):
+        """Write every recorded call and the per-query totals to a JSON trace file."""
+        trace = {
+            "started": datetime.fromtimestamp(self.started).isoformat(),
+            "source": source,
+            "seconds": round(time.time() - self.started, 6),
+            "summary": self.summary(),
+            "calls": self.calls,
+        }
+        try:
+            with open(path, "w") as trace_file:
+                json.dump(trace, trace_file, indent=2, default=str)
+            print(green("[+] Wrote the query trace to {}.".format(path)))
+        except OSError as error:
+            print(red("[X] Could not write the query trace to {}.".format(path)))
+            print(red("L.. Details: {}".format(error)))
+
+
+profiler = Profiler()
@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the incremental report. Each domain's section is printed as soon as
+every one of its tasks is done, while a progress line on stderr shows how many queries are
+done, the elapsed time, and an estimate of the time left based on how long each query took in
+previous runs. If the run is interrupted, whatever has finished is printed as a partial report
+and written to a JSON file.
+"""
+
+import os
+import sys
+import json
+import time
+from colors import red, green, yellow
+from lib import cache, report, service
+
+# File in the cache directory that keeps how long each task took in previous runs
+HISTORY_FILE = "timings.json"
+
+# Weight of the newest run in each task's running average
+SMOOTHING = 0.5
+
+# Tasks that take at least this many seconds are logged when stderr is not a terminal, and
+# runs expected to take at least this long get an estimate up front
+SLOW_TASK = 5.0
+
+
+def format_duration(seconds):
+    """Format a number of seconds as M:SS, or H:MM:SS for an hour or more."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "%d:%02d:%02d" % (hours, minutes, seconds)
+    return "%d:%02d" % (minutes, seconds)
+
+
+class TimingHistory(object):
+    """A running average of how long each task took in previous runs against a dataset (the
+    database URI or offline path), kept on disk.
+    """
+
+    def __init__(self, source, path=None):
+        """Everything that should be initiated with a new object goes here."""
+        self.source = source
+        self.path = path or os.path.join(cache.default_directory(), HISTORY_FILE)
+        try:
+            with open(self.path) as history_file:
+                self.sources = json.load(history_file)
+            if not isinstance(self.sources, dict):
+                raise ValueError("The timing history is not a dictionary of datasets")
+        except (OSError, ValueError):
+            self.sources = {}
+        # A broken entry only resets this dataset's timings, so saving keeps the others
+        try:
+            self.timings = dict((name, float(seconds))
+                                for name, seconds in self.sources.get(source, {}).items())
+        except (ValueError, AttributeError, TypeError):
+            self.timings = {}
+
+    def expected(self, name):
+        """Return how long the named task usually takes, or None if it has never run."""
+        return self.timings.get(name)
+
+    def record(self, name, seconds):
+        """Fold a new timing for the named task into its running average."""
+        previous = self.timings.get(name)
+        if previous is None:
+            self.timings[name] = seconds
+        else:
+            self.timings[name] = previous + SMOOTHING * (seconds - previous)
+
+    def save(self):
+        """Write the timings back to disk. A history that cannot be written is skipped."""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.sources[self.source] = self.timings
+            with open(self.path, "w") as history_file:
+                json.dump(self.sources, history_file, indent=2, sort_keys=True)
+        except OSError as error:
+            print(yellow("[!] Could not save the query timings to {}.".format(self.path)),
+                  file=sys.stderr)
+            print(yellow("L.. Details: {}".format(error)), file=sys.stderr)
+
+
+class ReportProgress(object):
+    """Collects task results as they arrive from helpers.run_tasks, prints each domain's
+    section of the report as soon as it is complete (in the order of the domains), and shows
+    the progress of the run on stderr.
+    """
+
+    def __init__(self, all_domains, tasks, workers=1, source=None):
+        """Everything that should be initiated with a new object goes here."""
+        self.domains = [domain.upper() for domain in all_domains if domain]
+        self.tasks = tasks
+        self.workers = max(workers, 1)
+        self.history = TimingHistory(source)
+        self.defaults = dict((task[:2], task[4]) for task in tasks)
+        # Domain -> names of its report tasks that are not done yet. Exports are not part of
+        # the printed report, so they do not hold a section back.
+        self.pending = dict((domain, set()) for domain in self.domains)
+        for domain, name in self.defaults:
+            if domain in self.pending and not name.startswith("export."):
+                self.pending[domain].add(name)
+        self.remaining = set(self.defaults)
+        self.results = {}
+        self.printed = 0
+        self.totals = [0, 0, 0]
+        self.started = time.time()
+        self.interactive = sys.stderr.isatty()
+
+    def estimate(self):
+        """Return the expected seconds left from previous runs, or None if none of the tasks
+        that are left has run before.
+        """
+        expected = [self.history.expected(name) for _, name in self.remaining]
+        known = [seconds for seconds in expected if seconds is not None]
+        if not known:
+            return None
+        return sum(known) / self.workers
+
+    def start(self):
+        """Print how long the whole run is expected to take, unless it is quick."""
+        estimate = self.estimate()
+        if estimate is not None and estimate >= SLOW_TASK:
+            print(green("[+] Based on previous runs, this should take about %s."
+                        % format_duration(estimate)))
+
+    def finished(self, task, result, seconds):
+        """Record a finished task, show the progress, and print every section that is ready."""
+        domain, name = task[:2]
+        self.results[(domain, name)] = result
+        self.remaining.discard((domain, name))
+        if domain in self.pending:
+            self.pending[domain].discard(name)
+        if seconds is not None:
+            self.history.record(name, seconds)
+        self._show(domain, name, seconds)
+        self._print_ready()
+
+    def _show(self, domain, name, seconds):
+        """Show the progress line."""
+        done = len(self.defaults) - len(self.remaining)
+        line = "[!] %s of %s queries done, %s elapsed" % (done, len(self.defaults),
+                                                           format_duration(self.elapsed()))
+        estimate = self.estimate()
+        if estimate is not None and self.remaining:
+            line += ", about %s left" % format_duration(estimate)
+        took = "cached" if seconds is None else "%.1fs" % seconds
+        line += " -- %s for %s (%s)" % (name, domain, took)
+        if self.interactive:
+            sys.stderr.write("\r\033[K" + yellow(line))
+            sys.stderr.flush()
+        elif seconds is not None and seconds >= SLOW_TASK:
+            print(yellow(line), file=sys.stderr)
+
+    def _clear(self):
+        """Clear the progress line before printing part of the report."""
+        if self.interactive:
+            sys.stderr.write("\r\033[K")
+            sys.stderr.flush()
+
+    def elapsed(self):
+        """Return the seconds since the run started."""
+        return time.time() - self.started
+
+    def _print_domain(self, domain):
+        """Print one domain's section and add it to the totals."""
+        for position, total in enumerate(report.print_domain(domain, self.results)):
+            self.totals[position] += total
+        sys.stdout.flush()
+
+    def _print_ready(self):
+        """Print the sections, in order, whose tasks are all done."""
+        while self.printed < len(self.domains) and not self.pending[self.domains[self.printed]]:
+            self._clear()
+            self._print_domain(self.domains[self.printed])
+            self.printed += 1
+
+    def finish(self):
+        """Print the totals once every task is done and save the timings."""
+        self._clear()
+        self._print_ready()
+        report.print_totals(*self.totals)
+        self.history.save()
+
+    def interrupt(self, path):
+        """Print every section that has not been printed yet from what has finished, with the
+        missing results left empty, and write the finished results to a JSON file.
+        """
+        self._clear()
+        print(red("\n[X] The run was interrupted after %s -- printing a partial report."
+                  % format_duration(self.elapsed())))
+        self.history.save()
+        results = dict(self.defaults)
+        results.update(self.results)
+        for domain in self.domains[self.printed:]:
+            missing = sorted(self.pending[domain])
+            if missing:
+                print(red("\n[X] Partial results for %s -- these were not finished and are shown \
+as empty: %s" % (domain, ", ".join(missing))))
+            for position, total in enumerate(report.print_domain(domain, results)):
+                self.totals[position] += total
+        report.print_totals(*self.totals)
+        self.write_partial(path)
+
+    def write_partial(self, path):
+        """Write the finished results, and the names of the unfinished ones, to a JSON file."""
+        partial = {"complete": False, "elapsed": round(self.elapsed(), 3), "domains": {}}
+        for domain in self.domains:
+            partial["domains"][domain] = {
+                "results": dict((name, result) for (result_domain, name), result
+                                in sorted(self.results.items())
+                                if result_domain == domain and not name.startswith("export.")),
+                "missing": sorted(self.pending[domain]),
+            }
+        try:
+            with open(path, "w") as partial_file:
+                json.dump(partial, partial_file, indent=2, default=service.encode)
+        except OSError as error:
+            print(red("[X] Could not write the partial results to {}.".format(path)))
+            print(red("L.. Details: {}".format(error)))
+            return
+        print(green("[+] Wrote the partial results to {}.".format(path)))
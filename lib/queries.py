@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the registry of every Cypher query Fox runs. Queries are named and
+parameterized ($domain, $group_name, etc.) so the query text never changes between domains or
+runs, which lets Neo4j reuse its cached plans. The offline backend answers the same names.
+"""
+
+from colors import red, green, yellow
+
+# Labels and relationship types that make up the dataset fingerprint used by the result cache
+FINGERPRINT_LABELS = ("User", "Group", "Computer", "Domain", "GPO", "OU")
+FINGERPRINT_RELATIONSHIPS = (
+    "MemberOf", "HasSession", "AdminTo", "CanRDP", "ExecuteDCOM", "CanPSRemote",
+    "AllowedToDelegate", "AllowedToAct", "AddAllowedToAct", "HasSIDHistory", "SQLAdmin",
+    "GpLink", "Contains", "TrustedBy", "GenericAll", "GenericWrite", "WriteOwner", "WriteDacl",
+    "Owns", "AddMember", "ForceChangePassword", "AllExtendedRights", "ReadLAPSPassword",
+    "ReadGMSAPassword",
+)
+
+
+def _fingerprint_query(label_branch, relationship_branch):
+    """Build one UNION ALL query with a branch for every fingerprinted label and type."""
+    branches = [label_branch.replace("LABEL", label) for label in FINGERPRINT_LABELS]
+    branches.extend(relationship_branch.replace("TYPE", rel_type)
+                    for rel_type in FINGERPRINT_RELATIONSHIPS)
+    return "\n        UNION ALL\n".join(branches)
+
+
+QUERIES = {
+    # Domain data
+    "domains.domains_with_data": """
+        MATCH (g:Group)
+        RETURN DISTINCT g.domain
+        """,
+    "domains.all_domains": """
+        MATCH (d:Domain)
+        RETURN DISTINCT d.name
+        """,
+    "domains.summary": """
+        OPTIONAL MATCH (u:User {domain:$domain})
+        WITH COUNT(u) AS users, COUNT(CASE WHEN u.Enabled = True THEN 1 END) AS enabledUsers
+        OPTIONAL MATCH (c:Computer {domain:$domain})
+        WITH users, enabledUsers, c.OperatingSystem AS os, COUNT(c) AS osTotal,
+             COUNT(CASE WHEN c.UnconstrainedDelegation = True THEN 1 END) AS osUnconstrained
+        WITH users, enabledUsers, SUM(osTotal) AS computers, SUM(osUnconstrained) AS unconstrained,
+             COLLECT(CASE WHEN os IS NULL OR os = "" THEN NULL ELSE [os, osTotal] END) AS systems
+        OPTIONAL MATCH (g:GPO {domain:$domain})
+        WHERE NOT (g.name IS NULL OR g.name = "")
+        WITH users, enabledUsers, computers, unconstrained, systems, COUNT(g) AS gpos
+        OPTIONAL MATCH (o:OU {domain:$domain})
+        WHERE o.blocksInheritance = True
+        RETURN users, enabledUsers, computers, unconstrained, systems, gpos, COUNT(o) AS blockedOus
+        """,
+    "domains.operating_systems": """
+        MATCH (c:Computer {domain:$domain})
+        WHERE NOT (c.OperatingSystem = "" or c.OperatingSystem is Null)
+        RETURN DISTINCT(c.OperatingSystem) as OperartingSystems,COUNT(c.OperatingSystem) as Total
+        ORDER BY Total DESC
+        """,
+    "domains.gpos": """
+        MATCH (g:GPO {domain:$domain})
+        WHERE NOT (g.name is Null or g.name = "")
+        RETURN g.name
+        """,
+    "domains.blocked_inheritance_ous": """
+        MATCH (o:OU {domain:$domain})
+        WHERE o.blocksInheritance = True
+        RETURN o.name
+        """,
+
+    # User metrics
+    "users.total_users": """
+        MATCH (totalUsers:User {domain:toUpper($domain)})
+        RETURN COUNT(DISTINCT(totalUsers))
+        """,
+    "users.total_enabled_users": """
+        MATCH (totalUsers:User {domain:toUpper($domain)})
+        WHERE (totalUsers.Enabled = True)
+        RETURN COUNT(DISTINCT(totalUsers))
+        """,
+    "users.total_computers": """
+        MATCH (totalComputers:Computer {domain:toUpper($domain)})
+        RETURN COUNT(DISTINCT(totalComputers))
+        """,
+    "users.spn_users": """
+        MATCH (u:User {domain:$domain})
+        WHERE u.HasSPN = True
+        RETURN u.name
+        """,
+    "users.unconstrained_delegation": """
+        MATCH (c:Computer {domain:$domain})
+        WHERE c.UnconstrainedDelegation = True
+        RETURN c.name
+        """,
+    "users.old_pwdlastset": """
+        MATCH (u:User {domain:$domain})
+        WHERE u.PwdLastSet <> 0 AND u.PwdLastSet < $cutoff
+        RETURN u.name,u.PwdLastSet
+        """,
+    "users.pwdlastset_ages": """
+        MATCH (u:User {domain:$domain})
+        WHERE u.PwdLastSet <> 0
+        WITH coalesce(u.Enabled, False) = True AS enabled,
+             size([edge IN $edges WHERE u.PwdLastSet <= $now - edge]) AS bucket,
+             size([cutoff IN $cutoffs WHERE u.PwdLastSet < cutoff]) AS stale
+        RETURN enabled, bucket, stale, COUNT(*) AS total
+        """,
+
+    # Name classification
+    "classify.names": """
+        MATCH (u:User {domain:$domain})
+        RETURN 'User' AS label, u.name AS name
+        UNION ALL
+        MATCH (g:Group {domain:$domain})
+        RETURN 'Group' AS label, g.name AS name
+        UNION ALL
+        MATCH (c:Computer {domain:$domain})
+        RETURN 'Computer' AS label, c.name AS name
+        """,
+
+    # Reverse breadth-first search for paths to Domain Admin
+    "paths.start_node": """
+        MATCH (g:Group {name:$group_name})
+        RETURN id(g)
+        """,
+    "paths.inbound": """
+        MATCH (m)<-[r]-(n)
+        WHERE id(m) IN $ids
+        RETURN id(n),type(r),id(m),labels(n),n.domain,n.name
+        """,
+    "paths.outbound": """
+        MATCH (m)-[r]->(n)
+        WHERE id(m) IN $ids
+        RETURN id(m),type(r),id(n)
+        """,
+    "paths.principals": """
+        MATCH (n:User {domain:$domain})
+        RETURN id(n),'User'
+        UNION ALL
+        MATCH (n:Computer {domain:$domain})
+        RETURN id(n),'Computer'
+        """,
+
+    # Group membership closure
+    "membership.edges": """
+        MATCH (m)-[:MemberOf]->(g:Group)
+        RETURN m.name,labels(m),m.domain,g.name,g.domain
+        """,
+
+    # Bulk pulls for the vectorized metrics. Each label comes back in one query, streamed as it
+    # is read.
+    "bulk.users": """
+        MATCH (n:User)
+        RETURN id(n),n.domain,n.Enabled,n.PwdLastSet
+        """,
+    "bulk.computers": """
+        MATCH (n:Computer)
+        RETURN id(n),n.domain,n.OperatingSystem,n.UnconstrainedDelegation
+        """,
+    "bulk.groups": """
+        MATCH (n:Group)
+        RETURN id(n),n.domain
+        """,
+    "bulk.containers": """
+        MATCH (n:GPO)
+        RETURN id(n),'GPO',n.domain,NOT (n.name IS NULL OR n.name = "")
+        UNION ALL
+        MATCH (n:OU)
+        RETURN id(n),'OU',n.domain,n.blocksInheritance = True
+        """,
+    "bulk.memberships": """
+        MATCH (m)-[:MemberOf]->(g:Group)
+        RETURN id(m),id(g)
+        """,
+
+    # Every node and relationship, for writing a snapshot of the dataset
+    "snapshot.nodes": """
+        MATCH (n)
+        RETURN id(n),labels(n),n.name,properties(n)
+        """,
+    "snapshot.edges": """
+        MATCH (a)-[r]->(b)
+        RETURN id(a),type(r),id(b)
+        """,
+
+    # Every session, for the privileged session analyzer
+    "sessions.edges": """
+        MATCH (c:Computer)-[:HasSession]->(u:User)
+        RETURN c.name,c.domain,u.name
+        """,
+
+    # Effective rights matrix
+    "rights.edges": """
+        MATCH (p)-[r:AdminTo|CanRDP|ExecuteDCOM]->(c:Computer)
+        RETURN p.name,labels(p),p.domain,type(r),c.name,c.domain
+        """,
+
+    # Dataset fingerprint for the result cache. Each count is answered from Neo4j's count
+    # store, and each sample only reads the first few nodes or relationships of its kind.
+    "fingerprint.counts": _fingerprint_query("""
+        MATCH (n:LABEL)
+        RETURN 'LABEL' AS key, COUNT(n) AS total""", """
+        MATCH ()-[r:TYPE]->()
+        RETURN 'TYPE' AS key, COUNT(r) AS total"""),
+    "fingerprint.sample": _fingerprint_query("""
+        MATCH (n:LABEL)
+        WITH n LIMIT $sample
+        RETURN 'LABEL' AS key, COLLECT(properties(n)) AS sample""", """
+        MATCH (a)-[r:TYPE]->(b)
+        WITH a, b LIMIT $sample
+        RETURN 'TYPE' AS key, COLLECT([a.name, b.name]) AS sample"""),
+}
+
+# Placeholder values used when asking Neo4j to plan the queries ahead of time
+PREWARM_PARAMETERS = {
+    "domain": "",
+    "group_name": "",
+    "ids": [],
+    "cutoff": 0,
+    "now": 0,
+    "edges": [],
+    "cutoffs": [],
+    "sample": 0,
+}
+
+
+def get_query(name):
+    """Return the Cypher for the named query."""
+    try:
+        return QUERIES[name]
+    except KeyError:
+        raise KeyError("There is no query named %s in the registry" % name)
+
+
+def prewarm(driver):
+    """Ask Neo4j to plan every registered query with EXPLAIN before the report starts, so a
+    query the server cannot plan is reported up front. EXPLAIN does not run the query.
+    """
+    planned = 0
+    with driver.session() as session:
+        for name, query in QUERIES.items():
+            try:
+                session.run("EXPLAIN " + query, PREWARM_PARAMETERS).consume()
+                planned += 1
+            except Exception as error:
+                print(yellow("[!] Could not plan the {} query ahead of time.".format(name)))
+                print(yellow("L.. Details: {}".format(error)))
+    print(green("[+] Pre-planned {} of {} queries.".format(planned, len(QUERIES))))
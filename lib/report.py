@@ -0,0 +1,351 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains Fox's report: the metric tasks it is built from and the code that prints
+it from their results. The CLI and the service both use it, so a report looks the same however
+it was produced.
+"""
+
+from colors import red, green, yellow
+from lib import domains, paths, users
+
+
+def report_tasks(all_domains, domain_metrics, group_metrics, users_metrics, pass_age,
+                 age_buckets, details=False, approximate=None, vector_metrics=None):
+    """Return every independent query for every domain, along with a fallback value to use if
+    the query fails, as tasks for helpers.run_tasks. If approximate is a time budget in seconds,
+    the paths to Domain Admin are estimated from a sample instead of searched exhaustively. If
+    vector_metrics is given, the aggregates it can compute from the bulk graph come from it.
+    """
+    summaries = domain_metrics
+    memberships = group_metrics
+    ages = users_metrics
+    if vector_metrics:
+        summaries = memberships = ages = vector_metrics
+    tasks = []
+    for domain in all_domains:
+        # We may get a 'None' domain if the label is missing in BloodHound
+        if domain:
+            # Neo4j will expect domain names to match what it has in the database, so must be all uppercase
+            domain = domain.upper()
+            tasks.extend([
+                (domain, "da_sessions", domain_metrics.get_systems_with_da, (domain,), []),
+                (domain, "privileged_sessions", domain_metrics.get_privileged_sessions,
+                 (domain, 10), []),
+                (domain, "avg_membership_nonrecur", memberships.get_avg_group_membership,
+                 (domain,), None),
+                (domain, "avg_membership_recur", memberships.get_avg_group_membership,
+                 (domain, True), None),
+                (domain, "admin_groups", group_metrics.get_admin_groups, (domain,), ([], [], [])),
+                (domain, "other_admin_groups", group_metrics.find_admin_groups, (domain,), []),
+                (domain, "local_admin", group_metrics.find_local_admin_groups, (domain,), []),
+                (domain, "local_admin_reach", group_metrics.get_group_reach, (domain,), {}),
+                (domain, "exposed_hosts", domain_metrics.get_most_exposed_computers,
+                 (domain, 5), []),
+                (domain, "rdp_users", group_metrics.find_remote_desktop_users, (domain,), []),
+                (domain, "foreign_groups", group_metrics.find_foreign_group_membership,
+                 (domain,), {}),
+                (domain, "foreign_domains", group_metrics.get_foreign_domains, (domain,), []),
+                (domain, "summary", summaries.get_domain_summary, (domain,),
+                 domains.DomainSummary(domain)),
+                (domain, "password_ages", ages.get_password_ages,
+                 (domain, pass_age, age_buckets), users.PasswordAges(domain, pass_age, age_buckets)),
+                (domain, "special_users", users_metrics.find_special_users, (domain,), []),
+                (domain, "special_computers", users_metrics.find_special_computers, (domain,),
+                 []),
+                (domain, "da_spn", users_metrics.find_da_spn, (domain,), []),
+                (domain, "foreign_users", users_metrics.find_foreign_group_membership,
+                 (domain,), {}),
+            ])
+            if approximate:
+                tasks.append((domain, "path_estimate", domain_metrics.estimate_da_paths,
+                              (domain, approximate), paths.PathEstimate(domain)))
+            else:
+                tasks.extend([
+                    (domain, "path_stats", domain_metrics.get_da_path_stats, (domain,),
+                     paths.PathStats(domain, None, {}, [])),
+                    (domain, "total_paths", domain_metrics.get_all_da_paths, (domain,), 0),
+                    (domain, "avg_path", domain_metrics.avg_path_length, (domain,), None),
+                ])
+            # The full lists behind some of the summary counters are only needed for details
+            if details:
+                tasks.extend([
+                    (domain, "gpo_list", domain_metrics.get_all_gpos, (domain,), []),
+                    (domain, "blocker_ous", domain_metrics.find_blocked_inheritance, (domain,),
+                     []),
+                    (domain, "unc_deleg_computers", users_metrics.find_unconstrained_delegation,
+                     (domain,), []),
+                    (domain, "old_passwords", users_metrics.find_old_pwdlastset,
+                     (domain, min(pass_age)), {}),
+                ])
+
+    return tasks
+
+
+def print_report(all_domains, results, stream=None):
+    """Print the report for every domain from the results of its tasks, followed by the totals
+    across domains. Everything is printed to the stream, or to stdout if there is none.
+    """
+    # A few variables we need for tracking some numbers across domains
+    totals = [0, 0, 0]
+
+    for domain in all_domains:
+        if domain:
+            for position, total in enumerate(print_domain(domain.upper(), results, stream)):
+                totals[position] += total
+
+    print_totals(*totals, stream=stream)
+
+
+def print_domain(domain, results, stream=None):
+    """Print the report for one domain from the results of its tasks. Returns the domain's
+    total users, enabled users, and computers for the totals across domains.
+    """
+    print(green("\n[+] Domain: %s" % domain), file=stream)
+
+    da_sessions = results[(domain, "da_sessions")]
+    privileged_sessions = results[(domain, "privileged_sessions")]
+    avg_membership_nonrecur = results[(domain, "avg_membership_nonrecur")]
+    avg_membership_recur = results[(domain, "avg_membership_recur")]
+    dadmins, eadmins, admins = results[(domain, "admin_groups")]
+    admin_groups = results[(domain, "other_admin_groups")]
+    local_admin = results[(domain, "local_admin")]
+    local_admin_reach = results[(domain, "local_admin_reach")]
+    exposed_hosts = results[(domain, "exposed_hosts")]
+    rdp_users = results[(domain, "rdp_users")]
+    foreign_groups = results[(domain, "foreign_groups")]
+    foreign_domains = results[(domain, "foreign_domains")]
+    summary = results[(domain, "summary")]
+    total_users = summary.total_users
+    total_enabled_users = summary.total_enabled_users
+    total_computers = summary.total_computers
+    operating_systems = summary.operating_systems
+    path_stats = results.get((domain, "path_stats"),
+                             paths.PathStats(domain, None, {}, []))
+    total_paths = results.get((domain, "total_paths"), 0)
+    avg_path = results.get((domain, "avg_path"))
+    path_estimate = results.get((domain, "path_estimate"))
+    password_ages = results[(domain, "password_ages")]
+    old_passwords = results.get((domain, "old_passwords"), {})
+    special_users = results[(domain, "special_users")]
+    special_computers = results[(domain, "special_computers")]
+    da_spn = results[(domain, "da_spn")]
+    foreign_users = results[(domain, "foreign_users")]
+    gpo_list = results.get((domain, "gpo_list"), [])
+    blocker_ous = results.get((domain, "blocker_ous"), [])
+    unc_deleg_computers = results.get((domain, "unc_deleg_computers"), [])
+
+    # Calculations for user objects
+    totals = (total_users, total_enabled_users, total_computers)
+    percentage_users_path_to_da = path_stats.percentage("User", total_users)
+    percentage_comps_path_to_da = path_stats.percentage("Computer", total_computers)
+
+    # Review the data to see if we can detect any missing labels/data and try to name
+    # CollectionMethod types that are missing from the database
+    warning_count = 0
+    print(yellow("\n[!] WARNINGS for %s:" % domain), file=stream)
+    if summary.total_gpos == 0:
+        warning_count += 1
+        print(yellow("[*] There are zero GPOs for this domain!"), file=stream)
+        print(yellow("L.. Missing CollectionMethod: GPO"), file=stream)
+    if total_enabled_users == 0:
+        warning_count += 1
+        print(yellow("[*] There are no user objects with the Enabled attribute!"), file=stream)
+        print(yellow("L.. Missing CollectionMethod: ObjectProps"), file=stream)
+    if not operating_systems:
+        warning_count += 1
+        print(yellow("[*] There are no computer objects with the operating system attribute!"),
+              file=stream)
+        print(yellow("L.. Missing CollectionMethod: ObjectProps"), file=stream)
+    if not avg_membership_nonrecur:
+        warning_count += 1
+        print(red("[X] Cannot pull group membership data!"), file=stream)
+        print(red("L.. Data for this domain is too incomplete and will be skipped."), file=stream)
+        return totals
+    if warning_count == 0:
+        print(green("\tNone! BloodHound data looks good!\n"), file=stream)
+
+    # Report domain-related data
+    if summary.total_gpos > 0:
+        print(green("Number of GPOs:\t%s" % summary.total_gpos), file=stream)
+        for gpo in gpo_list:
+            print(yellow("\t%s" % gpo), file=stream)
+    if summary.blocked_inheritance_ous:
+        print(green("OUs blockiung inheritance:\t%s" % summary.blocked_inheritance_ous),
+              file=stream)
+        for ou in blocker_ous:
+            print(yellow("\t%s" % ou), file=stream)
+    if operating_systems:
+        print(green("Operating Systems seen in domain:"), file=stream)
+        for key, value in operating_systems.items():
+            print(yellow("\t%s\t%s" % (value, key)), file=stream)
+    print(green("Domain Admins tied to SPNs:"), file=stream)
+    if len(da_spn):
+        for account in da_spn:
+            print(yellow("\t%s" % account), file=stream)
+    else:
+        print(green("\tNone! :D"), file=stream)
+
+    # Report session data
+    print(green("Systems that are not Domain Controllers with Domain Admin sessions:"), file=stream)
+    if da_sessions:
+        for session in da_sessions:
+            print(yellow("\t%s" % session), file=stream)
+    else:
+        print(green("\tNone! :D"), file=stream)
+    if privileged_sessions:
+        print(green("Computers with the most privileged tier-0 sessions:"), file=stream)
+        for computer, session_users, group in privileged_sessions:
+            print(yellow("\t%s\t%s tier-0 user(s)\t(%s)"
+                         % (computer, len(session_users), group)), file=stream)
+
+    # Report group-related data
+    print(green("Average group membership:\t\t\t%s" % avg_membership_nonrecur), file=stream)
+    print(green("Average recursive group membership:\t\t%s" % avg_membership_recur), file=stream)
+    print(green("Nested groups increased membership by:\t\t%s"
+                 % float(avg_membership_recur-avg_membership_nonrecur)), file=stream)
+    print(green("Domain Admins:"), file=stream)
+    for user in dadmins:
+        print(yellow("\t%s" % user), file=stream)
+    print(green("Enterprise Admins:"), file=stream)
+    for user in eadmins:
+        print(yellow("\t%s" % user), file=stream)
+    print(green("Administrators:"), file=stream)
+    for user in admins:
+        print(yellow("\t%s" % user), file=stream)
+    print(green("Other ADMIN groups:"), file=stream)
+    for group, rule in admin_groups:
+        print(yellow("\t%s\t(%s)" % (group, rule)), file=stream)
+    print(green("Non-Admin groups with Local Admin:"), file=stream)
+    if local_admin:
+        for group in local_admin:
+            print(yellow("\t%s\t(%s computers)" % (group, local_admin_reach.get(group, 0))),
+                  file=stream)
+    else:
+        print(green("\tNone! :D"), file=stream)
+    if exposed_hosts:
+        print(green("Computers with the most local admin users:"), file=stream)
+        for computer, count in exposed_hosts:
+            print(yellow("\t%s\t%s" % (computer, count)), file=stream)
+    print(green("REMOTE DESKTOP USERS members:"), file=stream)
+    for member in rdp_users:
+        if "DOMAIN USERS" in member:
+            print(red("\t--> %s" % member), file=stream)
+        else:
+            print(yellow("\t%s" % member), file=stream)
+    if foreign_groups:
+        print(green("Groups with foregin group membership:"), file=stream)
+        print_memberships(foreign_groups, stream)
+    if foreign_domains:
+        print(green("Foreign domains reached through group membership:"), file=stream)
+        for foreign_domain, user_count, group_count, computer_count in foreign_domains:
+            print(yellow("\t%s\t%s users, %s groups, %s computers"
+                         % (foreign_domain, user_count, group_count, computer_count)), file=stream)
+
+    # Report user statistics
+    print(green("Total users:\t\t\t\t\t%s" % total_users), file=stream)
+    print(green("Total enabled users:\t\t\t\t%s (%s disabled)"
+                 % (total_enabled_users, total_users-total_enabled_users)), file=stream)
+    for months, count in password_ages.stale.items():
+        print(green("Users with passwords older than %s months:\t%s" % (months, count)),
+              file=stream)
+    for account, changed in sorted(old_passwords.items()):
+        print(yellow("\t%s\t(%s)" % (account, changed)), file=stream)
+    print(green("Password ages (months):\t\t\tEnabled\tDisabled"), file=stream)
+    for label, (enabled, disabled) in password_ages.histogram.items():
+        print(yellow("\t%s\t\t\t\t\t%s\t%s" % (label, enabled, disabled)), file=stream)
+    print(green("Total computers:\t\t\t\t%s" % total_computers), file=stream)
+    print(green("Potentially privileged accounts:"), file=stream)
+    for account, rule in special_users:
+        print(yellow("\t%s\t(%s)" % (account, rule)), file=stream)
+    print(green("Users with foregin group membership:"), file=stream)
+    if foreign_users:
+        print_memberships(foreign_users, stream)
+    else:
+        print(green("\tNone!"), file=stream)
+
+    # Report on computer objects
+    if special_computers:
+        print(green("Potentially privileged computers:"), file=stream)
+        for computer, rule in special_computers:
+            print(yellow("\t%s\t(%s)" % (computer, rule)), file=stream)
+    if summary.unconstrained_delegation:
+        print(green("Computers with Unconstrained Delegation:\t%s"
+                     % summary.unconstrained_delegation), file=stream)
+        for computer in unc_deleg_computers:
+            print(yellow("\t%s" % computer), file=stream)
+    else:
+        print(green("Computers with Unconstrained Delegation:"), file=stream)
+        print(green("\tNone! :D"), file=stream)
+
+    # Report on paths
+    if path_estimate:
+        print_estimate(path_estimate, stream)
+        return totals
+    print(green("Total paths:\t\t\t\t\t%s" % total_paths), file=stream)
+    print(green("Average path length:\t\t\t\t%s" % avg_path), file=stream)
+    print(green("Users with path to a Domain Admin:\t\t%s %%"
+                 % percentage_users_path_to_da), file=stream)
+    print(green("Machines with path to Domain Admin:\t\t%s %%"
+                 % percentage_comps_path_to_da), file=stream)
+    if path_stats.distances:
+        print(green("Path lengths to Domain Admin:"), file=stream)
+        for length, count in path_stats.histogram().items():
+            print(yellow("\t%s hops\t%s" % (length, count)), file=stream)
+    return totals
+
+
+def print_totals(total_users, total_enabled_users, total_computers, stream=None):
+    """Print the totals across domains."""
+    print(green("\n[+] Totals for all domains in dataset:"), file=stream)
+    print(green("Total users across domains:\t\t\t%s" % total_users), file=stream)
+    print(green("Total enabled users across domains:\t\t%s" % total_enabled_users), file=stream)
+    print(green("Total computers across domains:\t\t\t%s" % total_computers), file=stream)
+
+
+def print_memberships(memberships, stream=None):
+    """Print each principal's foreign group memberships, marking the nested ones."""
+    for principal, groups in sorted(memberships.items()):
+        for group, direct in groups:
+            print(yellow("\t%s -> %s%s" % (principal, group, "" if direct else "\t(nested)")),
+                  file=stream)
+
+
+def _interval(estimate, exact, format="%s", suffix=""):
+    """Format a (value, low, high) estimate, with its confidence interval unless it is exact."""
+    if estimate is None:
+        return None
+    value, low, high = estimate
+    if exact:
+        return (format + "%s") % (value, suffix)
+    return (format + "%s\t(95%% CI " + format + "-" + format + "%s)") % (value, suffix, low, high,
+                                                                      suffix)
+
+
+def print_estimate(estimate, stream=None):
+    """Print the path metrics of a PathEstimate, marked as estimates unless every user and
+    computer was searched.
+    """
+    sampled = sum(estimate.sampled.values())
+    total = sum(estimate.totals.values())
+    exact = estimate.complete()
+    label = ""
+    if exact:
+        print(green("Paths were searched from all %s users and computers in %.1f seconds, so \
+these values are exact:" % (total, estimate.seconds)), file=stream)
+    else:
+        label = " (estimate)"
+        print(yellow("[!] ESTIMATES from %s of %s users and computers sampled in %.1f seconds:"
+                     % (sampled, total, estimate.seconds)), file=stream)
+    print(green("%-48s%s" % ("Total paths%s:" % label,
+                             _interval(estimate.count("User"), exact))), file=stream)
+    # The exact report averages every principal with a path, but only users and computers are
+    # searched here, so the line is labelled with the population it covers
+    print(green("%-48s%s" % ("Average user/computer path length%s:" % label,
+                             _interval(estimate.average(), exact, "%.2f"))), file=stream)
+    print(green("%-48s%s" % ("Users with path to a Domain Admin%s:" % label,
+                             _interval(estimate.percentage("User"), exact, "%.1f", " %"))),
+          file=stream)
+    print(green("%-48s%s" % ("Machines with path to Domain Admin%s:" % label,
+                             _interval(estimate.percentage("Computer"), exact, "%.1f", " %"))),
+          file=stream)
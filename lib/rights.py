@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the effective rights matrix for AdminTo, CanRDP, and ExecuteDCOM. The
+rights relationships are pulled once and expanded through the shared group membership closure,
+so every principal that holds a right on a computer, directly or through nested groups, is
+known. Computers that grant a right to the same principals share one row of the matrix.
+"""
+
+import threading
+from array import array
+from lib import helpers, membership
+
+# Rights relationships from principals to computers that the matrix covers
+RIGHTS = ("AdminTo", "CanRDP", "ExecuteDCOM")
+
+# Matrices are kept for each database connection and nesting depth cap
+_matrices = {}
+_matrices_lock = threading.Lock()
+
+
+class RightsMatrix(object):
+    """A sparse principal-by-computer matrix of effective rights. Principals and computers are
+    numbered, each computer points at a shared, sorted array of the principals holding the right
+    on it, and the per-label counts of every array are worked out once when it is built.
+    """
+
+    def __init__(self, closure):
+        """Everything that should be initiated with a new object goes here."""
+        self.closure = closure
+        self.principals = []
+        self.principal_index = {}
+        self.labels = []
+        self.domains = []
+        self.computers = []
+        self.computer_index = {}
+        self.computer_domains = []
+        # Right -> computer -> set of principals with the right assigned directly
+        self.direct = dict((right, {}) for right in RIGHTS)
+        # Right -> array of holder set IDs, one per computer (-1 for no holders)
+        self.rows = {}
+        # Shared holder sets as sorted arrays of principal IDs, and their counts by label
+        self.holder_sets = []
+        self.holder_counts = []
+
+    def principal(self, name, label=None, domain=None):
+        """Return the ID for a principal, adding it the first time it is seen."""
+        name = name.upper()
+        principal = self.principal_index.get(name)
+        if principal is None:
+            principal = len(self.principals)
+            self.principal_index[name] = principal
+            self.principals.append(name)
+            self.labels.append(label or self.closure.labels.get(name))
+            self.domains.append(domain.upper() if domain else self.closure.domains.get(name))
+        return principal
+
+    def computer(self, name, domain=None):
+        """Return the ID for a computer, adding it the first time it is seen."""
+        name = name.upper()
+        computer = self.computer_index.get(name)
+        if computer is None:
+            computer = len(self.computers)
+            self.computer_index[name] = computer
+            self.computers.append(name)
+            self.computer_domains.append(domain.upper() if domain else None)
+        return computer
+
+    def add(self, principal, labels, principal_domain, right, computer, computer_domain):
+        """Record a single rights relationship."""
+        label = next((l for l in membership.PRINCIPAL_LABELS if l in (labels or [])), None)
+        principal = self.principal(principal, label, principal_domain)
+        computer = self.computer(computer, computer_domain)
+        self.direct[right].setdefault(computer, set()).add(principal)
+
+    def build(self):
+        """Expand every computer's direct holders through nested group membership. Computers
+        with the same direct holders, like every workstation administered by the same groups,
+        are expanded once and share the result.
+        """
+        set_ids = {}
+        for right in RIGHTS:
+            row = array("l", [-1]) * len(self.computers)
+            for computer, direct in self.direct[right].items():
+                key = frozenset(direct)
+                if key not in set_ids:
+                    holders = set(direct)
+                    for principal in direct:
+                        for member in self.closure.members_of(self.principals[principal]):
+                            holders.add(self.principal(member))
+                    set_ids[key] = len(self.holder_sets)
+                    self.holder_sets.append(array("l", sorted(holders)))
+                    counts = {}
+                    for holder in holders:
+                        counts[self.labels[holder]] = counts.get(self.labels[holder], 0) + 1
+                    self.holder_counts.append(counts)
+                row[computer] = set_ids[key]
+            self.rows[right] = row
+        return self
+
+    def _computers(self, domain=None):
+        """Yield the IDs of the computers in the domain."""
+        for computer, computer_domain in enumerate(self.computer_domains):
+            if domain and computer_domain != domain.upper():
+                continue
+            yield computer
+
+    def holders(self, right, computer, label=None):
+        """Return the names of the principals with the right on the computer."""
+        computer = self.computer_index.get(computer.upper())
+        if computer is None or self.rows[right][computer] < 0:
+            return []
+        return [self.principals[principal]
+                for principal in self.holder_sets[self.rows[right][computer]]
+                if not label or self.labels[principal] == label]
+
+    def counts(self, right="AdminTo", domain=None, label="User"):
+        """Return a dictionary of computer -> number of principals (of the label) with the
+        right on it, most exposed first.
+        """
+        row = self.rows[right]
+        counts = []
+        for computer in self._computers(domain):
+            if row[computer] >= 0:
+                counts.append((self.computers[computer],
+                               self.holder_counts[row[computer]].get(label, 0) if label
+                               else len(self.holder_sets[row[computer]])))
+        return dict(sorted(counts, key=lambda count: count[1], reverse=True))
+
+    def most_exposed(self, right="AdminTo", count=10, domain=None, label="User"):
+        """Return the (computer, principals) pairs for the most exposed computers."""
+        return list(self.counts(right, domain, label).items())[:count]
+
+    def reach(self, right="AdminTo", domain=None, label="Group"):
+        """Return a dictionary of principal -> number of computers it holds the right on,
+        largest reach first. Each shared holder set is visited once and credited with the
+        number of computers that use it.
+        """
+        row = self.rows[right]
+        uses = array("l", [0]) * len(self.holder_sets)
+        for computer in self._computers(domain):
+            if row[computer] >= 0:
+                uses[row[computer]] += 1
+        reach = array("l", [0]) * len(self.principals)
+        for holder_set, total in enumerate(uses):
+            if total:
+                for principal in self.holder_sets[holder_set]:
+                    reach[principal] += total
+        results = [(self.principals[principal], total) for principal, total in enumerate(reach)
+                   if total and (not label or self.labels[principal] == label)]
+        return dict(sorted(results, key=lambda result: result[1], reverse=True))
+
+    def direct_holders(self, right="AdminTo", label=None, domain=None):
+        """Return the names of principals with the right assigned to them directly."""
+        holders = set()
+        for principals in self.direct[right].values():
+            holders.update(principals)
+        return set(self.principals[principal] for principal in holders
+                   if (not label or self.labels[principal] == label) and
+                   (not domain or self.domains[principal] == domain.upper()))
+
+
+def get_rights(driver, max_depth=None):
+    """Return the shared RightsMatrix for the given database connection, pulling the rights
+    relationships the first time it is requested.
+    """
+    key = (id(driver), max_depth)
+    with _matrices_lock:
+        if key not in _matrices:
+            matrix = RightsMatrix(membership.get_closure(driver, max_depth))
+            results = helpers.stream_query(driver, "rights.edges")
+            for principal, labels, principal_domain, right, computer, computer_domain in results:
+                if principal and computer:
+                    matrix.add(principal, labels, principal_domain, right, computer,
+                               computer_domain)
+            _matrices[key] = matrix.build()
+
+        return _matrices[key]
+
+
+def clear_cache():
+    """Forget every matrix built so far, so the next request pulls the rights again."""
+    with _matrices_lock:
+        _matrices.clear()
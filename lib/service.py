@@ -0,0 +1,341 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains Fox's service mode. The service keeps the database connection, its
+connection pool, and every result it has computed in memory and answers requests over HTTP on
+localhost, so the CLI can ask it for a report or a single metric instead of starting cold. The
+client functions used by the CLI live here too.
+"""
+
+import io
+import sys
+import json
+import time
+import threading
+import socketserver
+from urllib import error as url_error, parse, request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from colors import red, green, yellow
+from lib import cache, classify, domains, groups, helpers, membership, report, rights, sessions, \
+    users, vectorized
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8421
+
+
+class MemoryCache(object):
+    """Keeps task results in memory for as long as the service runs, in front of the on-disk
+    ResultCache if there is one. It answers the same calls as a ResultCache, so it can be handed
+    to helpers.run_tasks. The dataset is fingerprinted once, not for every request, so use
+    refresh() after the data changes.
+    """
+
+    def __init__(self, backing=None):
+        """Everything that should be initiated with a new object goes here."""
+        self.backing = backing
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if backing:
+            backing.load_fingerprint()
+
+    def load_fingerprint(self):
+        """Nothing to do -- the fingerprint is loaded when the cache is created or cleared."""
+        return None
+
+    def cacheable(self, name):
+        """Return True if the named task's result can be kept."""
+        return not name.startswith("export.") and name not in cache.TIME_BASED_METRICS
+
+    def get(self, domain, name, arguments):
+        """Return (found, result) for a task, checking memory before the on-disk cache."""
+        key = (domain, name, repr(arguments))
+        with self.lock:
+            if key in self.results:
+                self.hits += 1
+                return True, self.results[key]
+        if self.backing:
+            found, result = self.backing.get(domain, name, arguments)
+            if found:
+                with self.lock:
+                    self.hits += 1
+                    self.results[key] = result
+                return True, result
+        with self.lock:
+            self.misses += 1
+        return False, None
+
+    def put(self, domain, name, arguments, result):
+        """Keep a task's result, and store it on disk if there is an on-disk cache."""
+        with self.lock:
+            self.results[(domain, name, repr(arguments))] = result
+        if self.backing:
+            self.backing.put(domain, name, arguments, result)
+
+    def clear(self):
+        """Forget every result and fingerprint the dataset again."""
+        with self.lock:
+            self.results.clear()
+        if self.backing:
+            self.backing.load_fingerprint()
+
+
+class FoxService(object):
+    """The warm state behind the service: one database connection, the metrics objects, and
+    the results of every task run so far.
+    """
+
+    def __init__(self, driver, max_depth=None, workers=1, result_cache=None, vectorize=False):
+        """Everything that should be initiated with a new object goes here."""
+        self.neo4j_driver = driver
+        self.max_depth = max_depth
+        self.workers = workers
+        self.vectorize = vectorize
+        self.started = time.time()
+        self.requests = 0
+        self.cache = MemoryCache(result_cache)
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """Create fresh metrics objects and forget the known domains."""
+        self.domain_metrics = domains.DomainData(self.neo4j_driver, self.max_depth)
+        self.group_metrics = groups.GroupMetrics(self.neo4j_driver, self.max_depth)
+        self.users_metrics = users.UserMetrics(self.neo4j_driver, self.max_depth)
+        self.vector_metrics = None
+        if self.vectorize:
+            self.vector_metrics = vectorized.VectorMetrics(self.neo4j_driver, self.max_depth)
+        self.known_domains = None
+
+    def domains(self, domain=None):
+        """Return the domains to report on. A domain that has no data raises a KeyError."""
+        if self.known_domains is None:
+            self.known_domains = self.domain_metrics.get_all_domains()
+        if domain:
+            if domain.upper() not in [known.upper() for known in self.known_domains if known]:
+                raise KeyError("No data is available for the {} domain.".format(domain))
+            return [domain.upper()]
+        return [known.upper() for known in self.known_domains if known]
+
+    def tasks(self, all_domains, pass_age, age_buckets, details, approximate=None):
+        """Return the report's tasks for the domains."""
+        return report.report_tasks(all_domains, self.domain_metrics, self.group_metrics,
+                                   self.users_metrics, pass_age, age_buckets, details,
+                                   approximate, self.vector_metrics)
+
+    def report(self, domain=None, pass_age=(6,), age_buckets=users.AGE_BUCKETS, details=False,
+               approximate=None):
+        """Return the full report for the domain (or every domain) as text."""
+        all_domains = self.domains(domain)
+        results = helpers.run_tasks(self.tasks(all_domains, pass_age, age_buckets, details,
+                                               approximate),
+                                    self.workers, self.cache)
+        output = io.StringIO()
+        report.print_report(all_domains, results, output)
+        return output.getvalue()
+
+    def metric_names(self):
+        """Return the names of the metrics that can be requested one at a time."""
+        return sorted(set(task[1] for task in self.tasks(["DOMAIN"], (6,), users.AGE_BUCKETS,
+                                                         True)))
+
+    def metric(self, name, domain=None, pass_age=(6,), age_buckets=users.AGE_BUCKETS):
+        """Return a dictionary of domain -> result of the named metric. An unknown metric raises
+        a KeyError.
+        """
+        all_domains = self.domains(domain)
+        tasks = [task for task in self.tasks(all_domains, pass_age, age_buckets, True)
+                 if task[1] == name]
+        if not tasks:
+            raise KeyError("There is no {} metric. Choose from: {}."
+                           .format(name, ", ".join(self.metric_names())))
+        results = helpers.run_tasks(tasks, self.workers, self.cache)
+        return dict((task_domain, result) for (task_domain, _), result in results.items())
+
+    def refresh(self):
+        """Forget every result and shared structure, so the next request reads the data again."""
+        self.cache.clear()
+        membership.clear_cache()
+        classify.clear_cache()
+        rights.clear_cache()
+        sessions.clear_cache()
+        vectorized.clear_cache()
+        self._reset()
+
+    def count_request(self):
+        """Count a request the service answered."""
+        with self.lock:
+            self.requests += 1
+
+    def stats(self):
+        """Return the service's uptime, request count, and cache counters."""
+        return {
+            "uptime": round(time.time() - self.started, 3),
+            "requests": self.requests,
+            "results": len(self.cache.results),
+            "hits": self.cache.hits,
+            "misses": self.cache.misses,
+        }
+
+
+def encode(value):
+    """Turn the objects in a metric's result into something JSON can hold."""
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if hasattr(value, "__dict__"):
+        return dict((key, item) for key, item in vars(value).items()
+                    if not key.startswith("_"))
+    return str(value)
+
+
+def _options(query):
+    """Pull the report options out of a parsed query string."""
+    pass_age = [int(months) for months in query.get("pass_age", [])] or [6]
+    age_buckets = users.AGE_BUCKETS
+    if query.get("age_buckets"):
+        age_buckets = [int(months) for months in query["age_buckets"][0].split(",") if months]
+    return {"domain": query.get("domain", [None])[0], "pass_age": pass_age,
+            "age_buckets": age_buckets}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Answers the service's requests:
+
+    GET /report     the full report as text (domain, pass_age, age_buckets, details, and
+                    approximate)
+    GET /metric     one metric as JSON (name, domain, pass_age, and age_buckets)
+    GET /domains    the domains with data, as JSON
+    GET /stats      uptime, requests, and cache counters, as JSON
+    POST /refresh   forget every result so the data is read again
+    """
+
+    def _send(self, status, body, content_type="application/json"):
+        if content_type == "application/json":
+            body = json.dumps(body, default=encode)
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "%s; charset=utf-8" % content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        service.count_request()
+        url = parse.urlparse(self.path)
+        query = parse.parse_qs(url.query)
+        try:
+            options = _options(query)
+            if url.path == "/report":
+                details = query.get("details", ["0"])[0] not in ("", "0", "false")
+                approximate = float(query.get("approximate", ["0"])[0]) or None
+                self._send(200, service.report(details=details, approximate=approximate,
+                                               **options), "text/plain")
+            elif url.path == "/metric":
+                self._send(200, service.metric(query.get("name", [""])[0], **options))
+            elif url.path == "/domains":
+                self._send(200, service.domains())
+            elif url.path == "/stats":
+                self._send(200, service.stats())
+            else:
+                self._send(404, {"error": "Unknown path {}.".format(url.path)})
+        except (KeyError, ValueError) as error:
+            self._send(400, {"error": str(error).strip("'\"")})
+        except Exception as error:
+            self._send(500, {"error": str(error)})
+
+    def do_POST(self):
+        service = self.server.service
+        service.count_request()
+        if parse.urlparse(self.path).path == "/refresh":
+            service.refresh()
+            self._send(200, service.stats())
+        else:
+            self._send(404, {"error": "Unknown path {}.".format(self.path)})
+
+    def log_message(self, format, *args):
+        # Log requests in Fox's colors, to stderr like BaseHTTPRequestHandler does
+        print(yellow("[!] %s %s" % (self.address_string(), format % args)), file=sys.stderr)
+
+
+class ServiceServer(socketserver.ThreadingMixIn, HTTPServer):
+    """An HTTP server that answers every request in its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """Everything that should be initiated with a new object goes here."""
+        HTTPServer.__init__(self, (host, port), ServiceHandler)
+        self.service = service
+
+
+def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Answer requests until the service is stopped with Ctrl-C."""
+    try:
+        server = ServiceServer(service, host, port)
+    except OSError as error:
+        print(red("[X] Could not listen on {}:{}.".format(host, port)))
+        print(red("L.. Details: {}".format(error)))
+        exit()
+    print(green("[+] Fox is listening on http://{}:{}/ -- press Ctrl-C to stop.".format(host,
+                                                                                        port)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(yellow("\n[!] Stopping the service."))
+    finally:
+        server.server_close()
+
+
+def call(url, path, parameters=None, method="GET"):
+    """Send a request to the service at url and return the response body as text. Errors from
+    the service are printed and end the run.
+    """
+    address = url.rstrip("/") + path
+    if parameters:
+        address += "?" + parse.urlencode(parameters, doseq=True)
+    try:
+        with request.urlopen(request.Request(address, data=b"" if method == "POST" else None,
+                                             method=method)) as response:
+            return response.read().decode("utf-8")
+    except url_error.HTTPError as error:
+        details = error.read().decode("utf-8")
+        try:
+            details = json.loads(details)["error"]
+        except (ValueError, KeyError):
+            pass
+        print(red("[X] The Fox service could not answer the request."))
+        print(red("L.. Details: {}".format(details)))
+        exit()
+    except url_error.URLError as error:
+        print(red("[X] Could not reach the Fox service at {} -- make sure it is running with \
+fox.py serve.".format(url)))
+        print(red("L.. Details: {}".format(error.reason)))
+        exit()
+
+
+def _parameters(domain, pass_age, age_buckets):
+    """Return the query string parameters for the report options."""
+    parameters = {"pass_age": list(pass_age),
+                  "age_buckets": ",".join(str(months) for months in age_buckets)}
+    if domain:
+        parameters["domain"] = domain
+    return parameters
+
+
+def fetch_report(url, domain=None, pass_age=(6,), age_buckets=users.AGE_BUCKETS, details=False,
+                 approximate=None):
+    """Return the report text from the service."""
+    parameters = _parameters(domain, pass_age, age_buckets)
+    parameters["details"] = int(details)
+    if approximate:
+        parameters["approximate"] = approximate
+    return call(url, "/report", parameters)
+
+
+def fetch_metric(url, name, domain=None, pass_age=(6,), age_buckets=users.AGE_BUCKETS):
+    """Return the service's dictionary of domain -> result for the named metric."""
+    parameters = _parameters(domain, pass_age, age_buckets)
+    parameters["name"] = name
+    return json.loads(call(url, "/metric", parameters))
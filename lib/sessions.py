@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the privileged session analyzer. The tier-0 principals (members of
+Domain Admins, Enterprise Admins, Administrators, and any groups added in database.config) and
+the Domain Controllers are worked out once from the shared group membership closure. Every
+HasSession relationship is then read in a single pass, and each computer that is not a Domain
+Controller is ranked by how many tier-0 users have sessions on it and how privileged they are.
+"""
+
+import threading
+from colors import yellow
+from lib import helpers, membership
+
+# The default tier-0 groups and their privilege levels, higher being more privileged. Groups
+# are named without a domain so they match in every domain.
+DEFAULT_TIER0_GROUPS = {
+    "ENTERPRISE ADMINS": 3,
+    "DOMAIN ADMINS": 2,
+    "ADMINISTRATORS": 1,
+}
+
+# Groups whose computer members are Domain Controllers
+CONTROLLER_GROUPS = ("DOMAIN CONTROLLERS",)
+
+# The tier-0 groups, read from database.config the first time they are needed
+_tier0_groups = None
+
+# Analyzers are kept for each database connection and nesting depth cap
+_analyzers = {}
+_analyzers_lock = threading.Lock()
+
+
+def load_tier0_groups():
+    """Return the default tier-0 groups updated with any groups from the [Tier0] section of
+    database.config. Each option is a group name, with or without @DOMAIN, and its value is the
+    group's privilege level.
+    """
+    groups = dict(DEFAULT_TIER0_GROUPS)
+    for name, level in helpers.config_section_map("Tier0", required=False).items():
+        try:
+            groups[name.strip().upper()] = int(level)
+        except ValueError:
+            print(yellow("[!] Skipping the {} tier-0 group -- its level must be a number"
+                         .format(name)))
+
+    return groups
+
+
+def get_tier0_groups():
+    """Return the shared tier-0 groups, reading them the first time."""
+    global _tier0_groups
+    if _tier0_groups is None:
+        _tier0_groups = load_tier0_groups()
+    return _tier0_groups
+
+
+class ComputerSessions(object):
+    """The tier-0 sessions on one computer."""
+
+    def __init__(self, computer, domain):
+        """Everything that should be initiated with a new object goes here."""
+        self.computer = computer
+        self.domain = domain
+        # User -> (level, group) of the most privileged tier-0 group the user belongs to
+        self.users = {}
+
+    def add(self, user, level, group):
+        """Record a tier-0 user's session."""
+        self.users[user] = (level, group)
+
+    def level(self):
+        """Return the highest privilege level of the users with sessions."""
+        return max(level for level, _ in self.users.values())
+
+    def group(self):
+        """Return the most privileged tier-0 group of the users with sessions."""
+        return max(self.users.values())[1]
+
+    def rank(self):
+        """Return the sort key for ranking: highest level, then the number of users, then the
+        sum of their levels.
+        """
+        return (self.level(), len(self.users), sum(level for level, _ in self.users.values()))
+
+
+class SessionAnalyzer(object):
+    """The tier-0 principals, the Domain Controllers, and the tier-0 sessions on every other
+    computer in the dataset.
+    """
+
+    def __init__(self, closure, tier0_groups):
+        """Everything that should be initiated with a new object goes here."""
+        self.closure = closure
+        self.tier0_groups = tier0_groups
+        # User -> (level, group) of the most privileged tier-0 group the user belongs to
+        self.tier0 = {}
+        # User -> set of every tier-0 group the user belongs to
+        self.tier0_memberships = {}
+        self.controllers = set()
+        self.computers = {}
+        self.sessions = 0
+        self._find_principals()
+
+    def _find_principals(self):
+        """Expand every tier-0 and Domain Controllers group in the dataset once."""
+        for group in list(self.closure.direct_members):
+            account = group.split("@", 1)[0]
+            if account in CONTROLLER_GROUPS:
+                self.controllers.update(self.closure.members_of(group, "Computer"))
+            level = self.tier0_groups.get(group, self.tier0_groups.get(account))
+            if level is None:
+                continue
+            for user in self.closure.members_of(group, "User"):
+                self.tier0_memberships.setdefault(user, set()).add(group)
+                if user not in self.tier0 or (level, group) > self.tier0[user]:
+                    self.tier0[user] = (level, group)
+
+    def sweep(self, sessions):
+        """Read (computer, computer domain, user) session records once, keeping the tier-0
+        sessions on computers that are not Domain Controllers.
+        """
+        for computer, computer_domain, user in sessions:
+            self.sessions += 1
+            if not computer or not user:
+                continue
+            user = user.upper()
+            privilege = self.tier0.get(user)
+            if privilege is None:
+                continue
+            computer = computer.upper()
+            if computer in self.controllers:
+                continue
+            if computer not in self.computers:
+                self.computers[computer] = ComputerSessions(
+                    computer, (computer_domain or "").upper() or None)
+            self.computers[computer].add(user, *privilege)
+        return self
+
+    def ranked(self, domain=None):
+        """Return the ComputerSessions of the domain's computers (or every computer), most
+        exposed first.
+        """
+        computers = [sessions for sessions in self.computers.values()
+                     if not domain or sessions.domain == domain.upper()]
+        return sorted(computers, key=lambda sessions: (tuple(-key for key in sessions.rank()),
+                                                       sessions.computer))
+
+    def computers_with(self, group):
+        """Return the sorted names of the computers with a session for a member of the group."""
+        group = group.upper()
+        return sorted(sessions.computer for sessions in self.computers.values()
+                      if any(group in self.tier0_memberships.get(user, ())
+                             for user in sessions.users))
+
+
+def get_analyzer(driver, max_depth=None):
+    """Return the shared SessionAnalyzer for the given database connection, sweeping the
+    sessions the first time it is requested.
+    """
+    key = (id(driver), max_depth)
+    with _analyzers_lock:
+        if key not in _analyzers:
+            analyzer = SessionAnalyzer(membership.get_closure(driver, max_depth),
+                                       get_tier0_groups())
+            _analyzers[key] = analyzer.sweep(helpers.stream_query(driver, "sessions.edges"))
+
+        return _analyzers[key]
+
+
+def clear_cache():
+    """Forget every analyzer built so far, so the next request reads the sessions again."""
+    with _analyzers_lock:
+        _analyzers.clear()
@@ -0,0 +1,268 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the what-if simulation for paths to Domain Admin. The attack graph
+walked by the reverse breadth-first search is loaded into memory once, and hypothetical fixes
+(removing a relationship or a group membership, or disabling an account) update the hop
+distances incrementally instead of searching the whole graph again.
+"""
+
+import re
+import heapq
+from collections import defaultdict
+
+# The kinds of changes that can be simulated and how the names after the kind are written.
+# BloodHound names can contain spaces, so relationships are written with Cypher-style arrows.
+CHANGE_KINDS = {
+    "remove-edge": re.compile(r"^(.+?)\s*-\[:?(\w+)\]->\s*(.+)$"),
+    "remove-member": re.compile(r"^(.+?)\s*->\s*(.+)$"),
+    "disable": re.compile(r"^(.+)$"),
+}
+
+# How each kind of change is written, for error messages
+CHANGE_USAGE = {
+    "remove-edge": "remove-edge SOURCE -[RELATIONSHIP]-> TARGET",
+    "remove-member": "remove-member MEMBER -> GROUP",
+    "disable": "disable ACCOUNT",
+}
+
+
+class Change(object):
+    """One hypothetical change to the attack graph."""
+
+    def __init__(self, kind, names):
+        """Everything that should be initiated with a new object goes here."""
+        self.kind = kind
+        # For remove-edge the second name is the relationship type
+        self.names = list(names)
+
+    def __str__(self):
+        if self.kind == "remove-edge":
+            return "remove-edge %s -[%s]-> %s" % tuple(self.names)
+        return "%s %s" % (self.kind, " -> ".join(self.names))
+
+
+def parse_change(text):
+    """Parse one change, like "remove-edge SOURCE -[RELATIONSHIP]-> TARGET", "remove-member
+    MEMBER -> GROUP", or "disable ACCOUNT". Raises a ValueError for anything else.
+    """
+    kind, _, rest = text.strip().partition(" ")
+    kind = kind.lower()
+    if kind not in CHANGE_KINDS:
+        raise ValueError("Unknown change: %s (use one of %s)"
+                         % (text.strip(), ", ".join(sorted(CHANGE_KINDS))))
+    match = CHANGE_KINDS[kind].match(rest.strip())
+    if not match:
+        raise ValueError("Write the %s change as %s: %s"
+                         % (kind, CHANGE_USAGE[kind], text.strip()))
+    return Change(kind, [name.strip() for name in match.groups()])
+
+
+def parse_candidates(lines):
+    """Parse candidate fixes, one per line. A candidate can make several changes at once by
+    separating them with semicolons. Blank lines and lines starting with # are skipped.
+    """
+    candidates = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        candidates.append((line, [parse_change(part) for part in line.split(";")
+                                  if part.strip()]))
+    return candidates
+
+
+class Simulation(object):
+    """The in-memory attack graph for one domain's paths to a target group. Removing edges only
+    ever makes paths longer or breaks them, so only the principals whose shortest paths ran
+    through a removed edge are revisited, and every change can be reverted to try the next
+    candidate.
+    """
+
+    def __init__(self, path_stats):
+        """Everything that should be initiated with a new object goes here."""
+        self.domain = path_stats.domain
+        self.target = path_stats.target
+        self.names = dict(path_stats.names)
+        self.index = dict((name.upper(), node) for node, name in self.names.items() if name)
+        # Node ID -> (label, domain)
+        self.details = {}
+        self.distances = {}
+        for node, (hops, label, node_domain) in path_stats.distances.items():
+            self.details[node] = (label, node_domain)
+            self.distances[node] = hops
+        if self.target is not None:
+            self.distances[self.target] = 0
+        self.outbound = defaultdict(set)
+        self.inbound = defaultdict(set)
+        for source, rel_type, target in path_stats.edges:
+            self.outbound[source].add((rel_type, target))
+            self.inbound[target].add((rel_type, source))
+        # Number of relationships from each node that lie on one of its shortest paths
+        self.support = {}
+        for node in self.distances:
+            self._count_support(node)
+        # Label -> [principals, total hops] for the domain's principals with a path
+        self.totals = defaultdict(lambda: [0, 0])
+        for node, hops in self.distances.items():
+            self._tally(node, hops, 1)
+
+    def _count_support(self, node):
+        """Recount the relationships from the node to a node one hop closer to the target."""
+        hops = self.distances.get(node)
+        if hops is None or node == self.target:
+            self.support.pop(node, None)
+            return
+        self.support[node] = sum(1 for _, other in self.outbound[node]
+                                 if self.distances.get(other) == hops - 1)
+
+    def _tally(self, node, hops, sign):
+        """Add (or remove, with a negative sign) a node's path from the domain totals."""
+        if node not in self.details:
+            return
+        label, node_domain = self.details[node]
+        if node_domain != self.domain:
+            return
+        self.totals[label][0] += sign
+        self.totals[label][1] += sign * hops
+
+    def resolve(self, change):
+        """Return the (source, rel_type, target) relationships a change removes. Names that are
+        not on any path to the target resolve to nothing, since removing them changes nothing.
+        """
+        nodes = [self.index.get(name.upper()) for name in change.names]
+        if change.kind == "disable":
+            if nodes[0] is None:
+                return []
+            return [(nodes[0], rel_type, other) for rel_type, other in self.outbound[nodes[0]]]
+        if change.kind == "remove-member":
+            source, rel_type, target = nodes[0], "MemberOf", nodes[1]
+        else:
+            source, rel_type, target = nodes[0], change.names[1], nodes[2]
+        if source is None or target is None or (rel_type, target) not in self.outbound[source]:
+            return []
+        return [(source, rel_type, target)]
+
+    def apply(self, changes):
+        """Apply the changes and return an undo record for revert()."""
+        removed = []
+        for change in changes:
+            for edge in self.resolve(change):
+                if edge not in removed:
+                    removed.append(edge)
+
+        undo = {"edges": removed, "distances": {}, "touched": set()}
+        queue = []
+        for source, rel_type, target in removed:
+            self.outbound[source].discard((rel_type, target))
+            self.inbound[target].discard((rel_type, source))
+            undo["touched"].add(source)
+            if source in self.support and \
+                    self.distances.get(target) == self.distances[source] - 1:
+                self.support[source] -= 1
+                if not self.support[source]:
+                    queue.append(source)
+
+        # Collect every node that lost its last relationship on a shortest path; nothing else
+        # can change distance
+        affected = set()
+        while queue:
+            node = queue.pop()
+            if node in affected:
+                continue
+            affected.add(node)
+            for _, other in self.inbound[node]:
+                if other in self.support and other not in affected and \
+                        self.distances[other] == self.distances[node] + 1:
+                    self.support[other] -= 1
+                    if not self.support[other]:
+                        queue.append(other)
+
+        # Settle the affected nodes again, starting from their neighbours that kept their
+        # distances
+        heap = []
+        for node in affected:
+            hops = [self.distances[other] for _, other in self.outbound[node]
+                    if other not in affected and other in self.distances]
+            if hops:
+                heapq.heappush(heap, (min(hops) + 1, node))
+        settled = {}
+        while heap:
+            hops, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled[node] = hops
+            for _, other in self.inbound[node]:
+                if other in affected and other not in settled:
+                    heapq.heappush(heap, (hops + 1, other))
+
+        for node in affected:
+            old = self.distances.pop(node)
+            undo["distances"][node] = old
+            self._tally(node, old, -1)
+            if node in settled:
+                self.distances[node] = settled[node]
+                self._tally(node, settled[node], 1)
+            undo["touched"].add(node)
+            undo["touched"].update(other for _, other in self.inbound[node])
+        for node in undo["touched"]:
+            self._count_support(node)
+
+        return undo
+
+    def revert(self, undo):
+        """Put back everything changed by apply()."""
+        for source, rel_type, target in undo["edges"]:
+            self.outbound[source].add((rel_type, target))
+            self.inbound[target].add((rel_type, source))
+        for node, old in undo["distances"].items():
+            if node in self.distances:
+                self._tally(node, self.distances[node], -1)
+            self.distances[node] = old
+            self._tally(node, old, 1)
+        for node in undo["touched"]:
+            self._count_support(node)
+
+    def count(self, label=None):
+        """Return the number of the domain's principals with a path to the target."""
+        if label:
+            return self.totals[label][0]
+        return sum(total[0] for total in self.totals.values())
+
+    def average(self, label=None):
+        """Return the average path length for the domain's principals, or None."""
+        if label:
+            principals, hops = self.totals[label]
+        else:
+            principals = sum(total[0] for total in self.totals.values())
+            hops = sum(total[1] for total in self.totals.values())
+        if not principals:
+            return None
+        return hops / principals
+
+    def percentage(self, label, total):
+        """Return the percentage of the given total with a path to the target."""
+        if not total:
+            return 0
+        return 100.0 * self.count(label) / total
+
+    def evaluate(self, changes):
+        """Return (users with a path, average path length, computers with a path) with the
+        changes applied, leaving the simulation as it was.
+        """
+        undo = self.apply(changes)
+        try:
+            return self.count("User"), self.average(), self.count("Computer")
+        finally:
+            self.revert(undo)
+
+    def rank(self, candidates):
+        """Evaluate each (description, changes) candidate on its own and return
+        (description, users, average, computers) sorted by the fewest users left with a path.
+        """
+        ranking = []
+        for description, changes in candidates:
+            users, average, computers = self.evaluate(changes)
+            ranking.append((description, users, average, computers))
+        return sorted(ranking, key=lambda result: (result[1], result[3],
+                                                    -(result[2] or 0)))
@@ -0,0 +1,355 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains Fox's graph snapshots. A snapshot is a single binary file holding the
+node table, a string pool of names, the name index, and compressed sparse row arrays for every
+relationship type in both directions. Snapshots are opened with mmap, so opening one takes
+next to no time and only the pages a metric touches are ever read from disk.
+"""
+
+import sys
+import json
+import mmap
+import struct
+from array import array
+from lib import offline
+
+MAGIC = b"FOXSNAP\0"
+VERSION = 1
+
+# Magic, version, directory offset, and directory length
+HEADER = struct.Struct("<8sIQQ")
+
+# The kept properties and how each one is stored
+PROPERTY_TYPES = (
+    ("domain", "str"),
+    ("enabled", "bool"),
+    ("pwdlastset", "int"),
+    ("hasspn", "bool"),
+    ("unconstraineddelegation", "bool"),
+    ("operatingsystem", "str"),
+    ("blocksinheritance", "bool"),
+)
+
+# Stored for integer properties that were not collected
+MISSING = -2 ** 63
+
+
+def is_snapshot(path):
+    """Return True if the path is a Fox snapshot file."""
+    try:
+        with open(path, "rb") as handle:
+            return handle.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class _Writer(object):
+    """Writes the sections of a snapshot, each aligned to 8 bytes, and records where they are."""
+
+    def __init__(self, handle):
+        """Everything that should be initiated with a new object goes here."""
+        self.handle = handle
+        self.sections = {}
+        handle.write(b"\0" * HEADER.size)
+
+    def section(self, name, values, typecode="q"):
+        """Write an array (or bytes) as the named section."""
+        offset = self.handle.tell()
+        padding = -offset % 8
+        self.handle.write(b"\0" * padding)
+        offset += padding
+        data = values if isinstance(values, bytes) else array(typecode, values).tobytes()
+        self.handle.write(data)
+        self.sections[name] = [offset, len(data), typecode]
+
+    def strings(self, name, strings):
+        """Write a list of strings as a pool of UTF-8 bytes and an offsets section."""
+        offsets = array("q", [0])
+        pool = bytearray()
+        for string in strings:
+            pool.extend(string.encode("utf-8"))
+            offsets.append(len(pool))
+        self.section(name + ".offsets", offsets)
+        self.section(name + ".pool", bytes(pool), "B")
+
+    def finish(self, directory):
+        """Write the directory and point the header at it."""
+        directory["sections"] = self.sections
+        offset = self.handle.tell()
+        data = json.dumps(directory).encode("utf-8")
+        self.handle.write(data)
+        self.handle.seek(0)
+        self.handle.write(HEADER.pack(MAGIC, VERSION, offset, len(data)))
+
+
+def _code(value, values, codes):
+    """Return the code of a string in a list of distinct values, adding it if needed."""
+    if value not in codes:
+        codes[value] = len(values)
+        values.append(value)
+    return codes[value]
+
+
+def write_snapshot(graph, path):
+    """Write an OfflineGraph to a snapshot file."""
+    count = len(graph)
+    directory = {"nodes": count, "byteorder": sys.byteorder, "labels": [], "values": {},
+                 "rel_types": sorted(graph.rel_types())}
+    with open(path, "wb") as handle:
+        writer = _Writer(handle)
+        writer.strings("names", graph.names)
+
+        label_codes = {}
+        writer.section("labels", (-1 if label is None else
+                                  _code(label, directory["labels"], label_codes)
+                                  for label in graph.labels), "b")
+
+        for prop, kind in PROPERTY_TYPES:
+            column = []
+            if kind == "str":
+                values = directory["values"].setdefault(prop, [])
+                codes = {}
+                for properties in graph.properties:
+                    value = properties.get(prop)
+                    column.append(-1 if value is None else _code(str(value), values, codes))
+                writer.section("property." + prop, column, "i")
+            elif kind == "bool":
+                for properties in graph.properties:
+                    value = properties.get(prop)
+                    column.append(1 if value is True else 0 if value is False else -1)
+                writer.section("property." + prop, column, "b")
+            else:
+                for properties in graph.properties:
+                    value = properties.get(prop)
+                    try:
+                        column.append(MISSING if value is None else int(value))
+                    except (TypeError, ValueError):
+                        column.append(MISSING)
+                writer.section("property." + prop, column)
+
+        # The index is sorted by the UTF-8 bytes of each key, for a binary search
+        index = sorted((key.encode("utf-8"), node) for key, node in graph.index.items())
+        writer.strings("index.keys", [key.decode("utf-8") for key, _ in index])
+        writer.section("index.nodes", (node for _, node in index))
+
+        for rel_type in directory["rel_types"]:
+            indptr, indices = graph._csr(rel_type)
+            sources = array("q")
+            for node in range(count):
+                sources.extend([node] * (indptr[node + 1] - indptr[node]))
+            writer.section("edges.%s.sources" % rel_type, sources)
+            writer.section("edges.%s.indptr" % rel_type, indptr)
+            writer.section("edges.%s.indices" % rel_type, indices)
+            indptr, indices = graph._csr(rel_type, reverse=True)
+            writer.section("edges.%s.reverse.indptr" % rel_type, indptr)
+            writer.section("edges.%s.reverse.indices" % rel_type, indices)
+        writer.finish(directory)
+
+
+class _Strings(object):
+    """A read-only list of the strings in a pool."""
+
+    def __init__(self, offsets, pool):
+        """Everything that should be initiated with a new object goes here."""
+        self.offsets = offsets
+        self.pool = pool
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return bytes(self.pool[self.offsets[position]:self.offsets[position + 1]]).decode("utf-8")
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def raw(self, position):
+        """Return the UTF-8 bytes of a string without decoding them."""
+        return bytes(self.pool[self.offsets[position]:self.offsets[position + 1]])
+
+
+class _Codes(object):
+    """A read-only list of the values behind a column of codes, where -1 means None."""
+
+    def __init__(self, codes, values):
+        """Everything that should be initiated with a new object goes here."""
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, position):
+        code = self.codes[position]
+        return None if code < 0 else self.values[code]
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+
+class _Properties(object):
+    """A read-only list of each node's kept properties, built from the property columns."""
+
+    def __init__(self, snapshot):
+        """Everything that should be initiated with a new object goes here."""
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def __getitem__(self, node_id):
+        properties = {}
+        for prop, _ in PROPERTY_TYPES:
+            value = self.snapshot.prop(node_id, prop)
+            if value is not None:
+                properties[prop] = value
+        return properties
+
+    def __iter__(self):
+        for node_id in range(len(self)):
+            yield self[node_id]
+
+
+class SnapshotGraph(offline.OfflineGraph):
+    """An OfflineGraph whose tables live in a memory-mapped snapshot file. It answers every
+    query the offline backend does, but nothing is read into memory until it is used.
+    """
+
+    def __init__(self, path):
+        """Everything that should be initiated with a new object goes here."""
+        offline.OfflineGraph.__init__(self)
+        self.path = path
+        with open(path, "rb") as handle:
+            self.map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise ValueError("{} is not a version {} Fox snapshot.".format(path, VERSION))
+        magic, version, offset, length = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} Fox snapshot.".format(path, VERSION))
+        if offset + length > len(self.map):
+            raise ValueError("{} is truncated.".format(path))
+        self.directory = json.loads(self.map[offset:offset + length].decode("utf-8"))
+        if self.directory["byteorder"] != sys.byteorder:
+            raise ValueError("{} was written on a machine with a different byte order."
+                             .format(path))
+        self.buffer = memoryview(self.map)
+
+        self.names = _Strings(self.section("names.offsets"), self.section("names.pool"))
+        self.labels = _Codes(self.section("labels"), self.directory["labels"])
+        self.properties = _Properties(self)
+        self.columns = {}
+        for prop, kind in PROPERTY_TYPES:
+            column = self.section("property." + prop)
+            if kind == "str":
+                column = _Codes(column, self.directory["values"][prop])
+            self.columns[prop] = (kind, column)
+        self.index_keys = _Strings(self.section("index.keys.offsets"),
+                                   self.section("index.keys.pool"))
+        self.index_nodes = self.section("index.nodes")
+        self.edges = {}
+        for rel_type in self.directory["rel_types"]:
+            self.edges[rel_type] = (self.section("edges.%s.sources" % rel_type),
+                                    self.section("edges.%s.indices" % rel_type))
+
+    def section(self, name):
+        """Return a memoryview of the named section, cast to its type."""
+        offset, length, typecode = self.directory["sections"][name]
+        view = self.buffer[offset:offset + length]
+        return view if typecode == "B" else view.cast(typecode)
+
+    def __len__(self):
+        return self.directory["nodes"]
+
+    def node(self, key, label=None, name=None):
+        raise TypeError("Snapshots are read-only.")
+
+    def domain(self, node_id):
+        """Return the domain property for a node, if the node was collected."""
+        return self.columns["domain"][1][node_id]
+
+    def prop(self, node_id, key, default=None):
+        """Return one of the kept properties for a node."""
+        kind, column = self.columns[key]
+        value = column[node_id]
+        if kind == "bool":
+            return default if value < 0 else value == 1
+        if kind == "int":
+            return default if value == MISSING else value
+        return default if value is None else value
+
+    def lookup(self, name):
+        """Return the node ID for the given name or object identifier, or None."""
+        key = str(name).upper().encode("utf-8")
+        low, high = 0, len(self.index_keys)
+        while low < high:
+            middle = (low + high) // 2
+            if self.index_keys.raw(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.index_keys) and self.index_keys.raw(low) == key:
+            return self.index_nodes[low]
+        return None
+
+    def nodes(self, label=None, domain=None):
+        """Yield the IDs of the nodes matching the given label and domain. The label and domain
+        are compared by their codes, so no strings are decoded.
+        """
+        labels = self.labels.codes
+        domains = self.columns["domain"][1]
+        label_code = domain_code = None
+        if label:
+            if label not in self.directory["labels"]:
+                return
+            label_code = self.directory["labels"].index(label)
+        if domain:
+            if domain.upper() not in domains.values:
+                return
+            domain_code = domains.values.index(domain.upper())
+        for node_id in range(len(self)):
+            if label_code is not None and labels[node_id] != label_code:
+                continue
+            if domain_code is not None and domains.codes[node_id] != domain_code:
+                continue
+            yield node_id
+
+    def _csr(self, rel_type, reverse=False):
+        """Return the compressed adjacency arrays for one relationship type."""
+        if rel_type not in self.edges:
+            return array("q", [0]) * (len(self) + 1), array("q")
+        prefix = "edges.%s.reverse" % rel_type if reverse else "edges.%s" % rel_type
+        return self.section(prefix + ".indptr"), self.section(prefix + ".indices")
+
+
+def open_snapshot(path):
+    """Open a snapshot file as a SnapshotGraph."""
+    return SnapshotGraph(path)
+
+
+def build_graph(nodes, edges):
+    """Build an OfflineGraph from the records of the snapshot.nodes and snapshot.edges queries,
+    so a snapshot can be written from a Neo4j database.
+    """
+    graph = offline.OfflineGraph()
+    interned = {}
+    labels = list(offline.COLLECTION_LABELS.values())
+    for node, node_labels, name, properties in nodes:
+        label = next((label for label in labels if label in (node_labels or [])), None)
+        node_id = graph.node(name or "#%s" % node, label, name)
+        kept = {}
+        for prop, value in (properties or {}).items():
+            prop = prop.lower()
+            if prop in offline.KEPT_PROPERTIES and value is not None:
+                kept[prop] = value
+        if properties:
+            kept["domain"] = str(kept.get("domain") or
+                                 graph._derive_domain(label, graph.names[node_id])).upper()
+        graph.properties[node_id] = kept
+        interned[node] = node_id
+    for source, rel_type, target in edges:
+        if source in interned and target in interned:
+            graph.add_edge(interned[source], rel_type, interned[target])
+    return graph
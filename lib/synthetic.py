@@ -0,0 +1,290 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the seeded generator of synthetic BloodHound data. It produces
+SharpHound-shaped JSON for users, computers, nested groups, sessions, local admin rights, GPOs,
+and OUs across several domains, with foreign group membership between them, so Fox can be
+measured at any scale without a customer's dataset. The same seed always produces the same data.
+"""
+
+import json
+import random
+import zipfile
+from lib import offline
+
+# Share of each domain's objects that are users, computers, groups, OUs, and GPOs
+OBJECT_SHARES = (
+    ("users", 0.55),
+    ("computers", 0.35),
+    ("groups", 0.08),
+    ("ous", 0.01),
+    ("gpos", 0.01),
+)
+
+# Chance of a custom group sitting at each nesting level; level 0 groups hold users and every
+# other level holds groups from the level below it
+DEPTH_WEIGHTS = (0.6, 0.25, 0.1, 0.04, 0.01)
+
+OPERATING_SYSTEMS = (
+    ("Windows 10 Enterprise", 0.55),
+    ("Windows 7 Professional", 0.1),
+    ("Windows Server 2016 Standard", 0.2),
+    ("Windows Server 2012 R2 Standard", 0.1),
+    ("Windows Server 2008 R2 Standard", 0.05),
+)
+
+# Rights handed out through ACEs, for a few extra paths that are not group membership
+ACE_RIGHTS = ("GenericAll", "GenericWrite", "WriteDacl", "ForceChangePassword", "AddMember")
+
+SECONDS_PER_YEAR = 365 * 24 * 60 * 60
+
+# The time the datasets are generated "at" (2020-01-01 UTC), so password ages depend on the seed
+# and not on the day the data was generated
+EPOCH = 1577836800
+
+
+def _weighted(rng, choices):
+    """Pick a value from (value, weight) pairs."""
+    point = rng.random() * sum(weight for _, weight in choices)
+    for value, weight in choices:
+        point -= weight
+        if point <= 0:
+            return value
+    return choices[-1][0]
+
+
+class SyntheticDomain(object):
+    """The layout of one synthetic domain. Object names are worked out from their index, so any
+    object can be referenced without keeping the generated entries around.
+    """
+
+    def __init__(self, dataset, number, objects):
+        """Everything that should be initiated with a new object goes here."""
+        self.dataset = dataset
+        self.number = number
+        self.name = "CORP%s.LOCAL" % number if number else "CORP.LOCAL"
+        counts = dict((kind, int(objects * share)) for kind, share in OBJECT_SHARES)
+        self.users = max(counts["users"], 5)
+        self.computers = max(counts["computers"], 3)
+        self.groups = max(counts["groups"], 3)
+        self.ous = max(counts["ous"], 1)
+        self.gpos = max(counts["gpos"], 1)
+        self.admins = max(2, self.users // 500)
+        self.domain_controllers = max(1, self.computers // 1000)
+        # The nesting level of every custom group, and the groups at each level
+        rng = self.random("levels")
+        levels = [(level, weight) for level, weight in enumerate(DEPTH_WEIGHTS)]
+        self.levels = [_weighted(rng, levels) for _ in range(self.groups)]
+        self.levels[0] = 0
+        self.by_level = {}
+        for group, level in enumerate(self.levels):
+            self.by_level.setdefault(level, []).append(group)
+
+    def random(self, kind):
+        """Return the random generator for one kind of object in this domain."""
+        return random.Random("%s-%s-%s" % (self.dataset.seed, self.number, kind))
+
+    def user(self, index):
+        if index < self.admins:
+            return "ADM_USER%s@%s" % (index, self.name)
+        return "USER%s@%s" % (index, self.name)
+
+    def computer(self, index):
+        if index < self.domain_controllers:
+            return "DC%s.%s" % (index, self.name)
+        return "WS%s.%s" % (index, self.name)
+
+    def group(self, index):
+        return "GROUP%s@%s" % (index, self.name)
+
+    def builtin(self, name):
+        return "%s@%s" % (name, self.name)
+
+    def helpdesk(self):
+        """Return the custom group that administers the workstations."""
+        return self.group(self.by_level.get(1, self.by_level[0])[0])
+
+    def user_entries(self):
+        rng = self.random("users")
+        for index in range(self.users):
+            aces = []
+            if rng.random() < 0.01:
+                aces.append({"PrincipalName": self.group(rng.randrange(self.groups)),
+                             "PrincipalType": "group", "RightName": rng.choice(ACE_RIGHTS)})
+            yield {
+                "Name": self.user(index),
+                "PrimaryGroup": self.builtin("DOMAIN USERS"),
+                "Properties": {
+                    "domain": self.name,
+                    "enabled": rng.random() < 0.9,
+                    "pwdlastset": int(self.dataset.now - rng.random() * 3 * SECONDS_PER_YEAR),
+                    "hasspn": index < self.admins and rng.random() < 0.3 or
+                              rng.random() < 0.02,
+                },
+                "Aces": aces,
+            }
+
+    def computer_entries(self):
+        rng = self.random("computers")
+        for index in range(self.computers):
+            controller = index < self.domain_controllers
+            admins = [{"Name": self.builtin("DOMAIN ADMINS"), "Type": "group"}]
+            if not controller:
+                admins.append({"Name": self.helpdesk(), "Type": "group"})
+                if rng.random() < 0.05:
+                    admins.append({"Name": self.user(rng.randrange(self.users)),
+                                   "Type": "user"})
+            rdp_users = []
+            if not controller and rng.random() < 0.1:
+                rdp_users.append({"Name": self.group(rng.randrange(self.groups)),
+                                  "Type": "group"})
+            yield {
+                "Name": self.computer(index),
+                "PrimaryGroup": self.builtin("DOMAIN CONTROLLERS" if controller
+                                            else "DOMAIN COMPUTERS"),
+                "Properties": {
+                    "domain": self.name,
+                    "operatingsystem": ("Windows Server 2016 Standard" if controller
+                                        else _weighted(rng, OPERATING_SYSTEMS)),
+                    "unconstraineddelegation": controller or rng.random() < 0.01,
+                },
+                "LocalAdmins": admins,
+                "RemoteDesktopUsers": rdp_users,
+            }
+
+    def _members(self, names):
+        return [{"MemberName": name, "MemberType": member_type} for name, member_type in names]
+
+    def group_entries(self):
+        rng = self.random("groups")
+        domains = self.dataset.domains
+        admins = [(self.user(index), "user") for index in range(self.admins)]
+        # Half of the administrators are Domain Admins through a nested group
+        administrators = [(self.builtin("DOMAIN ADMINS"), "group")]
+        builtins = [
+            ("DOMAIN ADMINS", admins[::2] + [(self.builtin("IT ADMINS"), "group")]),
+            ("IT ADMINS", admins[1::2]),
+            ("ADMINISTRATORS", administrators),
+            ("DOMAIN USERS", []),
+            ("DOMAIN COMPUTERS", []),
+            ("DOMAIN CONTROLLERS", []),
+            ("REMOTE DESKTOP USERS", [(self.builtin("DOMAIN USERS"), "group")]),
+        ]
+        if self.number == 0:
+            builtins.append(("ENTERPRISE ADMINS", admins[:1]))
+            administrators.append((self.builtin("ENTERPRISE ADMINS"), "group"))
+        for name, members in builtins:
+            yield {"Name": self.builtin(name), "Properties": {"domain": self.name},
+                   "Members": self._members(members), "Aces": []}
+
+        # Each user lands in about two of the groups at the bottom of the nesting
+        average = max(1, 2 * self.users // len(self.by_level[0]))
+        for index, level in enumerate(self.levels):
+            members = set()
+            if level == 0:
+                for _ in range(rng.randint(1, 2 * average)):
+                    members.add((self.user(rng.randrange(self.users)), "user"))
+                # A few groups hold users from another domain
+                if len(domains) > 1 and rng.random() < 0.02:
+                    other = domains[(self.number + 1) % len(domains)]
+                    members.add((other.user(rng.randrange(other.users)), "user"))
+            else:
+                below = self.by_level.get(level - 1) or self.by_level[0]
+                for _ in range(rng.randint(1, 4)):
+                    members.add((self.group(rng.choice(below)), "group"))
+                for _ in range(rng.randint(0, 3)):
+                    members.add((self.user(rng.randrange(self.users)), "user"))
+            aces = []
+            if rng.random() < 0.02:
+                aces.append({"PrincipalName": self.group(rng.randrange(self.groups)),
+                             "PrincipalType": "group", "RightName": rng.choice(ACE_RIGHTS)})
+            yield {"Name": self.group(index), "Properties": {"domain": self.name},
+                   "Members": self._members(sorted(members)), "Aces": aces}
+
+    def session_entries(self):
+        rng = self.random("sessions")
+        for index in range(self.computers):
+            for _ in range(rng.randint(0, 2)):
+                yield {"UserName": self.user(rng.randrange(self.users)),
+                       "ComputerName": self.computer(index), "Weight": 1}
+            # Now and then an administrator leaves a session on a workstation
+            if index >= self.domain_controllers and rng.random() < 0.01:
+                yield {"UserName": self.user(rng.randrange(self.admins)),
+                       "ComputerName": self.computer(index), "Weight": 1}
+
+    def ou_entries(self):
+        rng = self.random("ous")
+        per_ou = max(1, self.computers // self.ous)
+        for index in range(self.ous):
+            computers = range(index * per_ou, min(self.computers, (index + 1) * per_ou))
+            yield {
+                "Name": "OU%s@%s" % (index, self.name),
+                "Guid": "{%s-OU-%s}" % (self.name, index),
+                "Properties": {"domain": self.name, "blocksinheritance": rng.random() < 0.1},
+                "Links": [{"IsEnforced": False,
+                           "Name": "GPO%s@%s" % (rng.randrange(self.gpos), self.name)}],
+                "Computers": [self.computer(computer) for computer in computers],
+            }
+
+    def gpo_entries(self):
+        for index in range(self.gpos):
+            yield {"Name": "GPO%s@%s" % (index, self.name),
+                   "Guid": "{%s-GPO-%s}" % (self.name, index),
+                   "Properties": {"domain": self.name}}
+
+    def domain_entries(self):
+        yield {"Name": self.name, "Properties": {"domain": self.name},
+               "Links": [{"IsEnforced": False, "Name": "GPO0@%s" % self.name}], "Trusts": []}
+
+
+class SyntheticDataset(object):
+    """A seeded synthetic BloodHound dataset of roughly the requested number of objects, split
+    across the requested number of domains with the first domain the largest.
+    """
+
+    def __init__(self, objects=1000, domains=2, seed=1, now=EPOCH):
+        """Everything that should be initiated with a new object goes here."""
+        self.objects = objects
+        self.seed = seed
+        self.now = now
+        self.domains = []
+        shares = [2.0] + [1.0] * (domains - 1)
+        for number, share in enumerate(shares):
+            self.domains.append(SyntheticDomain(self, number, objects * share / sum(shares)))
+
+    def entries(self, kind):
+        """Yield the SharpHound entries of one kind (users, groups, etc.) for every domain."""
+        for domain in self.domains:
+            for entry in getattr(domain, "%s_entries" % kind[:-1])():
+                yield entry
+
+    def kinds(self):
+        """Return the kinds of SharpHound files the dataset is made of."""
+        return ("domains", "gpos", "ous", "groups", "users", "computers", "sessions")
+
+    def graph(self):
+        """Build an OfflineGraph straight from the generated entries, without writing files."""
+        graph = offline.OfflineGraph()
+        for kind in self.kinds():
+            for entry in self.entries(kind):
+                if kind == "sessions":
+                    graph.add_session(entry)
+                else:
+                    graph.add_object(kind, entry)
+        return graph
+
+    def write(self, path):
+        """Write the dataset as a SharpHound ZIP with one JSON file per kind. Entries are written
+        as they are generated, so even very large datasets are never held in memory.
+        """
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for kind in self.kinds():
+                with archive.open("%s.json" % kind, "w", force_zip64=True) as raw:
+                    raw.write(('{"%s": [' % kind).encode("utf-8"))
+                    count = 0
+                    for entry in self.entries(kind):
+                        raw.write(((",\n" if count else "\n") + json.dumps(entry))
+                                  .encode("utf-8"))
+                        count += 1
+                    meta = {"count": count, "type": kind, "version": 2}
+                    raw.write(('\n], "meta": %s}\n' % json.dumps(meta)).encode("utf-8"))
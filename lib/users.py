@@ -5,19 +5,64 @@
 statistics.
 """
 
+import time
 from neo4j.v1 import GraphDatabase
 from time import ctime
 from datetime import datetime, timedelta, date
 from colors import red, green, yellow
-from lib import helpers
+from lib import helpers, classify, membership
+
+# Default edges (in months) of the password age histogram: 0-3, 3-6, 6-12, and 12+ months
+AGE_BUCKETS = (3, 6, 12)
+
+# Seconds in an average month, used to turn month counts into PwdLastSet epoch offsets
+SECONDS_PER_MONTH = 365 * 24 * 60 * 60 / 12
+
+
+class PasswordAges(object):
+    """The password age histogram for one domain's users, split into enabled and disabled
+    accounts, along with the number of users with passwords older than each threshold.
+    """
+
+    def __init__(self, domain, thresholds, buckets, records=None):
+        """Everything that should be initiated with a new object goes here."""
+        self.domain = domain
+        self.thresholds = sorted(set(thresholds))
+        self.buckets = sorted(set(buckets))
+        # Bucket label -> [enabled, disabled]
+        self.histogram = dict((label, [0, 0]) for label in self.labels())
+        # Threshold in months -> number of users
+        self.stale = dict((months, 0) for months in self.thresholds)
+        labels = self.labels()
+        for enabled, bucket, stale, total in records or []:
+            self.histogram[labels[bucket]][0 if enabled else 1] += total
+            # A user older than one threshold is older than every smaller threshold, too
+            for months in self.thresholds[:stale]:
+                self.stale[months] += total
+
+    def labels(self):
+        """Return the histogram's bucket labels, like 0-3, 3-6, and 12+."""
+        edges = [0] + self.buckets
+        labels = ["%s-%s" % (low, high) for low, high in zip(edges, edges[1:])]
+        labels.append("%s+" % edges[-1])
+        return labels
+
 
 class UserMetrics(object):
     """A class containing functions for checking group membership data."""
 
-    def __init__(self, driver):
+    def __init__(self, driver, max_depth=None, now=None):
         """Everything that should be initiated with a new object goes here."""
         # Collect the database info from the config file
         self.neo4j_driver = driver
+        # Optional cap on how many levels of group nesting are unrolled
+        self.max_depth = max_depth
+        # Optional time, in seconds since the epoch, that password ages are measured from
+        self.now = now
+
+    def current_time(self):
+        """Return the time password ages are measured from, which is now unless one was given."""
+        return self.now or int(time.time())
 
     def get_total_users(self, domain, enabled=False):
         """Returns the total number of users in the given domain. All user accounts are returned
@@ -25,59 +70,34 @@ class UserMetrics(object):
         are returned.
         """
         if enabled:
-            query = """
-            MATCH (totalUsers:User {domain:UPPER('%s')})
-            WHERE (totalUsers.Enabled = True)
-            RETURN COUNT(DISTINCT(totalUsers))
-            """ % domain            
+            name = "users.total_enabled_users"
         else:
-            query = """
-            MATCH (totalUsers:User {domain:UPPER('%s')})
-            RETURN COUNT(DISTINCT(totalUsers))
-            """ % domain
-
-        results = helpers.execute_query(self.neo4j_driver, query)
+            name = "users.total_users"
 
-        for record in results:
-            return record[0]
+        return helpers.query_value(self.neo4j_driver, name, domain=domain)
 
     def get_total_computers(self, domain):
         """Returns the total number of computers in the given domain."""
-        query = """
-        MATCH (totalComputers:Computer {domain:UPPER('%s')})
-        RETURN COUNT(DISTINCT(totalComputers))
-        """ % domain
-
-        results = helpers.execute_query(self.neo4j_driver, query)
-
-        for record in results:
-            return record[0]
+        return helpers.query_value(self.neo4j_driver, "users.total_computers", domain=domain)
 
     def find_da_spn(self, domain):
         """Identify Domain Admins linked to SPNs."""
-        query = """
-        MATCH (u:User {domain:'%s'})-[:MemberOf*1..]->(g:Group {name:'DOMAIN ADMINS@%s'})
-        WHERE u.HasSPN = True
-        RETURN u.name
-        """ % (domain, domain)
+        closure = membership.get_closure(self.neo4j_driver, self.max_depth)
+        domain_admins = closure.members_of("DOMAIN ADMINS@%s" % domain, "User")
 
-        results = helpers.execute_query(self.neo4j_driver, query)
+        results = helpers.stream_query(self.neo4j_driver, "users.spn_users", domain=domain)
 
         has_spn = []
         for record in results:
-            has_spn.append(record[0])
+            if record[0].upper() in domain_admins:
+                has_spn.append(record[0])
 
         return has_spn
 
     def find_unconstrained_delegation(self, domain):
         """Identifies computers with unconstrained delegation enabled on the given domain."""
-        query = """
-        MATCH (c:Computer {domain:'%s'})
-        WHERE c.UnconstrainedDelegation = True
-        RETURN c.name
-        """ % domain
-
-        results = helpers.execute_query(self.neo4j_driver, query)
+        results = helpers.execute_query(self.neo4j_driver, "users.unconstrained_delegation",
+                                        domain=domain)
 
         computers = []
         for record in results:
@@ -86,67 +106,53 @@ class UserMetrics(object):
         return computers
 
     def find_old_pwdlastset(self, domain, months=6):
-        """Find active users with PwdLastSet dates older than the specified number of months."""
-        months_ago = datetime.today() - timedelta(months*365/12)
-
-        query = """
-        MATCH (u:User {domain:'%s'})
-        RETURN u.name,u.PwdLastSet
-        """ % domain
+        """Find active users with PwdLastSet dates older than the specified number of months.
+        The cutoff is compared against the PwdLastSet epoch in the query, so only the stale
+        users come back.
+        """
+        return dict(self.iter_old_pwdlastset(domain, months))
 
-        results = helpers.execute_query(self.neo4j_driver, query)
+    def iter_old_pwdlastset(self, domain, months=6):
+        """Generator that yields (user, PwdLastSet date) for users with passwords older than the
+        specified number of months as they arrive from the database.
+        """
+        cutoff = int(self.current_time() - months * SECONDS_PER_MONTH)
+        results = helpers.stream_query(self.neo4j_driver, "users.old_pwdlastset",
+                                       domain=domain, cutoff=cutoff)
 
-        old_passwords = {}
         for record in results:
-            timestamp = record[1]
-            if timestamp:
-                pwdlastset = datetime.fromtimestamp(timestamp)
-                if pwdlastset < months_ago:
-                    old_passwords[record[0]] = ctime(timestamp)
+            yield record[0], ctime(record[1])
+
+    def get_password_ages(self, domain, thresholds=(6,), buckets=AGE_BUCKETS):
+        """Returns a PasswordAges object for the given domain. The query buckets each user's
+        PwdLastSet and counts the thresholds it is older than, so one small aggregate comes back
+        no matter how many users or thresholds there are.
+        """
+        now = self.current_time()
+        edges = [int(months * SECONDS_PER_MONTH) for months in sorted(set(buckets))]
+        cutoffs = [int(now - months * SECONDS_PER_MONTH) for months in sorted(set(thresholds))]
+        results = helpers.execute_query(self.neo4j_driver, "users.pwdlastset_ages",
+                                        domain=domain, now=now, edges=edges, cutoffs=cutoffs)
 
-        return old_passwords
+        return PasswordAges(domain, thresholds, buckets, results)
 
     def find_special_users(self, domain):
         """Attempt to find user accounts containing common prefixes or suffixes that often
-        denote accounts with administrator privileges.
+        denote accounts with administrator privileges. Returns a list of (user, rule) pairs
+        naming the classification rule each account matched.
         """
-        # TODO: This seems like it could be more efficient
-        query = """
-        MATCH (u:User {domain:'%s'})
-        WHERE u.name STARTS WITH '_' or u.name STARTS WITH '$'
-        or u.name =~ '(?i).*ADMIN_.*' or u.name =~ '(?i).*ADMIN-.*'
-        or u.name =~ '(?i).*_ADMIN.*' or u.name =~ '(?i).*-ADMIN.*'
-        or u.name =~ '(?i).*ADM_.*' or u.name =~ '(?i).*ADM-.*'
-        or u.name =~ '(?i).*_ADM.*' or u.name =~ '(?i).*-ADM.*'
-        or u.name =~ '(?i).*_A.*' or u.name =~ '(?i).*-A.*'
-        or u.name =~ '(?i).*A_.*' or u.name =~ '(?i).*A-.*'
-        RETURN u.name
-        """ % domain
-
-        results = helpers.execute_query(self.neo4j_driver, query)
-
-        users = []
-        for record in results:
-            users.append(record[0])
+        return classify.get_classification(self.neo4j_driver, domain).get("User")
 
-        return users
+    def find_special_computers(self, domain):
+        """Attempt to find computers with names that suggest administrative use, like admin
+        workstations and jump boxes. Returns a list of (computer, rule) pairs.
+        """
+        return classify.get_classification(self.neo4j_driver, domain).get("Computer")
 
     def find_foreign_group_membership(self, domain):
-        """Identify users with foregin group memberships."""
-        query = """
-        MATCH (n:User) 
-        WHERE n.name ENDS WITH ('@' + '%s') 
-        WITH n 
-        MATCH (n)-[r:MemberOf]->(m:Group) 
-        WHERE NOT m.name ENDS WITH ('@' + '%s') 
-        RETURN n.name,m.name
-        """ % (domain, domain)
-
-        results = helpers.execute_query(self.neo4j_driver, query)
-
-        users = {}
-        for record in results:
-            users[record[0]] = record[1]
-
-        return users
+        """Identify users with foreign group memberships, direct or nested. Returns a
+        dictionary of user -> list of (foreign group, direct) pairs.
+        """
+        foreign = membership.get_foreign_membership(self.neo4j_driver, self.max_depth)
+        return foreign.memberships(domain, "User")
     
\ No newline at end of file
@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""This module contains the vectorized metrics. Users, computers, groups, GPOs, OUs, and the
+MemberOf relationships are pulled once in a few bulk queries, the node IDs are interned into
+dense integers, and group membership is kept as compressed sparse arrays. The domain summary,
+average group membership, and password ages are then worked out with NumPy for every domain
+instead of with a Cypher aggregation per domain.
+"""
+
+import time
+import threading
+from lib import domains, helpers, users
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Graphs are kept for each database connection
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+# Label codes for the node arrays
+LABELS = ("User", "Computer", "Group", "GPO", "OU")
+
+
+class BulkGraph(object):
+    """Column arrays for every node and the MemberOf relationships between them. Node i of
+    every array is the i-th smallest database ID, and strings like domains and operating
+    systems are stored as codes into a list of the distinct values.
+    """
+
+    def __init__(self):
+        """Everything that should be initiated with a new object goes here."""
+        self.domain_names = []
+        self.domain_codes = {}
+        self.system_names = []
+        self.system_codes = {}
+        self.ids = None
+        self.label = None
+        self.domain = None
+        self.enabled = None
+        self.pwdlastset = None
+        self.system = None
+        self.unconstrained = None
+        self.flag = None
+        # MemberOf as (member, group) pairs of dense node numbers, and the group -> parent
+        # groups adjacency in compressed sparse row form
+        self.members = None
+        self.groups = None
+        self.parent_indptr = None
+        self.parent_indices = None
+        self._closure_sizes = {}
+        self._lock = threading.Lock()
+
+    def _code(self, value, names, codes):
+        """Return the code for a string, adding it the first time it is seen. Empty values
+        get -1.
+        """
+        if not value:
+            return -1
+        value = str(value)
+        code = codes.get(value)
+        if code is None:
+            code = len(names)
+            codes[value] = code
+            names.append(value)
+        return code
+
+    def load(self, driver):
+        """Pull the nodes and relationships and build the arrays."""
+        columns = dict((name, []) for name in ("ids", "label", "domain", "enabled",
+                                               "pwdlastset", "system", "unconstrained",
+                                               "flag"))
+
+        def add(node, label, domain, enabled=False, pwdlastset=0, system=None,
+                unconstrained=False, flag=False):
+            columns["ids"].append(node)
+            columns["label"].append(LABELS.index(label))
+            columns["domain"].append(self._code((domain or "").upper(), self.domain_names,
+                                                self.domain_codes))
+            columns["enabled"].append(enabled is True)
+            columns["pwdlastset"].append(pwdlastset or 0)
+            columns["system"].append(self._code(system, self.system_names, self.system_codes))
+            columns["unconstrained"].append(unconstrained is True)
+            columns["flag"].append(flag is True)
+
+        for node, domain, enabled, pwdlastset in helpers.stream_query(driver, "bulk.users"):
+            add(node, "User", domain, enabled=enabled, pwdlastset=pwdlastset)
+        for node, domain, system, unconstrained in helpers.stream_query(driver,
+                                                                        "bulk.computers"):
+            add(node, "Computer", domain, system=system, unconstrained=unconstrained)
+        for node, domain in helpers.stream_query(driver, "bulk.groups"):
+            add(node, "Group", domain)
+        for node, label, domain, flag in helpers.stream_query(driver, "bulk.containers"):
+            add(node, label, domain, flag=flag)
+
+        ids = numpy.array(columns["ids"], dtype=numpy.int64)
+        order = numpy.argsort(ids, kind="stable")
+        self.ids = ids[order]
+        self.label = numpy.array(columns["label"], dtype=numpy.int8)[order]
+        self.domain = numpy.array(columns["domain"], dtype=numpy.int32)[order]
+        self.enabled = numpy.array(columns["enabled"], dtype=bool)[order]
+        self.pwdlastset = numpy.array(columns["pwdlastset"], dtype=numpy.int64)[order]
+        self.system = numpy.array(columns["system"], dtype=numpy.int32)[order]
+        self.unconstrained = numpy.array(columns["unconstrained"], dtype=bool)[order]
+        self.flag = numpy.array(columns["flag"], dtype=bool)[order]
+
+        pairs = numpy.array(list(helpers.stream_query(driver, "bulk.memberships")),
+                            dtype=numpy.int64).reshape(-1, 2)
+        members = self.intern(pairs[:, 0])
+        groups = self.intern(pairs[:, 1])
+        # Relationships to or from nodes that were not pulled are dropped
+        known = (members >= 0) & (groups >= 0)
+        self.members = members[known]
+        self.groups = groups[known]
+        self._build_parents()
+        return self
+
+    def intern(self, ids):
+        """Return the dense node numbers for an array of database IDs, or -1 for unknown IDs."""
+        if not len(self.ids):
+            return numpy.full(len(ids), -1, dtype=numpy.int64)
+        positions = numpy.minimum(numpy.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return numpy.where(self.ids[positions] == ids, positions, -1)
+
+    def _build_parents(self):
+        """Build the compressed sparse rows of each group's parent groups."""
+        nested = self.label[self.members] == LABELS.index("Group")
+        children = self.members[nested]
+        parents = self.groups[nested]
+        order = numpy.argsort(children, kind="stable")
+        self.parent_indices = parents[order]
+        self.parent_indptr = numpy.zeros(len(self.ids) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(children, minlength=len(self.ids)),
+                     out=self.parent_indptr[1:])
+
+    def mask(self, label, domain=None):
+        """Return a boolean array selecting the nodes with the label, in the domain."""
+        selected = self.label == LABELS.index(label)
+        if domain:
+            code = self.domain_codes.get(domain.upper())
+            if code is None:
+                return numpy.zeros(len(self.ids), dtype=bool)
+            selected &= self.domain == code
+        return selected
+
+    def direct_counts(self):
+        """Return the number of direct group memberships of every node."""
+        return numpy.bincount(self.members, minlength=len(self.ids))
+
+    def closure_sizes(self, max_depth=None):
+        """Return the number of direct and nested groups of every user. The nested groups of
+        each group are worked out first, then joined onto the users' direct groups in one pass.
+        """
+        with self._lock:
+            if max_depth not in self._closure_sizes:
+                self._closure_sizes[max_depth] = self._closure(max_depth)
+            return self._closure_sizes[max_depth]
+
+    def _gather(self, pairs, indptr, indices):
+        """For (source, node) pairs encoded as source * count + node, return the encoded
+        (source, neighbour) pairs for every neighbour of each node in the sparse rows.
+        """
+        count = len(self.ids)
+        sources = pairs // count
+        starts = indptr[pairs % count]
+        lengths = indptr[pairs % count + 1] - starts
+        total = int(lengths.sum())
+        offsets = numpy.arange(total) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+        neighbours = indices[numpy.repeat(starts, lengths) + offsets]
+        return numpy.repeat(sources, lengths) * count + neighbours
+
+    def _ancestors(self, steps):
+        """Return the sparse rows of the groups each group reaches within the number of
+        nesting steps (or any number if steps is None). Each round only expands the pairs found
+        in the round before, so nesting cycles stop adding pairs.
+        """
+        count = len(self.ids)
+        children = numpy.repeat(numpy.arange(count), numpy.diff(self.parent_indptr))
+        known = numpy.unique(children * count + self.parent_indices)
+        new = known
+        depth = 1
+        while len(new) and (steps is None or depth < steps):
+            found = numpy.unique(self._gather(new, self.parent_indptr, self.parent_indices))
+            new = found[~numpy.isin(found, known, assume_unique=True)]
+            known = numpy.union1d(known, new)
+            depth += 1
+        if steps == 0:
+            known = known[:0]
+        indptr = numpy.zeros(count + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(known // count, minlength=count), out=indptr[1:])
+        return indptr, known % count
+
+    def _closure(self, max_depth):
+        count = len(self.ids)
+        if max_depth == 0:
+            return numpy.zeros(count, dtype=numpy.int64)
+        users = self.label[self.members] == LABELS.index("User")
+        # Pairs are encoded as user * count + group
+        direct = numpy.unique(self.members[users] * count + self.groups[users])
+        indptr, indices = self._ancestors(None if max_depth is None else max_depth - 1)
+        known = numpy.unique(numpy.concatenate([direct, self._gather(direct, indptr, indices)]))
+        return numpy.bincount(known // count, minlength=count)
+
+
+def get_bulk_graph(driver):
+    """Return the shared BulkGraph for the given database connection, pulling the data the
+    first time it is requested.
+    """
+    key = id(driver)
+    with _graphs_lock:
+        if key not in _graphs:
+            _graphs[key] = BulkGraph().load(driver)
+
+        return _graphs[key]
+
+
+def clear_cache():
+    """Forget every graph pulled so far, so the next request pulls the data again."""
+    with _graphs_lock:
+        _graphs.clear()
+
+
+class VectorMetrics(object):
+    """Drop-in replacements for the aggregate metrics of DomainData, GroupMetrics, and
+    UserMetrics that are computed with NumPy from the bulk graph. Each method returns the same
+    result as the method it replaces.
+    """
+
+    def __init__(self, driver, max_depth=None, now=None):
+        """Everything that should be initiated with a new object goes here."""
+        self.neo4j_driver = driver
+        # Optional cap on how many levels of group nesting are unrolled
+        self.max_depth = max_depth
+        # Optional time, in seconds since the epoch, that password ages are measured from
+        self.now = now
+
+    def get_graph(self):
+        """Return the bulk graph for this object's connection."""
+        return get_bulk_graph(self.neo4j_driver)
+
+    def get_domain_summary(self, domain):
+        """Returns the DomainSummary for the given domain."""
+        graph = self.get_graph()
+        user_mask = graph.mask("User", domain)
+        computer_mask = graph.mask("Computer", domain)
+        systems = graph.system[computer_mask]
+        codes, totals = numpy.unique(systems[systems >= 0], return_counts=True)
+        return domains.DomainSummary(domain, (
+            int(user_mask.sum()),
+            int((user_mask & graph.enabled).sum()),
+            int(computer_mask.sum()),
+            int((computer_mask & graph.unconstrained).sum()),
+            [[graph.system_names[code], int(total)] for code, total in zip(codes, totals)],
+            int((graph.mask("GPO", domain) & graph.flag).sum()),
+            int((graph.mask("OU", domain) & graph.flag).sum()),
+        ))
+
+    def get_avg_group_membership(self, domain, recursive=False):
+        """Calculate the average number of groups memberships for each user with at least one
+        membership. If the recursive flag is set, nested groups are counted too.
+        """
+        graph = self.get_graph()
+        direct = graph.direct_counts()
+        selected = graph.mask("User", domain) & (direct > 0)
+        if not selected.any():
+            return None
+        counts = graph.closure_sizes(self.max_depth) if recursive else direct
+        return float(counts[selected].mean())
+
+    def get_password_ages(self, domain, thresholds=(6,), buckets=users.AGE_BUCKETS):
+        """Returns a PasswordAges object for the given domain."""
+        graph = self.get_graph()
+        now = self.now or int(time.time())
+        edges = numpy.array([int(months * users.SECONDS_PER_MONTH)
+                             for months in sorted(set(buckets))], dtype=numpy.int64)
+        cutoffs = numpy.sort([int(now - months * users.SECONDS_PER_MONTH)
+                              for months in set(thresholds)]).astype(numpy.int64)
+        selected = graph.mask("User", domain) & (graph.pwdlastset != 0)
+        timestamps = graph.pwdlastset[selected]
+        bucket = numpy.searchsorted(edges, now - timestamps, side="right")
+        stale = len(cutoffs) - numpy.searchsorted(cutoffs, timestamps, side="right")
+        keys = numpy.stack([graph.enabled[selected].astype(numpy.int64), bucket, stale], axis=1)
+        combinations, totals = numpy.unique(keys.reshape(-1, 3), axis=0, return_counts=True)
+        records = [(bool(enabled), int(bucket), int(stale), int(total))
+                   for (enabled, bucket, stale), total in zip(combinations, totals)]
+        return users.PasswordAges(domain, thresholds, buckets, records)
@@ -0,0 +1,29 @@
+"""Shared fixtures: a small seeded synthetic dataset, and module caches reset between tests."""
+
+import pytest
+
+from lib import classify, membership, rights, sessions, synthetic, vectorized
+
+# Small enough to build in well under a second, large enough for nesting, sessions, and
+# foreign membership between the two domains
+OBJECTS = 1000
+DOMAINS = 2
+SEED = 1
+
+
+@pytest.fixture(scope="session")
+def dataset():
+    return synthetic.SyntheticDataset(OBJECTS, DOMAINS, SEED)
+
+
+@pytest.fixture
+def graph(dataset):
+    return dataset.graph()
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Module caches are keyed on id(driver), which a later test's graph can reuse."""
+    yield
+    for module in (classify, membership, rights, sessions, vectorized):
+        module.clear_cache()
@@ -0,0 +1,132 @@
+"""Tests for the shared membership closure and the cross-domain memberships built from it."""
+
+from collections import deque
+
+import pytest
+
+from lib import groups, membership, users
+
+# A user in a chain of nested groups that ends in a nesting cycle, G2 -> G3 -> G4 -> G2, with
+# one group in another domain
+EDGES = (
+    ("U1@A.LOCAL", ["User"], "A.LOCAL", "G1@A.LOCAL", "A.LOCAL"),
+    ("G1@A.LOCAL", ["Group"], "A.LOCAL", "G2@A.LOCAL", "A.LOCAL"),
+    ("G2@A.LOCAL", ["Group"], "A.LOCAL", "G3@A.LOCAL", "A.LOCAL"),
+    ("G3@A.LOCAL", ["Group"], "A.LOCAL", "G4@B.LOCAL", "B.LOCAL"),
+    ("G4@B.LOCAL", ["Group"], "B.LOCAL", "G2@A.LOCAL", "A.LOCAL"),
+    ("C1.A.LOCAL", ["Computer"], None, "G3@A.LOCAL", "A.LOCAL"),
+)
+
+
+def _closure(max_depth=None, edges=EDGES):
+    closure = membership.MembershipClosure(max_depth)
+    for edge in edges:
+        closure.add(*edge)
+    return closure
+
+
+def _expand(closure, start, max_depth=None):
+    """Work out a principal's groups with a plain breadth-first search, for comparison."""
+    depths = {start: 0}
+    queue = deque([start])
+    while queue:
+        current = queue.popleft()
+        if max_depth is not None and depths[current] >= max_depth:
+            continue
+        for group in closure.direct_groups.get(current, ()):
+            if group not in depths:
+                depths[group] = depths[current] + 1
+                queue.append(group)
+    del depths[start]
+    return set(depths)
+
+
+def test_nested_groups():
+    closure = _closure()
+    assert closure.groups_of("u1@a.local") == {"G1@A.LOCAL", "G2@A.LOCAL", "G3@A.LOCAL",
+                                               "G4@B.LOCAL"}
+    assert closure.members_of("G1@A.LOCAL") == {"U1@A.LOCAL"}
+    assert closure.members_of("G3@A.LOCAL", "User") == {"U1@A.LOCAL"}
+    assert closure.members_of("G3@A.LOCAL", "Computer") == {"C1.A.LOCAL"}
+
+
+def test_nesting_cycle_shares_a_closure_without_itself():
+    closure = _closure()
+    assert closure.groups_of("G2@A.LOCAL") == {"G3@A.LOCAL", "G4@B.LOCAL"}
+    assert closure.groups_of("G3@A.LOCAL") == {"G2@A.LOCAL", "G4@B.LOCAL"}
+    assert closure.groups_of("G4@B.LOCAL") == {"G2@A.LOCAL", "G3@A.LOCAL"}
+
+
+@pytest.mark.parametrize("max_depth, expected", [
+    (1, {"G1@A.LOCAL"}),
+    (2, {"G1@A.LOCAL", "G2@A.LOCAL"}),
+    (10, {"G1@A.LOCAL", "G2@A.LOCAL", "G3@A.LOCAL", "G4@B.LOCAL"}),
+])
+def test_depth_cap(max_depth, expected):
+    assert _closure(max_depth).groups_of("U1@A.LOCAL") == expected
+
+
+@pytest.mark.parametrize("max_depth", [None, 1, 2])
+def test_closure_matches_a_plain_search(graph, max_depth):
+    closure = membership.get_closure(graph, max_depth)
+    principals = sorted(closure.direct_groups)
+    assert len(principals) > 100
+    # Asking in reverse order checks that the shared memo gives the same answers whichever
+    # principal is expanded first
+    for principal in reversed(principals):
+        assert closure.groups_of(principal) == _expand(closure, principal, max_depth)
+    for group in sorted(closure.direct_members)[:50]:
+        members = closure.members_of(group)
+        assert members == set(principal for principal in principals
+                              if group in closure.groups_of(principal))
+
+
+def test_closure_is_shared_per_connection(graph):
+    assert membership.get_closure(graph) is membership.get_closure(graph)
+    assert membership.get_closure(graph, 1) is not membership.get_closure(graph)
+    membership.clear_cache()
+    assert membership.get_closure(graph) is not None
+
+
+def test_foreign_memberships():
+    foreign = membership.ForeignMembership(_closure())
+    assert foreign.memberships("A.LOCAL", "User") == {"U1@A.LOCAL": [("G4@B.LOCAL", False)]}
+    assert foreign.memberships("A.LOCAL", "Group") == {
+        "G1@A.LOCAL": [("G4@B.LOCAL", False)],
+        "G2@A.LOCAL": [("G4@B.LOCAL", False)],
+        "G3@A.LOCAL": [("G4@B.LOCAL", True)],
+    }
+    assert foreign.memberships("B.LOCAL") == {"G4@B.LOCAL": [("G2@A.LOCAL", True),
+                                                             ("G3@A.LOCAL", False)]}
+    assert foreign.by_domain("a.local") == [("B.LOCAL", 1, 3, 0)]
+
+
+def test_domain_falls_back_to_the_name():
+    foreign = membership.ForeignMembership(_closure())
+    # C1 has no domain property and no @ in its name, so it has no domain to compare
+    assert "C1.A.LOCAL" not in foreign.memberships("A.LOCAL")
+    closure = _closure(edges=(("U2@B.LOCAL", ["User"], None, "G1@A.LOCAL", "A.LOCAL"),))
+    assert membership.ForeignMembership(closure).memberships("B.LOCAL") == {
+        "U2@B.LOCAL": [("G1@A.LOCAL", True)]}
+
+
+def test_foreign_memberships_match_a_plain_search(graph):
+    closure = membership.get_closure(graph)
+    user_metrics = users.UserMetrics(graph)
+    group_metrics = groups.GroupMetrics(graph)
+    found = 0
+    for domain in ("CORP.LOCAL", "CORP1.LOCAL"):
+        expected = {"User": {}, "Group": {}}
+        for principal in closure.direct_groups:
+            label = closure.labels.get(principal)
+            if closure.domains.get(principal) != domain or label not in expected:
+                continue
+            pairs = sorted((group, group in closure.direct_groups[principal])
+                           for group in _expand(closure, principal)
+                           if closure.domains.get(group) != domain)
+            if pairs:
+                expected[label][principal] = pairs
+        assert user_metrics.find_foreign_group_membership(domain) == expected["User"]
+        assert group_metrics.find_foreign_group_membership(domain) == expected["Group"]
+        found += len(expected["User"]) + len(expected["Group"])
+    assert found
@@ -0,0 +1,116 @@
+"""Tests for the plan regression check, run against plans stored from an EXPLAIN of the
+fixture instead of a live database.
+"""
+
+import json
+import os
+from types import SimpleNamespace
+
+from lib import plans
+
+PLANS_FILE = os.path.join(os.path.dirname(__file__), "data", "plan_reports.json")
+
+
+def _plan(stored):
+    """Turn a stored plan into an object shaped like the driver's plan summary."""
+    return SimpleNamespace(operator_type=stored["operator_type"],
+                           arguments=stored.get("arguments", {}),
+                           children=[_plan(child) for child in stored.get("children", [])])
+
+
+def _reports(changes=None):
+    """Return PlanReports for the stored plans, replacing any named in changes."""
+    with open(PLANS_FILE) as plans_file:
+        stored = json.load(plans_file)
+    stored.update(changes or {})
+    return dict((name, plans.PlanReport(name, _plan(plan))) for name, plan in stored.items())
+
+
+def _baseline(tmp_path, reports):
+    path = str(tmp_path / "plan_baseline.json")
+    plans.write_baseline(reports, path)
+    return plans.read_baseline(path)
+
+
+def _seek(rows, operator="NodeIndexSeek@neo4j"):
+    return {"operator_type": "ProduceResults@neo4j", "arguments": {"EstimatedRows": rows},
+            "children": [{"operator_type": operator, "arguments": {"EstimatedRows": rows}}]}
+
+
+def test_stored_plans_are_read():
+    reports = _reports()
+    assert reports["users.total_users"].operators == ["ProduceResults", "EagerAggregation",
+                                                      "NodeIndexSeek"]
+    assert reports["users.total_users"].estimated_rows == 552
+    assert reports["snapshot.nodes"].flagged == ["AllNodesScan"]
+
+
+def test_expected_scans_are_not_regressions():
+    assert plans.find_regressions(_reports()) == []
+
+
+def test_unchanged_plans_match_their_baseline(tmp_path):
+    reports = _reports()
+    assert plans.find_regressions(reports, _baseline(tmp_path, reports)) == []
+
+
+def test_baseline_keeps_rows_and_operators(tmp_path):
+    baseline = _baseline(tmp_path, _reports())
+    assert baseline["sessions.edges"] == {"estimated_rows": 1250,
+                                          "operators": ["Expand(All)", "NodeIndexSeek",
+                                                        "ProduceResults"]}
+
+
+def test_growth_within_tolerance_passes(tmp_path):
+    baseline = _baseline(tmp_path, {"users.total_users": _reports()["users.total_users"]})
+    reports = {"users.total_users": plans.PlanReport("users.total_users", _plan(_seek(330)))}
+    assert plans.find_regressions(reports, baseline) == []
+
+
+def test_row_growth_is_a_regression(tmp_path):
+    baseline = _baseline(tmp_path, _reports())
+    reports = _reports({"sessions.edges": {
+        "operator_type": "ProduceResults@neo4j",
+        "arguments": {"EstimatedRows": 400.0},
+        "children": [{"operator_type": "Expand(All)@neo4j",
+                      "arguments": {"EstimatedRows": 400.0},
+                      "children": [{"operator_type": "NodeByLabelScan@neo4j",
+                                    "arguments": {"EstimatedRows": 2000.0}}]}],
+    }})
+    assert plans.find_regressions(reports, baseline) == [
+        ("sessions.edges", "estimates 2800 rows, up from 1250 (new operators: NodeByLabelScan)"),
+    ]
+
+
+def test_flagged_operator_is_a_regression(tmp_path):
+    baseline = _baseline(tmp_path, _reports())
+    reports = _reports({"users.total_users": _seek(1, "CartesianProduct@neo4j")})
+    assert plans.find_regressions(reports, baseline) == [
+        ("users.total_users", "plan contains CartesianProduct"),
+    ]
+
+
+def test_label_scan_under_a_filter_is_flagged():
+    plan = {"operator_type": "Filter@neo4j", "arguments": {"EstimatedRows": 5.0},
+            "children": [{"operator_type": "NodeByLabelScan@neo4j",
+                          "arguments": {"EstimatedRows": 500.0}}]}
+    reports = _reports({"users.total_users": plan})
+    assert plans.find_regressions(reports) == [
+        ("users.total_users", "plan contains NodeByLabelScan + Filter"),
+    ]
+
+
+def test_missing_baseline_and_planning_errors_are_reported(tmp_path):
+    baseline = _baseline(tmp_path, _reports())
+    reports = _reports({"users.spn_users": _seek(10)})
+    reports["paths.inbound"] = plans.PlanReport("paths.inbound", error="Invalid input")
+    assert plans.find_regressions(reports, baseline) == [
+        ("paths.inbound", "could not be planned: Invalid input"),
+        ("users.spn_users", "has no baseline -- record one with --update-baseline"),
+    ]
+
+
+def test_baseline_from_another_version_is_ignored(tmp_path):
+    path = tmp_path / "plan_baseline.json"
+    path.write_text(json.dumps({"version": plans.BASELINE_VERSION + 1, "queries": {}}))
+    assert plans.read_baseline(str(path)) is None
@@ -0,0 +1,114 @@
+"""Tests for the timing history behind the report's progress estimates."""
+
+import json
+
+import pytest
+
+from lib import progress
+
+TASKS = [
+    ("A.LOCAL", "summary", None, (), None),
+    ("A.LOCAL", "path_stats", None, (), None),
+    ("B.LOCAL", "summary", None, (), None),
+    ("B.LOCAL", "path_stats", None, (), None),
+]
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    """The default history path, moved under a temporary cache directory."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    return str(tmp_path / "fox" / progress.HISTORY_FILE)
+
+
+def test_running_average(path):
+    history = progress.TimingHistory("bolt://localhost:7687", path)
+    assert history.expected("summary") is None
+    history.record("summary", 10.0)
+    assert history.expected("summary") == 10.0
+    history.record("summary", 20.0)
+    assert history.expected("summary") == 10.0 + progress.SMOOTHING * 10.0
+
+
+def test_saved_per_dataset(path):
+    first = progress.TimingHistory("bolt://localhost:7687", path)
+    first.record("summary", 4.0)
+    first.save()
+    second = progress.TimingHistory("/data/engagement.zip", path)
+    assert second.expected("summary") is None
+    second.record("summary", 8.0)
+    second.save()
+
+    assert progress.TimingHistory("bolt://localhost:7687", path).expected("summary") == 4.0
+    assert progress.TimingHistory("/data/engagement.zip", path).expected("summary") == 8.0
+
+
+@pytest.mark.parametrize("contents", ["not json", "[1, 2]", '"text"'])
+def test_unreadable_history_starts_over(path, contents):
+    history = progress.TimingHistory("bolt://localhost:7687", path)
+    history.save()
+    with open(path, "w") as history_file:
+        history_file.write(contents)
+    history = progress.TimingHistory("bolt://localhost:7687", path)
+    assert history.timings == {}
+    history.record("summary", 1.0)
+    history.save()
+    assert progress.TimingHistory("bolt://localhost:7687", path).expected("summary") == 1.0
+
+
+def test_broken_entry_keeps_other_datasets(path):
+    history = progress.TimingHistory("/data/engagement.zip", path)
+    history.record("summary", 8.0)
+    history.save()
+    with open(path) as history_file:
+        sources = json.load(history_file)
+    sources["bolt://localhost:7687"] = {"summary": "slow"}
+    with open(path, "w") as history_file:
+        json.dump(sources, history_file)
+
+    history = progress.TimingHistory("bolt://localhost:7687", path)
+    assert history.timings == {}
+    history.record("summary", 2.0)
+    history.save()
+    assert progress.TimingHistory("/data/engagement.zip", path).expected("summary") == 8.0
+    assert progress.TimingHistory("bolt://localhost:7687", path).expected("summary") == 2.0
+
+
+def test_unwritable_history_is_skipped(tmp_path, capsys):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    history = progress.TimingHistory("bolt://localhost:7687", str(blocker / "timings.json"))
+    history.record("summary", 1.0)
+    history.save()
+    assert "Could not save the query timings" in capsys.readouterr().err
+
+
+def test_estimate_uses_the_history(path):
+    history = progress.TimingHistory("bolt://localhost:7687", path)
+    history.record("summary", 2.0)
+    history.record("path_stats", 30.0)
+    history.save()
+
+    run = progress.ReportProgress(["a.local", "b.local"], TASKS, workers=2,
+                                  source="bolt://localhost:7687")
+    assert run.estimate() == pytest.approx((2.0 + 30.0) * 2 / 2)
+    run.remaining.discard(("A.LOCAL", "path_stats"))
+    assert run.estimate() == pytest.approx((2.0 * 2 + 30.0) / 2)
+    run.remaining.clear()
+    assert run.estimate() is None
+
+
+def test_no_estimate_without_history(path):
+    run = progress.ReportProgress(["a.local"], TASKS[:2], source="/data/new.zip")
+    assert run.estimate() is None
+
+
+@pytest.mark.parametrize("seconds, expected", [
+    (0, "0:00"),
+    (59.6, "1:00"),
+    (754, "12:34"),
+    (3600, "1:00:00"),
+    (86399, "23:59:59"),
+])
+def test_format_duration(seconds, expected):
+    assert progress.format_duration(seconds) == expected
@@ -0,0 +1,102 @@
+"""Tests for the privileged session analyzer."""
+
+from lib import domains, helpers, membership, sessions
+
+TIER0 = dict(sessions.DEFAULT_TIER0_GROUPS, **{"TIER0 OPS@A.LOCAL": 2})
+
+MEMBERSHIPS = (
+    ("EA@A.LOCAL", ["User"], "A.LOCAL", "ENTERPRISE ADMINS@A.LOCAL", "A.LOCAL"),
+    ("EA@A.LOCAL", ["User"], "A.LOCAL", "DOMAIN ADMINS@A.LOCAL", "A.LOCAL"),
+    ("DA@A.LOCAL", ["User"], "A.LOCAL", "DOMAIN ADMINS@A.LOCAL", "A.LOCAL"),
+    ("OPS@A.LOCAL", ["User"], "A.LOCAL", "TIER0 OPS@A.LOCAL", "A.LOCAL"),
+    ("NESTED@A.LOCAL", ["User"], "A.LOCAL", "IT ADMINS@A.LOCAL", "A.LOCAL"),
+    ("IT ADMINS@A.LOCAL", ["Group"], "A.LOCAL", "ADMINISTRATORS@A.LOCAL", "A.LOCAL"),
+    ("BDA@B.LOCAL", ["User"], "B.LOCAL", "DOMAIN ADMINS@B.LOCAL", "B.LOCAL"),
+    ("STAFF@A.LOCAL", ["User"], "A.LOCAL", "DOMAIN USERS@A.LOCAL", "A.LOCAL"),
+    ("DC1.A.LOCAL", ["Computer"], "A.LOCAL", "DOMAIN CONTROLLERS@A.LOCAL", "A.LOCAL"),
+)
+
+SESSIONS = (
+    ("DC1.A.LOCAL", "A.LOCAL", "DA@A.LOCAL"),
+    ("ws1.a.local", "A.LOCAL", "da@a.local"),
+    ("WS2.A.LOCAL", "A.LOCAL", "EA@A.LOCAL"),
+    ("WS2.A.LOCAL", "A.LOCAL", "OPS@A.LOCAL"),
+    ("WS3.A.LOCAL", "A.LOCAL", "STAFF@A.LOCAL"),
+    ("WS4.A.LOCAL", "A.LOCAL", "NESTED@A.LOCAL"),
+    ("WS5.A.LOCAL", "A.LOCAL", "DA@A.LOCAL"),
+    ("WS5.A.LOCAL", "A.LOCAL", "OPS@A.LOCAL"),
+    ("WS1.B.LOCAL", "B.LOCAL", "BDA@B.LOCAL"),
+    (None, None, "DA@A.LOCAL"),
+)
+
+
+def _analyzer():
+    closure = membership.MembershipClosure()
+    for edge in MEMBERSHIPS:
+        closure.add(*edge)
+    return sessions.SessionAnalyzer(closure, TIER0).sweep(SESSIONS)
+
+
+def test_tier0_principals():
+    analyzer = _analyzer()
+    assert analyzer.tier0 == {
+        "EA@A.LOCAL": (3, "ENTERPRISE ADMINS@A.LOCAL"),
+        "DA@A.LOCAL": (2, "DOMAIN ADMINS@A.LOCAL"),
+        "OPS@A.LOCAL": (2, "TIER0 OPS@A.LOCAL"),
+        "NESTED@A.LOCAL": (1, "ADMINISTRATORS@A.LOCAL"),
+        "BDA@B.LOCAL": (2, "DOMAIN ADMINS@B.LOCAL"),
+    }
+    assert analyzer.controllers == {"DC1.A.LOCAL"}
+
+
+def test_sweep_skips_controllers_and_other_users():
+    analyzer = _analyzer()
+    assert analyzer.sessions == len(SESSIONS)
+    assert sorted(analyzer.computers) == ["WS1.A.LOCAL", "WS1.B.LOCAL", "WS2.A.LOCAL",
+                                          "WS4.A.LOCAL", "WS5.A.LOCAL"]
+
+
+def test_ranking():
+    ranked = _analyzer().ranked("a.local")
+    assert [exposure.computer for exposure in ranked] == ["WS2.A.LOCAL", "WS5.A.LOCAL",
+                                                          "WS1.A.LOCAL", "WS4.A.LOCAL"]
+    assert ranked[0].group() == "ENTERPRISE ADMINS@A.LOCAL"
+    assert ranked[0].rank() == (3, 2, 5)
+    assert [exposure.computer for exposure in _analyzer().ranked("B.LOCAL")] == ["WS1.B.LOCAL"]
+
+
+def test_computers_with_any_membership_of_the_group():
+    analyzer = _analyzer()
+    # EA is also a Domain Admin, even though Enterprise Admins is the group it is ranked by
+    assert analyzer.computers_with("domain admins@a.local") == ["WS1.A.LOCAL", "WS2.A.LOCAL",
+                                                                "WS5.A.LOCAL"]
+    assert analyzer.computers_with("DOMAIN ADMINS@B.LOCAL") == ["WS1.B.LOCAL"]
+
+
+def test_tier0_groups_from_the_config(monkeypatch):
+    def section(name, required=True, raw=False):
+        assert name == "Tier0" and not required
+        return {"backup operators": "1", "Tier0 Ops@A.LOCAL": "2", "helpdesk": "high"}
+
+    monkeypatch.setattr(helpers, "config_section_map", section)
+    groups = sessions.load_tier0_groups()
+    assert groups == dict(sessions.DEFAULT_TIER0_GROUPS,
+                          **{"BACKUP OPERATORS": 1, "TIER0 OPS@A.LOCAL": 2})
+
+
+def test_domain_admin_sessions_match_a_plain_search(graph):
+    closure = membership.get_closure(graph)
+    metrics = domains.DomainData(graph)
+    found = 0
+    for domain in ("CORP.LOCAL", "CORP1.LOCAL"):
+        admins = closure.members_of("DOMAIN ADMINS@" + domain, "User")
+        controllers = set()
+        for group in closure.direct_members:
+            if group.startswith("DOMAIN CONTROLLERS@"):
+                controllers.update(closure.members_of(group, "Computer"))
+        expected = sorted(set(computer.upper() for computer, _, user
+                              in graph.stream("sessions.edges")
+                              if user.upper() in admins and computer.upper() not in controllers))
+        assert metrics.get_systems_with_da(domain) == expected
+        found += len(expected)
+    assert found
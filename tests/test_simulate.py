@@ -0,0 +1,104 @@
+"""Tests for the simulate command's incremental path updates."""
+
+from collections import deque
+
+import pytest
+
+from lib import paths, simulate
+
+DOMAIN = "CORP.LOCAL"
+TARGET = "DOMAIN ADMINS@CORP.LOCAL"
+
+
+@pytest.fixture
+def simulation(graph):
+    return simulate.Simulation(paths.reverse_bfs(graph, DOMAIN, TARGET))
+
+
+def _shortest_paths(simulation):
+    """Recompute every distance from scratch over the simulation's remaining relationships."""
+    distances = {simulation.target: 0}
+    queue = deque([simulation.target])
+    while queue:
+        node = queue.popleft()
+        for _, other in simulation.inbound[node]:
+            if other not in distances:
+                distances[other] = distances[node] + 1
+                queue.append(other)
+    return dict((node, hops) for node, hops in distances.items()
+                if node in simulation.details or node == simulation.target)
+
+
+def _state(simulation):
+    return (dict(simulation.distances), dict(simulation.support),
+            dict((label, list(total)) for label, total in simulation.totals.items()
+                 if total[0]))
+
+
+def _candidates(simulation):
+    """Disable every principal with a path, and remove each of its group memberships."""
+    candidates = []
+    for node, hops in sorted(simulation.distances.items()):
+        if not hops or not simulation.names.get(node):
+            continue
+        name = simulation.names[node]
+        candidates.append([simulate.parse_change("disable %s" % name)])
+        for rel_type, other in sorted(simulation.outbound[node]):
+            if rel_type == "MemberOf":
+                candidates.append([simulate.parse_change("remove-member %s -> %s"
+                                                         % (name, simulation.names[other]))])
+    return candidates
+
+
+def test_fixture_has_paths_to_break(simulation):
+    assert simulation.count("User") > 0
+    changed = 0
+    for changes in _candidates(simulation):
+        undo = simulation.apply(changes)
+        changed += bool(undo["distances"])
+        simulation.revert(undo)
+    assert changed
+
+
+def test_apply_matches_a_fresh_search(simulation):
+    for changes in _candidates(simulation):
+        undo = simulation.apply(changes)
+        assert simulation.distances == _shortest_paths(simulation), str(changes[0])
+        simulation.revert(undo)
+
+
+def test_revert_restores_the_original_distances(simulation):
+    original = _state(simulation)
+    for changes in _candidates(simulation):
+        simulation.revert(simulation.apply(changes))
+        assert _state(simulation) == original, str(changes[0])
+
+
+def test_combined_changes_revert(simulation):
+    original = _state(simulation)
+    changes = [change for candidate in _candidates(simulation) for change in candidate]
+    undo = simulation.apply(changes)
+    assert simulation.distances == _shortest_paths(simulation)
+    simulation.revert(undo)
+    assert _state(simulation) == original
+
+
+def test_evaluate_leaves_the_simulation_unchanged(simulation):
+    original = _state(simulation)
+    before = simulation.count("User"), simulation.average(), simulation.count("Computer")
+    for changes in _candidates(simulation):
+        users, _, computers = simulation.evaluate(changes)
+        assert users <= before[0] and computers <= before[2]
+    assert _state(simulation) == original
+
+
+def test_unknown_names_change_nothing(simulation):
+    original = _state(simulation)
+    undo = simulation.apply([simulate.parse_change("disable NOBODY@CORP.LOCAL")])
+    assert undo["edges"] == []
+    assert _state(simulation) == original
+
+
+def test_parse_change_rejects_unknown_kinds():
+    with pytest.raises(ValueError):
+        simulate.parse_change("delete DOMAIN ADMINS@CORP.LOCAL")
@@ -0,0 +1,58 @@
+"""Tests that the vectorized metrics match the query-based metrics they replace, with the
+offline backend answering the queries.
+"""
+
+import pytest
+
+from lib import domains, groups, users, vectorized
+
+pytest.importorskip("numpy")
+
+DOMAINS = ("CORP.LOCAL", "CORP1.LOCAL")
+
+
+def _metrics(graph, dataset, max_depth=None):
+    return (domains.DomainData(graph, max_depth), groups.GroupMetrics(graph, max_depth),
+            users.UserMetrics(graph, max_depth, dataset.now),
+            vectorized.VectorMetrics(graph, max_depth, dataset.now))
+
+
+@pytest.mark.parametrize("domain", DOMAINS)
+def test_domain_summary(graph, dataset, domain):
+    domain_metrics, _, _, vector_metrics = _metrics(graph, dataset)
+    expected = vars(domain_metrics.get_domain_summary(domain))
+    assert expected["total_users"] > 0
+    assert vars(vector_metrics.get_domain_summary(domain)) == expected
+
+
+@pytest.mark.parametrize("max_depth", [None, 1])
+@pytest.mark.parametrize("recursive", [False, True])
+@pytest.mark.parametrize("domain", DOMAINS)
+def test_avg_group_membership(graph, dataset, domain, recursive, max_depth):
+    _, group_metrics, _, vector_metrics = _metrics(graph, dataset, max_depth)
+    expected = group_metrics.get_avg_group_membership(domain, recursive)
+    assert expected is not None
+    assert vector_metrics.get_avg_group_membership(domain, recursive) == \
+        pytest.approx(expected)
+
+
+def test_nesting_adds_memberships(graph, dataset):
+    _, _, _, vector_metrics = _metrics(graph, dataset)
+    assert vector_metrics.get_avg_group_membership("CORP.LOCAL", True) > \
+        vector_metrics.get_avg_group_membership("CORP.LOCAL")
+
+
+@pytest.mark.parametrize("thresholds", [(6,), (1, 6, 12)])
+@pytest.mark.parametrize("domain", DOMAINS)
+def test_password_ages(graph, dataset, domain, thresholds):
+    _, _, user_metrics, vector_metrics = _metrics(graph, dataset)
+    expected = vars(user_metrics.get_password_ages(domain, thresholds))
+    assert any(sum(counts) for counts in expected["histogram"].values())
+    assert vars(vector_metrics.get_password_ages(domain, thresholds)) == expected
+
+
+def test_unknown_domain(graph, dataset):
+    _, group_metrics, _, vector_metrics = _metrics(graph, dataset)
+    assert vector_metrics.get_avg_group_membership("NOWHERE.LOCAL") is None
+    assert group_metrics.get_avg_group_membership("NOWHERE.LOCAL") is None
+    assert vars(vector_metrics.get_domain_summary("NOWHERE.LOCAL"))["total_users"] == 0